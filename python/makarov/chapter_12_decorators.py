@@ -16,14 +16,36 @@
 # функции в качестве аргумента.
 
 # +
+# глава-блокнот длиннее 1000 строк из-за примеров, сами декораторы
+# вынесены в decorator_tools
+# pylint: disable=too-many-lines
+import asyncio
 import functools
+import inspect
+import itertools
+import os
+import tempfile
 import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
 
 # Можно также воспользоваться функцией functools.update_wrapper().
 from functools import update_wrapper
 
 # Присвоение функции переменной
-from typing import Callable, ParamSpec, TypeVar
+from typing import AsyncGenerator, Callable, ParamSpec, TypeVar
+
+import numpy as np
+import numpy.typing as npt
+from decorator_tools.asynchronous import limit_concurrency, repeat_async, run_coroutine
+from decorator_tools.batching import autobatch
+from decorator_tools.bench import benchmark
+from decorator_tools.call_log import flush_logs, log_calls, logging_decorator
+from decorator_tools.disk_memo import persistent_memoize
+from decorator_tools.memo import LFUPolicy, TTLPolicy, memoize
+from decorator_tools.processes import run_in_process
+from decorator_tools.slots import auto_slots, instance_bytes
+from decorator_tools.timing import TIMINGS, timer_decorator
 
 
 def say_hello(name: str) -> None:
@@ -455,61 +477,59 @@ print(power.__doc__)
 # Примеры декораторов
 # Декоратор можно использовать для выведения (и записи)
 # информации о вызове функции (логирования).
+#
+# logging_decorator и log_calls() из decorator_tools.call_log отдают
+# строки лога фоновому потоку и понимают асинхронные функции.
 
 
-ParamLogVar = ParamSpec("ParamLogVar")
-ReturnLog = TypeVar("ReturnLog")  # Для возвращаемого значения
-
-
-def logging_decorator(
-    func: Callable[ParamLogVar, ReturnLog],
-) -> Callable[ParamLogVar, ReturnLog]:
-    """Decorate function for logging function calls."""
-
-    @functools.wraps(func)
-    def wrapper(*args: ParamLogVar.args, **kwargs: ParamLogVar.kwargs) -> ReturnLog:
-        """Execute wrapped function."""
-        print(f"Calling {func.__name__} with args: {args}, kwargs: {kwargs}")
-        result_log = func(*args, **kwargs)
-        print(f"{func.__name__} returned: {result_log}")
-        return result_log
-
-    return wrapper
-
-
-# +
 @logging_decorator
 def power_logged(base: int, exponent: int) -> int:
     """Calculate power."""
     return int(base**exponent)
 
 
-print(power_logged(5, 3))
+# строка лога печатается в фоне, дождемся ее перед выводом результата
+power_result = power_logged(5, 3)
+flush_logs()
+print(power_result)
 
 # +
-ParamTimeVar = ParamSpec("ParamTimeVar")
-ReturnTimeLog = TypeVar("ReturnTimeLog")
+# С specialize=True обертку с той же сигнатурой, что у функции, собирает
+# specialize_wrapper() из decorator_tools.codegen: аргументы не
+# упаковываются в *args, **kwargs, а в лог попадают так, как их передали.
 
 
-def timer_decorator(
-    func: Callable[ParamTimeVar, ReturnTimeLog],
-) -> Callable[ParamTimeVar, ReturnTimeLog]:
-    """Decorate timer."""
+@logging_decorator(specialize=True)
+def scale_logged(value: float, factor: float = 2.0, *, offset: float = 0.0) -> float:
+    """Scale and shift a value."""
+    return value * factor + offset
 
-    @functools.wraps(func)
-    def wrapper(
-        *args: ParamTimeVar.args, **kwargs: ParamTimeVar.kwargs
-    ) -> ReturnTimeLog:
-        start_time = time.time()
-        result_time: ReturnTimeLog = func(*args, **kwargs)
-        end_time = time.time()
-        print(f"{func.__name__} executed in {end_time - start_time:.4f} seconds")
-        return result_time
 
-    return wrapper
+scale_logged(3)
+scale_logged(3, offset=1.0)
+flush_logs()
+
+# +
+# Длинные аргументы сокращаются, в лог попадает каждый десятый вызов.
+
+
+@log_calls(sample_every=10, max_repr=20)
+def count_letters(text: str) -> int:
+    """Count letters in a text."""
+    return sum(letter.isalpha() for letter in text)
 
 
+for _ in range(30):
+    count_letters("Декораторы расширяют функциональность функций. " * 10)
+flush_logs()
+
 # +
+# Декоратор-таймер
+# timer_decorator из decorator_tools.timing ничего не печатает, а копит
+# в общем реестре TIMINGS число вызовов, суммарное время и гистограмму
+# задержек, измеренных монотонным time.perf_counter_ns().
+
+
 @timer_decorator
 def delayed_function(timer: float) -> str:
     """Delay function."""
@@ -519,6 +539,15 @@ def delayed_function(timer: float) -> str:
 
 delayed_function(2)
 
+# +
+# Статистику запрашивают у реестра: в виде словаря, JSON или текста
+# для Prometheus.
+
+delayed_function(0.01)
+delayed_function_stats = TIMINGS.stats(delayed_function)
+print(delayed_function_stats["count"], delayed_function_stats["p50_ns"] / 1e9)
+print(TIMINGS.to_prometheus())
+
 # +
 # Типы методов
 # Методы экземпляра
@@ -649,13 +678,18 @@ class CatClassDecorated:
 
 
 # +
+# Создание экземпляра - вызов декорированного класса, и реестр
+# таймера записывает его.
+
 cat_decorated = CatClassDecorated("gray")
+print(TIMINGS.stats(CatClassDecorated)["count"])
 
-# Как мы видим, декоратор «сработал» только при создании
-# экземпляра класса.
-# -
+# +
+# А вызов метода info() реестр не пополняет. Как мы видим, декоратор
+# «сработал» только при создании экземпляра класса.
 
 cat_decorated.info()
+print(TIMINGS.stats(CatClassDecorated)["count"])
 
 # +
 # Теперь рассмотрим функцию setattr(), которая позволяет
@@ -705,6 +739,79 @@ class CatClassWithAttribute:
         self.type_ = "cat"
 
 
+# +
+# Декоратор класса может и пересоздать класс. @auto_slots из
+# decorator_tools.slots находит в методах присваивания self.x = ... и
+# создает класс заново со __slots__ из этих имен: атрибуты хранятся в
+# фиксированных ячейках вместо словаря __dict__, а новые появиться не
+# могут. CatClass не меняется: auto_slots() возвращает новый класс.
+
+CatSlotted = auto_slots(CatClass)
+CatStaticSlotted = auto_slots(CatClassWithStatic)
+print(vars(CatSlotted)["__slots__"], vars(CatStaticSlotted)["__slots__"])
+
+slotted_cat = CatStaticSlotted("gray")
+slotted_cat.info()
+slotted_cat.convert_to_pounds(5)
+try:
+    setattr(slotted_cat, "weight", 5)
+except AttributeError as error:
+    print(error)
+
+# +
+# Иерархия классов: у потомка в __slots__ только новые атрибуты,
+# а super() внутри методов продолжает работать.
+
+
+@auto_slots
+class AnimalRecord:
+    """Animal with weight and length."""
+
+    def __init__(self, weight: float, length: float) -> None:
+        """Initialize animal instance."""
+        self.weight = weight
+        self.length = length
+
+
+@auto_slots
+class BirdRecord(AnimalRecord):
+    """Bird with flying speed."""
+
+    def __init__(self, weight: float, length: float, flying_speed: float) -> None:
+        """Initialize bird instance."""
+        super().__init__(weight, length)
+        self.flying_speed = flying_speed
+
+
+pigeon = BirdRecord(0.3, 30, 80)
+print(vars(AnimalRecord)["__slots__"], vars(BirdRecord)["__slots__"])
+print(pigeon.weight, pigeon.flying_speed)
+
+# +
+# Сравним, сколько памяти занимает экземпляр с __dict__ и с __slots__.
+# instance_bytes() считает через tracemalloc все выделенные блоки
+# памяти, поэтому замер включает и словарь атрибутов, и 8 байт ссылки
+# в списке.
+#
+# На Python 3.11 и новее выходит около 96 Б против 56 Б, то есть
+# экономия около 40%, а не больше половины. Начиная с 3.11 обычный
+# экземпляр тоже не создает словарь атрибутов, пока к __dict__ не
+# обратились: значения лежат в компактном массиве, а имена хранит
+# класс. До 3.11 словарь создавался сразу, и __slots__ экономили
+# больше половины памяти.
+
+
+for plain_class, slotted_class in (
+    (CatClass, CatSlotted),
+    (CatClassWithStatic, CatStaticSlotted),
+):
+    plain_bytes = instance_bytes(plain_class, "gray")
+    slotted_bytes = instance_bytes(slotted_class, "gray")
+    print(
+        f"{plain_class.__name__}: {plain_bytes:.0f} B -> {slotted_bytes:.0f} B,"
+        f" {1 - slotted_bytes / plain_bytes:.0%} less"
+    )
+
 # +
 # Несколько декораторов
 # Ничто не мешает использовать несколько декораторов.
@@ -720,7 +827,9 @@ def delayed_function_decorated(delay_time: float) -> str:
 
 # -
 
-print(delayed_function_decorated(2))
+delayed_result = delayed_function_decorated(2)
+flush_logs()
+print(delayed_result)
 
 # +
 # Вместо синтаксического сахара можно записать функцию в
@@ -738,7 +847,9 @@ def delayed_function_manual(delay_time: float) -> str:
 # -
 
 delayed_function_manual = logging_decorator(timer_decorator(delayed_function_manual))
-print(delayed_function_manual(2))
+delayed_result = delayed_function_manual(2)
+flush_logs()
+print(delayed_result)
 
 # +
 # Декораторы с аргументами
@@ -764,6 +875,9 @@ def repeat(
         func: Callable[ParamRepeatVar, ReturnRepeatLog],
     ) -> Callable[ParamRepeatVar, ReturnRepeatLog]:
         """Inner decorator function."""
+        async_wrapper = repeat_async(func, n_times)
+        if async_wrapper is not None:
+            return async_wrapper
 
         @functools.wraps(func)
         def wrapper(
@@ -789,3 +903,288 @@ def say_hello_repeated(name: str) -> None:
 
 
 say_hello_repeated("Алексей")
+
+# +
+# Кэширование результатов (мемоизация)
+# Декоратор @memoize из decorator_tools.memo запоминает результаты
+# функции по содержимому аргументов. Когда кэш переполнен, стратегия
+# LRUPolicy, LFUPolicy или TTLPolicy выбирает, какую запись удалить.
+# Как у functools.lru_cache, у обертки есть cache_info() и
+# cache_clear().
+
+
+@memoize(max_entries=2)
+def slow_square(number: int) -> int:
+    """Square a number slowly."""
+    time.sleep(0.1)
+    return number * number
+
+
+for argument in (2, 3, 2, 4, 2, 3):
+    print(argument, slow_square(argument))
+print(slow_square.cache_info())
+print(slow_square.__name__, slow_square.__doc__)
+
+# +
+# Размер кэша можно ограничить в байтах; LFU сохраняет частые записи.
+
+
+@memoize(max_entries=None, max_bytes=5_000, policy=LFUPolicy)
+def running_totals(numbers: list[int]) -> list[int]:
+    """Return running totals of a list."""
+    return list(itertools.accumulate(numbers))
+
+
+for list_length in (3, 3, 50, 60, 70, 3):
+    running_totals(list(range(list_length)))
+print(running_totals.cache_info())
+
+# +
+# TTL: запись живет заданное время, потом вычисляется заново.
+
+
+@memoize(policy=lambda: TTLPolicy(seconds=0.05))
+def current_minute(city: str) -> str:
+    """Return the current time in a city, as a string."""
+    return f"{city}: {time.strftime('%H:%M')}"
+
+
+current_minute("Москва")
+current_minute("Москва")
+time.sleep(0.06)
+current_minute("Москва")
+print(current_minute.cache_info())
+
+# +
+# Кэш на диске
+# @persistent_memoize из decorator_tools.disk_memo хранит результаты в
+# файле SQLite, и после перезапуска ядра они не считаются заново. Новая
+# обертка той же функции - как после перезапуска - находит результат в
+# файле. Файл лежит во временном каталоге, который удаляется при выходе.
+
+memo_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+memo_path = os.path.join(memo_dir.name, "memoize.db")
+
+
+@persistent_memoize(path=memo_path)
+def slow_power(base: int, exponent: int) -> int:
+    """Raise a number to a power slowly."""
+    time.sleep(0.2)
+    return int(base**exponent)
+
+
+for _ in range(2):
+    call_start = time.perf_counter()
+    power_value = slow_power(2, 100)
+    print(power_value, f"{time.perf_counter() - call_start:.3f} s")
+
+restarted = persistent_memoize(path=memo_path)(slow_power.__wrapped__)
+call_start = time.perf_counter()
+print(restarted(2, 100), f"{time.perf_counter() - call_start:.3f} s")
+print(restarted.cache_info())
+
+# +
+# Новая версия функции под тем же именем: результаты прежней удалены.
+
+
+@persistent_memoize(path=memo_path, name=slow_power.name)
+def fast_power(base: int, exponent: int) -> int:
+    """Raise a number to a power with the built-in pow()."""
+    return int(pow(base, exponent))
+
+
+print(fast_power.cache_info())
+print(fast_power(2, 100), fast_power.cache_info())
+
+# +
+# Микробенчмарк
+# Декоратор @benchmark из decorator_tools.bench вызывает функцию много
+# раз, как timeit: с прогревом, без сборщика мусора, с медианой,
+# квартилями и выбросами. Медиана сравнивается с сохраненной в файле
+# baseline; вторая, более медленная версия под тем же именем покажет
+# регрессию. Файл создается во временном каталоге.
+
+baseline_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+baseline_path = os.path.join(baseline_dir.name, "benchmarks.json")
+
+
+@benchmark(baseline=baseline_path)
+def sum_of_squares(limit: int) -> int:
+    """Add up the squares of numbers below limit."""
+    return sum(number * number for number in range(limit))
+
+
+print(sum_of_squares(1_000))
+
+
+@benchmark(baseline=baseline_path, name="sum_of_squares")
+def sum_of_squares_slow(limit: int) -> int:
+    """Add up the squares of numbers below limit, raising to a power."""
+    return sum([number**2 for number in range(limit)] * 4) // 4
+
+
+print(sum_of_squares_slow(1_000))
+print(sum_of_squares_slow.stats)
+
+# +
+# Асинхронные функции
+# timer_decorator, logging_decorator и repeat() понимают и async def
+# функции. run_coroutine() из decorator_tools.asynchronous запускает
+# корутину и в скрипте, и в Jupyter, где цикл событий уже запущен.
+
+
+@logging_decorator
+async def countdown(start: int) -> AsyncGenerator[int, None]:
+    """Count down to one, waiting between numbers."""
+    for number in range(start, 0, -1):
+        await asyncio.sleep(0.01)
+        yield number
+
+
+# Декоратор применен вызовом: строгий mypy запрещает декорировать
+# функции, тип которых содержит Any.
+
+
+async def greet(name: str) -> str:
+    """Greet after a pause."""
+    await asyncio.sleep(0.01)
+    return f"Привет, {name}!"
+
+
+greet_later = repeat(n_times=2)(timer_decorator(greet))
+
+
+async def greet_after_countdown() -> None:
+    """Run both examples."""
+    print([number async for number in countdown(3)])
+    print(await greet_later("Алексей"))
+
+
+run_coroutine(greet_after_countdown())
+flush_logs()
+print(TIMINGS.stats(greet)["count"])
+
+# +
+# Ограничение числа одновременных вызовов
+# @limit_concurrency(n) пропускает к асинхронной функции не больше n
+# корутин сразу. Шесть загрузок по 0,1 с по две одновременно - три волны.
+
+
+async def download(page_number: int) -> str:
+    """Pretend to download a page."""
+    await asyncio.sleep(0.1)
+    return f"страница {page_number}"
+
+
+fetch_page = limit_concurrency(2)(download)
+
+
+async def fetch_pages() -> list[str]:
+    """Download six pages concurrently."""
+    return await asyncio.gather(*(fetch_page(number) for number in range(6)))
+
+
+fetch_start = time.perf_counter()
+print(run_coroutine(fetch_pages()), f"{time.perf_counter() - fetch_start:.1f} s")
+
+# +
+# Автоматическая пакетная обработка
+# @autobatch(vectorized) из decorator_tools.batching собирает вызовы по
+# одному значению из разных потоков, из submit() и из корутин (acall())
+# в пакеты и один раз вызывает vectorized() с массивами Numpy.
+
+
+def power_vectorized(
+    bases: npt.NDArray[np.int64], exponents: npt.NDArray[np.int64]
+) -> npt.NDArray[np.int64]:
+    """Raise every base to its exponent."""
+    return np.power(bases, exponents)
+
+
+@autobatch(power_vectorized, max_batch=256)
+def power_batched(base: int, exponent: int) -> int:
+    """Raise a number to a power."""
+    return int(base**exponent)
+
+
+with ThreadPoolExecutor(8) as pool:
+    squares = list(pool.map(power_batched, range(1000), itertools.repeat(2)))
+print(squares[:5], power_batched.n_calls, power_batched.n_batches)
+
+cube_futures = [power_batched.submit(number, 3) for number in range(1000)]
+print(sum(future.result() for future in cube_futures), power_batched.n_batches)
+
+
+async def gather_squares() -> list[int]:
+    """Square numbers from a hundred coroutines."""
+    calls = (power_batched.acall(number, 2) for number in range(100))
+    return await asyncio.gather(*calls)
+
+
+print(sum(run_coroutine(gather_squares())), power_batched.n_batches)
+
+# +
+# Вычисления в другом процессе
+# Из-за GIL потоки Python не ускоряют вычисления на процессоре.
+# @run_in_process из decorator_tools.processes выполняет функцию в
+# постоянном пуле процессов, созданных через fork(), а большие массивы
+# Numpy передает через разделяемую память: в процесс уходит только имя
+# блока. Где fork() нет (Windows), функция выполняется в текущем процессе.
+
+
+Matrix = np.ndarray[tuple[int, int], np.dtype[np.float64]]
+Row = np.ndarray[tuple[int], np.dtype[np.float64]]
+
+
+@run_in_process
+def column_means(matrix: Matrix) -> Row:
+    """Average every column of a matrix."""
+    return np.asarray(matrix.mean(axis=0))
+
+
+@run_in_process
+def distance_grid(size: int) -> Matrix:
+    """Build a grid of distances from the top left corner."""
+    return np.asarray(np.fromfunction(np.hypot, (size, size)))
+
+
+random_matrix = np.random.default_rng(0).random((2_000, 500))
+print(np.allclose(column_means(random_matrix), random_matrix.mean(axis=0)))
+
+grid_futures = [distance_grid.submit(size) for size in (500, 1_000, 1_500)]
+print([future.result().shape for future in grid_futures])
+print(distance_grid(3).round(2))
+
+# +
+# Накладные расходы оберток с *args, **kwargs и с точной сигнатурой.
+# Логирующим оберткам дана такая выборка, что пишут они только первый
+# вызов: сравниваем саму обертку, а не печать.
+
+
+def add_numbers(first: int, second: int, third: int = 0) -> int:
+    """Add up two or three numbers."""
+    return first + second + third
+
+
+wrapped_versions = {
+    "timer": timer_decorator(add_numbers),
+    "timer, specialized": timer_decorator(add_numbers, specialize=True),
+    "log": log_calls(sample_every=10**9)(add_numbers),
+    "log, specialized": log_calls(sample_every=10**9, specialize=True)(add_numbers),
+}
+print(inspect.signature(wrapped_versions["timer, specialized"]))
+
+
+def call_ns(func: Callable[[int, int], int], n_calls: int = 200_000) -> float:
+    """Return the best time of one func(1, 2) call in nanoseconds."""
+    timer = timeit.Timer("func(1, 2)", globals={"func": func})
+    return min(timer.repeat(repeat=5, number=n_calls)) / n_calls * 1e9
+
+
+plain_ns = call_ns(add_numbers)
+overheads_ns = {
+    label: call_ns(wrapped) - plain_ns for label, wrapped in wrapped_versions.items()
+}
+flush_logs()
+for label, overhead_ns in overheads_ns.items():
+    print(f"{label:<20} {overhead_ns:5.0f} ns per call")
@@ -0,0 +1 @@
+"""Decorators of chapter 12, kept out of the notebook so it stays a tutorial."""
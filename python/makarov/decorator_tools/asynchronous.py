@@ -0,0 +1,179 @@
+"""Helpers for decorating and running async functions."""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    ParamSpec,
+    TypeVar,
+    cast,
+)
+
+AsyncItem = TypeVar("AsyncItem")
+
+
+async def timed_async_generator(
+    source: AsyncGenerator[AsyncItem, None],
+    done: Callable[[int, int, Exception | None], None],
+) -> AsyncGenerator[AsyncItem, None]:
+    """Yield the items of source, timing only its own steps.
+
+    When the source is exhausted, fails or is closed, done gets the
+    time in nanoseconds, the number of items and the exception raised.
+    """
+    clock = time.perf_counter_ns
+    elapsed_ns = n_items = 0
+    error: Exception | None = None
+    try:
+        while True:
+            start_time = clock()
+            try:
+                item = await anext(source)
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed_ns += clock() - start_time
+            n_items += 1
+            yield item
+    except Exception as exc:
+        error = exc
+        raise
+    finally:
+        await source.aclose()
+        done(elapsed_ns, n_items, error)
+
+
+ReturnRun = TypeVar("ReturnRun")
+
+
+def run_coroutine(main: Coroutine[object, object, ReturnRun]) -> ReturnRun:
+    """Run a coroutine to the end, also where an event loop is running.
+
+    In Jupyter the loop of the notebook is already running, so there
+    asyncio.run() is called in a thread of its own.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, main).result()
+
+
+ParamRepeat = ParamSpec("ParamRepeat")
+ReturnRepeat = TypeVar("ReturnRepeat")
+
+
+def repeat_async(
+    func: Callable[ParamRepeat, ReturnRepeat], n_times: int
+) -> Callable[ParamRepeat, ReturnRepeat] | None:
+    """Run an async function n_times, then once more; None for a plain one.
+
+    This is repeat() of the chapter for async def functions: a coroutine
+    is awaited every time, and an async generator is exhausted every
+    time but the last, which is iterated by the caller.
+    """
+    if inspect.isasyncgenfunction(func):
+
+        async def generator_wrapper(
+            *args: ParamRepeat.args, **kwargs: ParamRepeat.kwargs
+        ) -> AsyncGenerator[object, None]:
+            """Exhaust wrapped async generator, then yield from the last one."""
+            for _ in range(n_times):
+                async for _item in cast(
+                    AsyncGenerator[object, None], func(*args, **kwargs)
+                ):
+                    pass
+            async for item in cast(AsyncGenerator[object, None], func(*args, **kwargs)):
+                yield item
+
+        functools.update_wrapper(generator_wrapper, func)
+        return cast(Callable[ParamRepeat, ReturnRepeat], generator_wrapper)
+
+    if inspect.iscoroutinefunction(func):
+
+        async def coroutine_wrapper(
+            *args: ParamRepeat.args, **kwargs: ParamRepeat.kwargs
+        ) -> object:
+            """Await wrapped coroutine function."""
+            for _ in range(n_times):
+                await cast(Awaitable[object], func(*args, **kwargs))
+            return await cast(Awaitable[object], func(*args, **kwargs))
+
+        functools.update_wrapper(coroutine_wrapper, func)
+        return cast(Callable[ParamRepeat, ReturnRepeat], coroutine_wrapper)
+
+    return None
+
+
+ParamLimit = ParamSpec("ParamLimit")
+ReturnLimit = TypeVar("ReturnLimit")
+
+
+def limit_concurrency(
+    limit: int,
+) -> Callable[[Callable[ParamLimit, ReturnLimit]], Callable[ParamLimit, ReturnLimit]]:
+    """Make a decorator that lets at most limit calls run at once.
+
+    An asyncio semaphore cannot be shared between event loops, so every
+    loop gets its own on the first call made in it. An async generator
+    holds its slot while it is iterated.
+    """
+    if limit < 1:
+        raise ValueError(f"limit must be at least 1, got {limit}")
+
+    def decorator(
+        func: Callable[ParamLimit, ReturnLimit],
+    ) -> Callable[ParamLimit, ReturnLimit]:
+        """Decorate async function with a semaphore."""
+        semaphores: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = weakref.WeakKeyDictionary()
+
+        def semaphore() -> asyncio.Semaphore:
+            loop = asyncio.get_running_loop()
+            loop_semaphore = semaphores.get(loop)
+            if loop_semaphore is None:
+                loop_semaphore = semaphores[loop] = asyncio.Semaphore(limit)
+            return loop_semaphore
+
+        if inspect.isasyncgenfunction(func):
+
+            async def generator_wrapper(
+                *args: ParamLimit.args, **kwargs: ParamLimit.kwargs
+            ) -> AsyncGenerator[object, None]:
+                """Iterate wrapped async generator holding a slot."""
+                async with semaphore():
+                    generator = cast(
+                        AsyncGenerator[object, None], func(*args, **kwargs)
+                    )
+                    async with contextlib.aclosing(generator):
+                        async for item in generator:
+                            yield item
+
+            functools.update_wrapper(generator_wrapper, func)
+            return cast(Callable[ParamLimit, ReturnLimit], generator_wrapper)
+
+        if inspect.iscoroutinefunction(func):
+
+            async def coroutine_wrapper(
+                *args: ParamLimit.args, **kwargs: ParamLimit.kwargs
+            ) -> object:
+                """Await wrapped coroutine function holding a slot."""
+                async with semaphore():
+                    return await cast(Awaitable[object], func(*args, **kwargs))
+
+            functools.update_wrapper(coroutine_wrapper, func)
+            return cast(Callable[ParamLimit, ReturnLimit], coroutine_wrapper)
+
+        raise TypeError(f"{func.__qualname__} is not an async function")
+
+    return decorator
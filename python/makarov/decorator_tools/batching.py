@@ -0,0 +1,169 @@
+"""Compute concurrent calls of a scalar function in vectorized batches.
+
+Calls from different threads, or queued with submit(), are collected
+into a batch of up to max_batch calls, waiting at most max_wait seconds
+for more. A background thread then calls the vectorized function once,
+with one numpy array per parameter, and hands every caller its result
+through a Future. A batch of one call runs the scalar function, since
+making an array of a single number does not pay.
+"""
+
+import asyncio
+import functools
+import inspect
+import queue
+import time
+from concurrent.futures import Future
+from typing import (
+    Callable,
+    Generic,
+    ParamSpec,
+    Protocol,
+    TypedDict,
+    TypeVar,
+    TypeVarTuple,
+    Unpack,
+    cast,
+)
+
+import numpy as np
+
+from .processes import BackgroundThread
+
+ParamBatch = ParamSpec("ParamBatch")
+ReturnBatch = TypeVar("ReturnBatch")
+# типы массивов, которые получает vectorized()
+ColumnsBatch = TypeVarTuple("ColumnsBatch")
+# аргументы одного вызова и Future для его результата
+BatchRequest = tuple[tuple[object, ...], Future[object]]
+
+
+class PositionalFunction(Protocol):
+    """Function called with the arguments of a call in order."""
+
+    def __call__(self, *args: object) -> object:
+        """Call the function."""
+
+
+class BatchLimits(TypedDict):
+    """How large a batch grows and how long it waits for more calls."""
+
+    max_batch: int
+    max_wait: float
+
+
+class AutoBatched(Generic[ParamBatch, ReturnBatch, Unpack[ColumnsBatch]]):
+    """Scalar function whose concurrent calls are computed in batches."""
+
+    # копируется из func функцией functools.update_wrapper()
+    __wrapped__: Callable[ParamBatch, ReturnBatch]
+
+    def __init__(
+        self,
+        func: Callable[ParamBatch, ReturnBatch],
+        vectorized: Callable[[Unpack[ColumnsBatch]], object],
+        limits: BatchLimits,
+    ) -> None:
+        """Wrap func; vectorized takes one array per parameter of func."""
+        functools.update_wrapper(self, func)
+        self.vectorized = vectorized
+        self.limits = limits
+        self.signature = inspect.signature(func)
+        # None просит поток завершиться
+        self.requests: queue.SimpleQueue[BatchRequest | None] = queue.SimpleQueue()
+        self.batcher = BackgroundThread(self.run, self.requests)
+        self.n_calls = self.n_batches = 0
+
+    def submit(
+        self, *args: ParamBatch.args, **kwargs: ParamBatch.kwargs
+    ) -> Future[ReturnBatch]:
+        """Queue a call and return the Future of its result."""
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        future: Future[object] = Future()
+        self.requests.put((tuple(bound.arguments.values()), future))
+        self.batcher.wake()
+        return cast(Future[ReturnBatch], future)
+
+    def __call__(
+        self, *args: ParamBatch.args, **kwargs: ParamBatch.kwargs
+    ) -> ReturnBatch:
+        """Wait for the result of a call computed with others."""
+        return self.submit(*args, **kwargs).result()
+
+    async def acall(
+        self, *args: ParamBatch.args, **kwargs: ParamBatch.kwargs
+    ) -> ReturnBatch:
+        """Await the result of a call without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(*args, **kwargs))
+
+    def run(self) -> None:
+        """Collect calls into batches and compute them until stopped."""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.limits["max_wait"]
+            while len(batch) < self.limits["max_batch"]:
+                try:
+                    timeout = max(deadline - time.monotonic(), 0)
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # завершиться после этого пакета и вызовов за ним
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+            self.run_batch(batch)
+
+    def run_batch(self, batch: list[BatchRequest]) -> None:
+        """Compute one batch and hand every caller its result."""
+        # отмененные вызовы считать не нужно
+        batch = [
+            request for request in batch if request[1].set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        self.n_calls += len(batch)
+        self.n_batches += 1
+        try:
+            if len(batch) == 1:
+                values = [cast(PositionalFunction, self.__wrapped__)(*batch[0][0])]
+            else:
+                rows = (args for args, _ in batch)
+                columns = tuple(np.asarray(column) for column in zip(*rows))
+                vectorized_args = cast(tuple[Unpack[ColumnsBatch]], columns)
+                values = np.asarray(self.vectorized(*vectorized_args)).tolist()
+                if len(values) != len(batch):
+                    raise ValueError(
+                        f"{len(values)} results for a batch of {len(batch)} calls"
+                    )
+        # любая ошибка достается всем вызовам пакета через их Future
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), value in zip(batch, values):
+            future.set_result(value)
+
+
+def autobatch(
+    vectorized: Callable[[Unpack[ColumnsBatch]], object],
+    max_batch: int = 1024,
+    max_wait: float = 0.001,
+) -> Callable[
+    [Callable[ParamBatch, ReturnBatch]],
+    AutoBatched[ParamBatch, ReturnBatch, Unpack[ColumnsBatch]],
+]:
+    """Make a decorator that computes concurrent calls with vectorized."""
+    limits: BatchLimits = {"max_batch": max_batch, "max_wait": max_wait}
+
+    def decorator(
+        func: Callable[ParamBatch, ReturnBatch],
+    ) -> AutoBatched[ParamBatch, ReturnBatch, Unpack[ColumnsBatch]]:
+        """Decorate scalar function with batching."""
+        return AutoBatched(func, vectorized, limits)
+
+    return decorator
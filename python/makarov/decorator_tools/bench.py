@@ -0,0 +1,215 @@
+"""Benchmark a function on every call, the way timeit and pytest-benchmark do.
+
+A few warm-up calls are not timed, the number of calls in a run is
+picked so that a run lasts at least min_time, the garbage collector is
+off while timing, and outliers are counted by the Tukey rule. The
+median can be compared with one saved in a baseline JSON file.
+"""
+
+import functools
+import gc
+import json
+import os
+import statistics
+import timeit
+from typing import Callable, Generic, ParamSpec, TypedDict, TypeVar
+
+TUKEY_FENCE = 1.5
+
+
+class BenchmarkStats(TypedDict):
+    """Timings of one benchmarked function, in seconds per call."""
+
+    name: str
+    loops: int
+    runs: int
+    best: float
+    median: float
+    q1: float
+    q3: float
+    iqr: float
+    outliers: int
+    baseline: float | None
+    ratio: float | None
+    regression: bool
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration with a unit that suits it."""
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def calibrate_loops(timer: timeit.Timer, min_time: float) -> int:
+    """Return the smallest 1-2-5 number of calls that take min_time."""
+    scale = 1
+    while True:
+        for factor in (1, 2, 5):
+            loops = factor * scale
+            if timer.timeit(loops) >= min_time:
+                return loops
+        scale *= 10
+
+
+def summarize_runs(name: str, loops: int, run_times: list[float]) -> BenchmarkStats:
+    """Compute the median, quartiles and outliers of per-call times."""
+    samples = sorted(run_time / loops for run_time in run_times)
+    if len(samples) > 1:
+        quartiles = statistics.quantiles(samples, n=4, method="inclusive")
+        q1, median, q3 = quartiles[0], quartiles[1], quartiles[2]
+    else:
+        q1 = median = q3 = samples[0]
+    iqr = q3 - q1
+    low, high = q1 - TUKEY_FENCE * iqr, q3 + TUKEY_FENCE * iqr
+    return {
+        "name": name,
+        "loops": loops,
+        "runs": len(samples),
+        "best": samples[0],
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "iqr": iqr,
+        "outliers": sum(1 for sample in samples if not low <= sample <= high),
+        "baseline": None,
+        "ratio": None,
+        "regression": False,
+    }
+
+
+def compare_baseline(
+    stats: BenchmarkStats, path: str, threshold: float, update: bool
+) -> None:
+    """Compare the median with the one saved in path, saving it if missing."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            baselines: dict[str, float] = json.load(file)
+    except FileNotFoundError:
+        baselines = {}
+    saved = baselines.get(stats["name"])
+    if saved is not None:
+        stats["baseline"] = saved
+        ratio = stats["median"] / saved
+        stats["ratio"] = ratio
+        stats["regression"] = ratio > 1 + threshold
+    if saved is None or update:
+        baselines[stats["name"]] = stats["median"]
+        # пишем во временный файл и подменяем, чтобы не оставить
+        # полузаписанный JSON
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+
+def format_benchmark(stats: BenchmarkStats) -> str:
+    """Build the report line of one benchmark."""
+    line = (
+        f"{stats['name']}: {format_duration(stats['median'])} median,"
+        f" IQR {format_duration(stats['iqr'])},"
+        f" best {format_duration(stats['best'])}"
+        f" ({stats['runs']} runs x {stats['loops']} loops,"
+        f" {stats['outliers']} outliers)"
+    )
+    if stats["ratio"] is not None:
+        verdict = "REGRESSION" if stats["regression"] else "ok"
+        line += f", {stats['ratio']:.2f}x baseline: {verdict}"
+    return line
+
+
+class BenchmarkSettings(TypedDict):
+    """Parameters of the @benchmark decorator."""
+
+    repeats: int
+    warmup: int
+    min_time: float
+    gc_enabled: bool
+    baseline: str | None
+    threshold: float
+    update_baseline: bool
+    name: str | None
+
+
+ParamBench = ParamSpec("ParamBench")
+ReturnBench = TypeVar("ReturnBench")
+
+
+class Benchmarked(Generic[ParamBench, ReturnBench]):
+    """Function that benchmarks itself on every call."""
+
+    def __init__(
+        self,
+        func: Callable[ParamBench, ReturnBench],
+        settings: BenchmarkSettings,
+    ) -> None:
+        """Wrap func; the last statistics are kept in the stats attribute."""
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.settings = settings
+        self.name = settings["name"] or func.__qualname__
+        self.stats: BenchmarkStats | None = None
+
+    def __call__(
+        self, *args: ParamBench.args, **kwargs: ParamBench.kwargs
+    ) -> ReturnBench:
+        """Benchmark a call with these arguments, print and return its result."""
+        settings = self.settings
+        for _ in range(settings["warmup"]):
+            self.func(*args, **kwargs)
+        # timeit отключает сборщик мусора, setup может включить его снова
+        timer = timeit.Timer(
+            lambda: self.func(*args, **kwargs),
+            setup=gc.enable if settings["gc_enabled"] else "pass",
+        )
+        loops = calibrate_loops(timer, settings["min_time"])
+        run_times = timer.repeat(settings["repeats"], loops)
+        self.stats = summarize_runs(self.name, loops, run_times)
+        if settings["baseline"] is not None:
+            compare_baseline(
+                self.stats,
+                settings["baseline"],
+                settings["threshold"],
+                settings["update_baseline"],
+            )
+        print(format_benchmark(self.stats))
+        return self.func(*args, **kwargs)
+
+
+# pylint: disable-next=too-many-arguments
+def benchmark(
+    *,
+    repeats: int = 7,
+    warmup: int = 1,
+    min_time: float = 0.02,
+    gc_enabled: bool = False,
+    baseline: str | None = None,
+    threshold: float = 0.1,
+    update_baseline: bool = False,
+    name: str | None = None,
+) -> Callable[
+    [Callable[ParamBench, ReturnBench]], Benchmarked[ParamBench, ReturnBench]
+]:
+    """Make a decorator that benchmarks every call of a function.
+
+    Each timed run lasts at least min_time seconds. A median more than
+    threshold above the one saved in the baseline file is a regression.
+    """
+    settings: BenchmarkSettings = {
+        "repeats": repeats,
+        "warmup": warmup,
+        "min_time": min_time,
+        "gc_enabled": gc_enabled,
+        "baseline": baseline,
+        "threshold": threshold,
+        "update_baseline": update_baseline,
+        "name": name,
+    }
+
+    def decorator(
+        func: Callable[ParamBench, ReturnBench],
+    ) -> Benchmarked[ParamBench, ReturnBench]:
+        """Decorate function with a benchmark."""
+        return Benchmarked(func, settings)
+
+    return decorator
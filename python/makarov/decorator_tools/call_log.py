@@ -0,0 +1,269 @@
+"""Log calls of decorated functions from a background thread.
+
+Building the repr() of a large array or table can take longer than the
+call itself, and printing blocks the caller until the line is written.
+So a wrapper only puts the arguments and the result in a queue, and a
+background thread builds and prints the lines. Calls left out of the
+sample are not formatted at all.
+"""
+
+import contextlib
+import functools
+import inspect
+import itertools
+import queue
+import reprlib
+import sys
+import time
+from typing import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    ParamSpec,
+    Protocol,
+    TypeVar,
+    cast,
+    overload,
+)
+
+from .asynchronous import timed_async_generator
+from .codegen import specialize_wrapper
+from .processes import BackgroundThread
+
+LOG_QUEUE_SIZE = 10_000
+# (имя функции, args, kwargs, было ли исключение, результат или
+# исключение, время в нс, как сокращать repr)
+LogEntry = tuple[
+    str, tuple[object, ...], dict[str, object], bool, object, int, reprlib.Repr
+]
+
+
+def format_log_line(entry: LogEntry) -> str:
+    """Build the log line of one call."""
+    name, args, kwargs, raised, outcome, elapsed_ns, short = entry
+    arguments = [short.repr(arg) for arg in args]
+    arguments += [f"{key}={short.repr(arg)}" for key, arg in kwargs.items()]
+    verb = "raised" if raised else "->"
+    return (
+        f"{name}({', '.join(arguments)}) {verb} {short.repr(outcome)}"
+        f" in {elapsed_ns / 1e6:.3f} ms"
+    )
+
+
+class LogWriter:
+    """Print log lines from a background thread."""
+
+    def __init__(self, max_queue: int = LOG_QUEUE_SIZE) -> None:
+        """Prepare the queue; the thread starts with the first entry."""
+        # None просит поток завершиться
+        self.entries: queue.Queue[LogEntry | None] = queue.Queue(max_queue)
+        self.dropped = 0  # записи, не поместившиеся в очередь
+        self.printer = BackgroundThread(self.run, self.entries)
+
+    def emit(self, entry: LogEntry) -> None:
+        """Queue an entry, dropping it rather than waiting when the queue is full."""
+        try:
+            self.entries.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+        self.printer.wake()
+
+    def run(self) -> None:
+        """Format and print entries as they arrive."""
+        while True:
+            entry = self.entries.get()
+            try:
+                if entry is None:
+                    return
+                # sys.stdout берется в момент печати: его могли подменить
+                sys.stdout.write(format_log_line(entry) + "\n")
+            finally:
+                self.entries.task_done()
+
+    def flush(self) -> None:
+        """Wait until every queued entry is printed."""
+        self.entries.join()
+        sys.stdout.flush()
+
+
+LOG_WRITER = LogWriter()
+
+
+def flush_logs() -> None:
+    """Wait for the log lines of earlier calls."""
+    LOG_WRITER.flush()
+
+
+class ItemCount(int):
+    """Number of items an async generator yielded, as the log shows it."""
+
+    def __repr__(self) -> str:
+        """Show the count as a result that is not a plain number."""
+        return f"<{int(self)} items>"
+
+
+ParamLogVar = ParamSpec("ParamLogVar")
+ReturnLog = TypeVar("ReturnLog")  # Для возвращаемого значения
+
+LOG_CALLS_BODY = """
+start_time = clock()
+try:
+    result_log = {call}
+except Exception as error:
+    elapsed_ns = clock() - start_time
+    emit((name, {args}, {kwargs}, True, error, elapsed_ns, short))
+    raise
+elapsed_ns = clock() - start_time
+if elapsed_ns >= slower_than_ns and next(calls) % sample_every == 0:
+    emit((name, {args}, {kwargs}, False, result_log, elapsed_ns, short))
+return result_log
+"""
+
+
+def log_calls(
+    sample_every: int = 1,
+    slower_than: float = 0.0,
+    max_repr: int = 80,
+    specialize: bool = False,
+) -> Callable[[Callable[ParamLogVar, ReturnLog]], Callable[ParamLogVar, ReturnLog]]:
+    """Make a logging decorator that samples calls and shortens reprs.
+
+    Only every sample_every-th call slower than slower_than seconds is
+    logged; calls that raise are always logged. With specialize, the
+    wrapper of a plain function takes the exact parameters of it.
+    """
+    short = reprlib.Repr()
+    short.maxstring = short.maxother = max_repr
+    slower_than_ns = int(slower_than * 1e9)
+
+    def decorator(
+        func: Callable[ParamLogVar, ReturnLog],
+    ) -> Callable[ParamLogVar, ReturnLog]:
+        """Decorate function for logging function calls."""
+        # itertools.count считает вызовы атомарно, без блокировки
+        calls = itertools.count()
+        clock = time.perf_counter_ns
+        emit = LOG_WRITER.emit
+        name = func.__name__
+
+        if inspect.isasyncgenfunction(func):
+
+            async def generator_wrapper(
+                *args: ParamLogVar.args, **kwargs: ParamLogVar.kwargs
+            ) -> AsyncGenerator[object, None]:
+                """Iterate wrapped async generator."""
+
+                def done(
+                    elapsed_ns: int, n_items: int, error: Exception | None
+                ) -> None:
+                    if error is not None:
+                        emit((name, args, kwargs, True, error, elapsed_ns, short))
+                        return
+                    if elapsed_ns >= slower_than_ns and next(calls) % sample_every == 0:
+                        outcome = ItemCount(n_items)
+                        emit((name, args, kwargs, False, outcome, elapsed_ns, short))
+
+                generator = cast(AsyncGenerator[object, None], func(*args, **kwargs))
+                items = timed_async_generator(generator, done)
+                async with contextlib.aclosing(items):
+                    async for item in items:
+                        yield item
+
+            # update_wrapper() вызывается сам, а не через @functools.wraps:
+            # тип async def содержит Any, а строгий mypy не пропускает
+            # декорированные функции с Any в типе
+            functools.update_wrapper(generator_wrapper, func)
+            return cast(Callable[ParamLogVar, ReturnLog], generator_wrapper)
+
+        if inspect.iscoroutinefunction(func):
+
+            async def coroutine_wrapper(
+                *args: ParamLogVar.args, **kwargs: ParamLogVar.kwargs
+            ) -> object:
+                """Await wrapped coroutine function."""
+                start_time = clock()
+                try:
+                    result_log = await cast(Awaitable[object], func(*args, **kwargs))
+                except Exception as error:
+                    elapsed_ns = clock() - start_time
+                    emit((name, args, kwargs, True, error, elapsed_ns, short))
+                    raise
+                elapsed_ns = clock() - start_time
+                if elapsed_ns >= slower_than_ns and next(calls) % sample_every == 0:
+                    emit((name, args, kwargs, False, result_log, elapsed_ns, short))
+                return result_log
+
+            functools.update_wrapper(coroutine_wrapper, func)
+            return cast(Callable[ParamLogVar, ReturnLog], coroutine_wrapper)
+
+        if specialize:
+            specialized = specialize_wrapper(
+                func,
+                LOG_CALLS_BODY,
+                {
+                    "clock": clock,
+                    "emit": emit,
+                    "name": name,
+                    "short": short,
+                    "calls": calls,
+                    "slower_than_ns": slower_than_ns,
+                    "sample_every": sample_every,
+                },
+            )
+            if specialized is not None:
+                return specialized
+
+        @functools.wraps(func)
+        def wrapper(*args: ParamLogVar.args, **kwargs: ParamLogVar.kwargs) -> ReturnLog:
+            """Execute wrapped function."""
+            start_time = clock()
+            try:
+                result_log = func(*args, **kwargs)
+            except Exception as error:
+                elapsed_ns = clock() - start_time
+                emit((name, args, kwargs, True, error, elapsed_ns, short))
+                raise
+            elapsed_ns = clock() - start_time
+            if elapsed_ns >= slower_than_ns and next(calls) % sample_every == 0:
+                emit((name, args, kwargs, False, result_log, elapsed_ns, short))
+            return result_log
+
+        return wrapper
+
+    return decorator
+
+
+class LoggingDecorator(Protocol):
+    """Decorator returned by logging_decorator(specialize=True)."""
+
+    def __call__(
+        self,
+        func: Callable[ParamLogVar, ReturnLog],
+        /,
+    ) -> Callable[ParamLogVar, ReturnLog]:
+        """Decorate function for logging every call."""
+
+
+@overload
+def logging_decorator(
+    func: Callable[ParamLogVar, ReturnLog], *, specialize: bool = False
+) -> Callable[ParamLogVar, ReturnLog]:
+    """Decorate func itself."""
+
+
+@overload
+def logging_decorator(
+    func: None = None, *, specialize: bool = False
+) -> LoggingDecorator:
+    """Make a decorator with the options given."""
+
+
+def logging_decorator(
+    func: Callable[ParamLogVar, ReturnLog] | None = None, *, specialize: bool = False
+) -> Callable[ParamLogVar, ReturnLog] | LoggingDecorator:
+    """Decorate function for logging every call.
+
+    Used as @logging_decorator or as @logging_decorator(specialize=True).
+    """
+    decorator: LoggingDecorator = log_calls(specialize=specialize)
+    return decorator if func is None else decorator(func)
@@ -0,0 +1,214 @@
+"""Compile wrappers with the exact signature of the function they wrap.
+
+A ``def wrapper(*args, **kwargs)`` packs the arguments into a tuple and a
+dict on every call and unpacks them again for the wrapped function.
+specialize_wrapper() writes the source of a wrapper with the parameter
+list of the function instead and compiles it with exec(), the way
+dataclasses writes ``__init__`` and collections.namedtuple writes
+``__new__``. A closure cannot do this: its parameter list is fixed when
+it is written, whatever arity the function has. The source is put
+together only from parameter names that inspect.signature() reports,
+which are identifiers, and from the body the decorator itself passes,
+never from values seen at call time.
+"""
+
+import ast
+import functools
+import inspect
+import textwrap
+import types
+from typing import Callable, ParamSpec, Protocol, TypeVar, cast
+
+# значение параметра, которого вызывающий не передал
+MISSING = object()
+
+ParamSpecial = ParamSpec("ParamSpecial")
+ReturnSpecial = TypeVar("ReturnSpecial")
+
+
+class WrapperFactory(Protocol):
+    """Compiled function that closes a wrapper over the names it gets."""
+
+    def __call__(self, **names: object) -> types.FunctionType:
+        """Return the wrapper."""
+
+
+def passed_arguments(
+    signature: inspect.Signature, values: tuple[object, ...]
+) -> tuple[tuple[object, ...], dict[str, object]]:
+    """Return the args and kwargs a call passed, MISSING values left out.
+
+    Positional parameters after a left out one are given by keyword.
+
+    >>> signature = inspect.signature(lambda a, b=1, c=2, *, d=3: 0)
+    >>> passed_arguments(signature, (5, MISSING, 7, MISSING))
+    ((5,), {'c': 7})
+    """
+    args: list[object] = []
+    kwargs: dict[str, object] = {}
+    skipped = False
+    for parameter, value in zip(signature.parameters.values(), values):
+        if value is MISSING:
+            skipped = True
+        elif parameter.kind is parameter.VAR_POSITIONAL:
+            args.extend(cast(tuple[object, ...], value))
+        elif parameter.kind is parameter.VAR_KEYWORD:
+            kwargs.update(cast(dict[str, object], value))
+        elif skipped or parameter.kind is parameter.KEYWORD_ONLY:
+            kwargs[parameter.name] = value
+        else:
+            args.append(value)
+    return tuple(args), kwargs
+
+
+def signature_parts(
+    signature: inspect.Signature, track_defaults: bool = False
+) -> tuple[str, str, str, str]:
+    """Return the parameter list, call arguments, args tuple and kwargs dict.
+
+    With track_defaults, a parameter left out is called with default_<i>
+    and the args and kwargs come from passed().
+
+    >>> signature_parts(inspect.signature(lambda a, /, b=1, *c, d, **e: 0))
+    ('a, /, b=None, *c, d, **e', 'a, b, *c, d=d, **e', '(a, b, *c,)', "{'d': d, **e}")
+    >>> signature_parts(inspect.signature(lambda b=1: 0), track_defaults=True)
+    ('b=None', 'default_0 if b is missing else b', 'passed((b,))[0]', 'passed((b,))[1]')
+    """
+    header: list[str] = []
+    call: list[str] = []
+    positional: list[str] = []
+    keyword: list[str] = []
+    n_positional_only = 0
+    for index, parameter in enumerate(signature.parameters.values()):
+        name = parameter.name
+        value = name
+        # значения по умолчанию подставляются потом через __defaults__
+        default = ""
+        if parameter.default is not parameter.empty:
+            default = "=None"
+            if track_defaults:
+                value = f"default_{index} if {name} is missing else {name}"
+        if parameter.kind is parameter.POSITIONAL_ONLY:
+            n_positional_only += 1
+        if parameter.kind is parameter.VAR_POSITIONAL:
+            header.append(f"*{name}")
+            call.append(f"*{name}")
+            positional.append(f"*{name}")
+        elif parameter.kind is parameter.VAR_KEYWORD:
+            header.append(f"**{name}")
+            call.append(f"**{name}")
+            keyword.append(f"**{name}")
+        elif parameter.kind is parameter.KEYWORD_ONLY:
+            if not any(part.startswith("*") for part in header):
+                header.append("*")
+            header.append(name + default)
+            call.append(f"{name}={value}")
+            keyword.append(f"{name!r}: {name}")
+        else:
+            header.append(name + default)
+            call.append(value)
+            positional.append(name)
+    if n_positional_only:
+        header.insert(n_positional_only, "/")
+    args = f"({', '.join(positional)},)" if positional else "()"
+    kwargs = f"{{{', '.join(keyword)}}}"
+    if track_defaults:
+        args = f"({', '.join(signature.parameters)},)" if signature.parameters else "()"
+        args, kwargs = f"passed({args})[0]", f"passed({args})[1]"
+    return ", ".join(header), ", ".join(call), args, kwargs
+
+
+def split_defaults(
+    signature: inspect.Signature, namespace: dict[str, object], track_defaults: bool
+) -> tuple[tuple[object, ...] | None, dict[str, object] | None]:
+    """Return the __defaults__ and __kwdefaults__ of the wrapper.
+
+    With track_defaults, every default is MISSING and the real value is
+    put in namespace as default_<i>.
+    """
+    defaults: list[object] = []
+    kwdefaults: dict[str, object] = {}
+    for index, parameter in enumerate(signature.parameters.values()):
+        if parameter.default is parameter.empty:
+            continue
+        default = parameter.default
+        if track_defaults:
+            namespace[f"default_{index}"] = default
+            default = MISSING
+        if parameter.kind is parameter.KEYWORD_ONLY:
+            kwdefaults[parameter.name] = default
+        else:
+            defaults.append(default)
+    return tuple(defaults) or None, kwdefaults or None
+
+
+def body_names(body: str) -> set[str]:
+    """Return the names a wrapper body reads, binds or catches into."""
+    template = ast.parse(body.format(call="None", args="None", kwargs="None"))
+    names: set[str] = set()
+    for node in ast.walk(template):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+def compile_wrapper(
+    filename: str, header: str, code: str, namespace: dict[str, object]
+) -> types.FunctionType:
+    """Compile def wrapper(<header>) with the body code, closed over namespace."""
+    # имена из namespace становятся переменными замыкания: они читаются
+    # быстрее глобальных
+    source = (
+        f"def make_wrapper({', '.join(namespace)}):\n"
+        f"    def wrapper({header}):\n{code}\n"
+        f"    return wrapper\n"
+    )
+    scope: dict[str, object] = {}
+    # source is built from parameter names and the decorator's own body only
+    exec(compile(source, filename, "exec"), scope)  # pylint: disable=exec-used
+    make_wrapper = cast(WrapperFactory, scope["make_wrapper"])
+    return make_wrapper(**namespace)
+
+
+def specialize_wrapper(
+    func: Callable[ParamSpecial, ReturnSpecial],
+    body: str,
+    namespace: dict[str, object],
+) -> Callable[ParamSpecial, ReturnSpecial] | None:
+    """Compile a wrapper of func with its exact signature, None if impossible.
+
+    body sees func and the names in namespace. In its text {call} is
+    replaced with the call of func, and {args} and {kwargs} with the
+    tuple and dict of the arguments, built only when used. When the body
+    uses them, a parameter left out gets MISSING in the wrapper, so they
+    hold the arguments as passed, without the defaults filled in.
+
+    None is returned when the signature of func is unknown or one of its
+    parameters has the name of something the body uses.
+    """
+    try:
+        signature = inspect.signature(func)
+    except (TypeError, ValueError):
+        return None
+    track_defaults = "{args}" in body or "{kwargs}" in body
+    namespace = {"func": func, **namespace}
+    defaults, kwdefaults = split_defaults(signature, namespace, track_defaults)
+    if track_defaults:
+        namespace["missing"] = MISSING
+        namespace["passed"] = functools.partial(passed_arguments, signature)
+    if (body_names(body) | set(namespace)) & set(signature.parameters):
+        return None
+    header, call, args, kwargs = signature_parts(signature, track_defaults)
+    code = textwrap.indent(
+        textwrap.dedent(body).format(call=f"func({call})", args=args, kwargs=kwargs),
+        " " * 8,
+    )
+    wrapper = compile_wrapper(
+        f"<wrapper of {func.__qualname__}>", header, code, namespace
+    )
+    wrapper.__defaults__ = defaults
+    wrapper.__kwdefaults__ = kwdefaults
+    functools.update_wrapper(wrapper, func)
+    return cast(Callable[ParamSpecial, ReturnSpecial], wrapper)
@@ -0,0 +1,271 @@
+"""Keep results of a function in an SQLite file that outlives the process.
+
+The key is built from the argument content with content_key(), as in
+memoize(), and hashed with stable_digest(). pickle.dumps() will not do
+for that: the order a set is walked in, and so the pickled bytes,
+depends on PYTHONHASHSEED and differs between processes, so the items
+of a set are hashed one by one and sorted by their hashes. A
+fingerprint of the source of the function is kept with its results,
+and results of an older version are deleted.
+
+The wrapper opens a connection of its own in every thread, and again
+after fork(), since an SQLite connection cannot be shared between them.
+A write and the eviction after it run in one BEGIN IMMEDIATE
+transaction, so processes writing at once wait for each other. The
+time a result was last used matters only for eviction, so hits do not
+write it at once: the times are collected in memory and written with
+one executemany() every MEMO_USED_BATCH hits and with every new result.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import types
+from collections import Counter
+from typing import Callable, Generic, ParamSpec, TypedDict, TypeVar, cast
+
+from .memo import content_key
+
+MEMO_PATH = ".memoize.db"
+MEMO_MAX_BYTES = 256 << 20
+# сколько ждать, пока другой процесс пишет в файл
+MEMO_TIMEOUT = 30.0
+MEMO_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS results (
+        function TEXT NOT NULL,
+        key BLOB NOT NULL,
+        fingerprint BLOB NOT NULL,
+        used REAL NOT NULL,
+        size INTEGER NOT NULL,
+        value BLOB NOT NULL,
+        PRIMARY KEY (function, key)
+    )""",
+    "CREATE INDEX IF NOT EXISTS results_used ON results (used)",
+)
+
+
+def stable_digest(value: object) -> bytes:
+    """Hash a content_hashable() value the same way in every process.
+
+    >>> stable_digest(("set", frozenset("abc"))).hex()[:8]
+    'cee04e94'
+    """
+    if isinstance(value, tuple):
+        data = b"t" + b"".join(map(stable_digest, value))
+    elif isinstance(value, frozenset):
+        data = b"s" + b"".join(sorted(map(stable_digest, value)))
+    else:
+        data = b"v" + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.blake2b(data, digest_size=20).digest()
+
+
+def argument_digest(*args: object, **kwargs: object) -> bytes:
+    """Hash the content of the arguments."""
+    return stable_digest(content_key(*args, **kwargs))
+
+
+def code_digest(code: types.CodeType, digest: "hashlib.blake2b") -> None:
+    """Feed the bytecode and constants of code, nested functions included."""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            code_digest(const, digest)
+        else:
+            digest.update(repr(const).encode())
+
+
+ParamSource = ParamSpec("ParamSource")
+ReturnSource = TypeVar("ReturnSource")
+
+
+def source_fingerprint(func: Callable[ParamSource, ReturnSource]) -> bytes:
+    """Hash the source of func, or its bytecode when the source is unknown."""
+    try:
+        source = inspect.getsource(func)
+        return hashlib.blake2b(source.encode(), digest_size=16).digest()
+    except (OSError, TypeError):
+        digest = hashlib.blake2b(digest_size=16)
+        code = getattr(func, "__code__", None)
+        if isinstance(code, types.CodeType):
+            code_digest(code, digest)
+        return digest.digest()
+
+
+def open_memo_store(path: str) -> sqlite3.Connection:
+    """Open the store in WAL mode, so several processes can share it."""
+    connection = sqlite3.connect(path, timeout=MEMO_TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode = WAL")
+    for statement in MEMO_SCHEMA:
+        connection.execute(statement)
+    return connection
+
+
+def evict_results(connection: sqlite3.Connection, max_bytes: int) -> int:
+    """Drop the least recently used results beyond max_bytes; return how many."""
+    return connection.execute(
+        """DELETE FROM results WHERE (function, key) IN (
+            SELECT function, key FROM (
+                SELECT function, key,
+                    SUM(size) OVER (ORDER BY used DESC, function, key) AS kept
+                FROM results
+            ) WHERE kept > ?
+        )""",
+        (max_bytes,),
+    ).rowcount
+
+
+MEMO_USED_BATCH = 64
+
+
+class StoreSettings(TypedDict):
+    """Where a function keeps its results and how much of them."""
+
+    path: str
+    max_bytes: int
+
+
+class PersistentInfo(TypedDict):
+    """Counters of one function memoized on disk."""
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+ParamDisk = ParamSpec("ParamDisk")
+ReturnDisk = TypeVar("ReturnDisk")
+
+
+class PersistentMemoized(Generic[ParamDisk, ReturnDisk]):
+    """Function whose results are kept in an SQLite file."""
+
+    # копируются из func функцией functools.update_wrapper()
+    __name__: str  # noqa: VNE003
+    __qualname__: str
+    __wrapped__: Callable[ParamDisk, ReturnDisk]
+
+    def __init__(
+        self,
+        func: Callable[ParamDisk, ReturnDisk],
+        settings: StoreSettings,
+        name: str | None,
+    ) -> None:
+        """Wrap func, keeping at most max_bytes of pickled results in path."""
+        functools.update_wrapper(self, func)
+        self.settings = settings
+        self.name = name or f"{func.__module__}.{func.__qualname__}"
+        self.fingerprint = source_fingerprint(func)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # hits, misses и evictions этого процесса
+        self.counts: Counter[str] = Counter()
+        # ключ -> время попадания, еще не записанное в файл
+        self.recently_used: dict[bytes, float] = {}
+        # результаты прежней версии функции больше не верны
+        self.connection().execute(
+            "DELETE FROM results WHERE function = ? AND fingerprint != ?",
+            (self.name, self.fingerprint),
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the connection of this thread, opened anew in a forked child."""
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.connection = open_memo_store(self.settings["path"])
+            self.local.pid = os.getpid()
+        return cast(sqlite3.Connection, self.local.connection)
+
+    def __call__(self, *args: ParamDisk.args, **kwargs: ParamDisk.kwargs) -> ReturnDisk:
+        """Return the stored result, computing and storing it on a miss."""
+        key = argument_digest(*args, **kwargs)
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT value FROM results WHERE function = ? AND key = ?",
+            (self.name, key),
+        ).fetchone()
+        if row is not None:
+            with self.lock:
+                self.counts["hits"] += 1
+                self.recently_used[key] = time.time()
+                is_batch_full = self.counts["hits"] % MEMO_USED_BATCH == 0
+            if is_batch_full:
+                with connection:
+                    connection.execute("BEGIN IMMEDIATE")
+                    self.write_used(connection)
+            return cast(ReturnDisk, pickle.loads(row[0]))
+        with self.lock:
+            self.counts["misses"] += 1
+        value = self.__wrapped__(*args, **kwargs)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.settings["max_bytes"]:
+            return value
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (self.name, key, self.fingerprint, time.time(), len(data), data),
+            )
+            self.write_used(connection)
+            evicted = evict_results(connection, self.settings["max_bytes"])
+        with self.lock:
+            self.counts["evictions"] += evicted
+        return value
+
+    def write_used(self, connection: sqlite3.Connection) -> None:
+        """Store the pending hit times; the caller holds a transaction."""
+        with self.lock:
+            used, self.recently_used = self.recently_used, {}
+        connection.executemany(
+            "UPDATE results SET used = ? WHERE function = ? AND key = ?",
+            ((when, self.name, key) for key, when in used.items()),
+        )
+
+    def cache_info(self) -> PersistentInfo:
+        """Return the counters of this process and what the file holds."""
+        query = (
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results WHERE function = ?"
+        )
+        entries, size = self.connection().execute(query, (self.name,)).fetchone()
+        with self.lock:
+            counts = self.counts.copy()
+        return {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "evictions": counts["evictions"],
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def cache_clear(self) -> None:
+        """Delete the stored results of this function."""
+        self.connection().execute(
+            "DELETE FROM results WHERE function = ?", (self.name,)
+        )
+
+
+def persistent_memoize(
+    path: str = MEMO_PATH, max_bytes: int = MEMO_MAX_BYTES, name: str | None = None
+) -> Callable[
+    [Callable[ParamDisk, ReturnDisk]], PersistentMemoized[ParamDisk, ReturnDisk]
+]:
+    """Make a decorator that keeps results in an SQLite file.
+
+    Results are stored under name, by default the qualified name of the
+    function.
+    """
+    settings: StoreSettings = {"path": path, "max_bytes": max_bytes}
+
+    def decorator(
+        func: Callable[ParamDisk, ReturnDisk],
+    ) -> PersistentMemoized[ParamDisk, ReturnDisk]:
+        """Decorate function with a cache on disk."""
+        return PersistentMemoized(func, settings, name)
+
+    return decorator
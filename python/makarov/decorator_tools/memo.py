@@ -0,0 +1,355 @@
+"""Cache results in memory under keys built from the argument content.
+
+The key is built from what the arguments hold: lists and dicts become
+tuples, numpy arrays and pandas tables are hashed by their data. numpy
+and pandas are looked up in sys.modules: an argument that is an array
+or a table means the module is already loaded, and without pandas the
+cache works as usual.
+
+When the cache is full the eviction policy picks the entry to drop:
+LRU the one used longest ago, LFU the one used least often, TTL the one
+that expires first. Every policy operation takes O(1). The lock guards
+only the entries; the function runs outside it, so long computations
+for different arguments go in parallel.
+"""
+
+import functools
+import hashlib
+import sys
+import threading
+import time
+import types
+from collections import Counter, OrderedDict
+from typing import Callable, Generic, Hashable, ParamSpec, Protocol, TypedDict, TypeVar
+
+
+def content_hashable(value: object) -> Hashable:
+    """Return a hashable stand-in for a value, built from its content."""
+    numpy = sys.modules.get("numpy")
+    pandas = sys.modules.get("pandas")
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        data: Hashable
+        if value.dtype.hasobject:
+            data = tuple(content_hashable(item) for item in value.flat)
+        else:
+            array = numpy.ascontiguousarray(value)
+            data = hashlib.blake2b(array, digest_size=16).digest()
+        return ("ndarray", value.dtype.str, value.shape, data)
+    if pandas is not None and isinstance(value, (pandas.DataFrame, pandas.Series)):
+        row_hashes = pandas.util.hash_pandas_object(value, index=True).to_numpy()
+        digest = hashlib.blake2b(row_hashes, digest_size=16).digest()
+        table: tuple[object, ...]
+        if isinstance(value, pandas.DataFrame):
+            table = ("DataFrame", tuple(value.columns), str(value.dtypes.tolist()))
+        else:
+            table = ("Series", value.name, str(value.dtype))
+        return (*table, digest)
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(content_hashable(item) for item in value))
+    if isinstance(value, dict):
+        pairs = (
+            (content_hashable(key), content_hashable(item))
+            for key, item in value.items()
+        )
+        return ("dict", tuple(pairs))
+    if isinstance(value, (set, frozenset)):
+        return ("set", frozenset(content_hashable(item) for item in value))
+    hash(value)  # TypeError для прочих нехешируемых объектов
+    return value
+
+
+def content_key(*args: object, **kwargs: object) -> Hashable:
+    """Build a cache key from the content of the arguments."""
+    return (
+        tuple(content_hashable(arg) for arg in args),
+        tuple((name, content_hashable(arg)) for name, arg in sorted(kwargs.items())),
+    )
+
+
+def estimate_size(value: object) -> int:
+    """Return roughly how many bytes a value occupies."""
+    numpy = sys.modules.get("numpy")
+    pandas = sys.modules.get("pandas")
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        return int(value.nbytes)
+    if pandas is not None and isinstance(value, pandas.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if pandas is not None and isinstance(value, pandas.Series):
+        return int(value.memory_usage(deep=True))
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(
+            estimate_size(key) + estimate_size(item) for key, item in value.items()
+        )
+    return size
+
+
+class EvictionPolicy(Protocol):
+    """Order in which a cache gives up its entries."""
+
+    def added(self, key: Hashable) -> None:
+        """Track a new entry."""
+
+    def used(self, key: Hashable) -> None:
+        """Note a cache hit."""
+
+    def removed(self, key: Hashable) -> None:
+        """Stop tracking an entry."""
+
+    def victim(self) -> Hashable:
+        """Return the entry to evict next."""
+
+    def is_expired(self, key: Hashable) -> bool:
+        """Return True when an entry must not be served any more."""
+
+
+class LRUPolicy:
+    """Evict the least recently used entry."""
+
+    def __init__(self) -> None:
+        """Start with no entries."""
+        self.order: OrderedDict[Hashable, None] = OrderedDict()
+
+    def added(self, key: Hashable) -> None:
+        """Track a new entry."""
+        self.order[key] = None
+
+    def used(self, key: Hashable) -> None:
+        """Move the entry to the recent end."""
+        self.order.move_to_end(key)
+
+    def removed(self, key: Hashable) -> None:
+        """Stop tracking an entry."""
+        del self.order[key]
+
+    def victim(self) -> Hashable:
+        """Return the least recently used entry."""
+        return next(iter(self.order))
+
+    def is_expired(self, key: Hashable) -> bool:  # pylint: disable=unused-argument
+        """Never expire."""
+        return False
+
+
+class LFUPolicy:
+    """Evict the least frequently used entry, the oldest among equals."""
+
+    def __init__(self) -> None:
+        """Start with no entries."""
+        self.counts: dict[Hashable, int] = {}
+        # число обращений -> записи с таким числом в порядке добавления
+        self.by_count: dict[int, OrderedDict[Hashable, None]] = {}
+        self.min_count = 0
+
+    def added(self, key: Hashable) -> None:
+        """Track a new entry with one use."""
+        self.counts[key] = 1
+        self.by_count.setdefault(1, OrderedDict())[key] = None
+        self.min_count = 1
+
+    def used(self, key: Hashable) -> None:
+        """Move the entry to the next count."""
+        count = self.counts[key]
+        self.removed(key)
+        if count == self.min_count and count not in self.by_count:
+            self.min_count = count + 1
+        self.counts[key] = count + 1
+        self.by_count.setdefault(count + 1, OrderedDict())[key] = None
+
+    def removed(self, key: Hashable) -> None:
+        """Stop tracking an entry."""
+        count = self.counts.pop(key)
+        keys = self.by_count[count]
+        del keys[key]
+        if not keys:
+            del self.by_count[count]
+
+    def victim(self) -> Hashable:
+        """Return the least frequently used entry."""
+        # после удаления записей самое малое число обращений могло вырасти
+        if self.min_count not in self.by_count:
+            self.min_count = min(self.by_count)
+        return next(iter(self.by_count[self.min_count]))
+
+    def is_expired(self, key: Hashable) -> bool:  # pylint: disable=unused-argument
+        """Never expire."""
+        return False
+
+
+class TTLPolicy:
+    """Expire entries a fixed time after they were stored."""
+
+    def __init__(self, seconds: float) -> None:
+        """Keep entries for the given number of seconds."""
+        self.seconds = seconds
+        # срок у всех записей одинаковый, поэтому порядок добавления
+        # совпадает с порядком истечения
+        self.deadlines: OrderedDict[Hashable, float] = OrderedDict()
+
+    def added(self, key: Hashable) -> None:
+        """Start the clock of a new entry."""
+        self.deadlines[key] = time.monotonic() + self.seconds
+
+    def used(self, key: Hashable) -> None:
+        """Leave the deadline as it is."""
+
+    def removed(self, key: Hashable) -> None:
+        """Stop tracking an entry."""
+        del self.deadlines[key]
+
+    def victim(self) -> Hashable:
+        """Return the entry that expires first."""
+        return next(iter(self.deadlines))
+
+    def is_expired(self, key: Hashable) -> bool:
+        """Return True once the entry outlived its time."""
+        return time.monotonic() >= self.deadlines[key]
+
+
+class CacheInfo(TypedDict):
+    """Counters of one memoized function."""
+
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    entries: int
+    size_bytes: int
+
+
+class CacheKey(Protocol):
+    """Function that turns the arguments of a call into a cache key."""
+
+    def __call__(self, *args: object, **kwargs: object) -> Hashable:
+        """Return the key of a call."""
+
+
+class CacheSettings(TypedDict):
+    """Bounds of a memoized function and how it builds its keys."""
+
+    max_entries: int | None
+    max_bytes: int | None
+    key: CacheKey
+
+
+ParamMemo = ParamSpec("ParamMemo")
+ReturnMemo = TypeVar("ReturnMemo")
+
+
+class Memoized(Generic[ParamMemo, ReturnMemo]):
+    """Function whose results are cached under content keys."""
+
+    # копируются из func функцией functools.update_wrapper()
+    __name__: str  # noqa: VNE003
+    __qualname__: str
+    __wrapped__: Callable[ParamMemo, ReturnMemo]
+
+    def __init__(
+        self,
+        func: Callable[ParamMemo, ReturnMemo],
+        settings: CacheSettings,
+        policy: EvictionPolicy,
+    ) -> None:
+        """Wrap func, keeping at most max_entries results of max_bytes in total."""
+        functools.update_wrapper(self, func)
+        self.settings = settings
+        self.policy = policy
+        self.entries: dict[Hashable, tuple[ReturnMemo, int]] = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # hits, misses, evictions и expirations
+        self.counts: Counter[str] = Counter()
+
+    def __call__(self, *args: ParamMemo.args, **kwargs: ParamMemo.kwargs) -> ReturnMemo:
+        """Return the cached result, computing it on a miss."""
+        cache_key = self.settings["key"](*args, **kwargs)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None:
+                if not self.policy.is_expired(cache_key):
+                    self.counts["hits"] += 1
+                    self.policy.used(cache_key)
+                    return entry[0]
+                self.discard(cache_key)
+                self.counts["expirations"] += 1
+            self.counts["misses"] += 1
+        value = self.__wrapped__(*args, **kwargs)
+        max_bytes = self.settings["max_bytes"]
+        size = estimate_size(value) if max_bytes is not None else 0
+        if max_bytes is not None and size > max_bytes:
+            return value  # такой результат все равно не поместится
+        with self.lock:
+            if cache_key in self.entries:  # другой поток успел раньше
+                self.discard(cache_key)
+            self.entries[cache_key] = (value, size)
+            self.total_bytes += size
+            self.policy.added(cache_key)
+            while self.is_overfull():
+                self.discard(self.policy.victim())
+                self.counts["evictions"] += 1
+        return value
+
+    def __get__(
+        self, instance: object, owner: type | None = None
+    ) -> "Memoized[ParamMemo, ReturnMemo] | types.MethodType":
+        """Bind the wrapper to an instance, so methods can be memoized."""
+        if instance is None:
+            return self
+        return types.MethodType(self, instance)
+
+    def is_overfull(self) -> bool:
+        """Return True while the cache holds too much."""
+        max_entries = self.settings["max_entries"]
+        max_bytes = self.settings["max_bytes"]
+        too_many = max_entries is not None and len(self.entries) > max_entries
+        too_big = max_bytes is not None and self.total_bytes > max_bytes
+        return too_many or too_big
+
+    def discard(self, cache_key: Hashable) -> None:
+        """Remove one entry; the caller holds the lock."""
+        _, size = self.entries.pop(cache_key)
+        self.total_bytes -= size
+        self.policy.removed(cache_key)
+
+    def cache_info(self) -> CacheInfo:
+        """Return the hit, miss and eviction counters."""
+        with self.lock:
+            return {
+                "hits": self.counts["hits"],
+                "misses": self.counts["misses"],
+                "evictions": self.counts["evictions"],
+                "expirations": self.counts["expirations"],
+                "entries": len(self.entries),
+                "size_bytes": self.total_bytes,
+            }
+
+    def cache_clear(self) -> None:
+        """Drop every entry and reset the counters."""
+        with self.lock:
+            for cache_key in list(self.entries):
+                self.discard(cache_key)
+            self.counts.clear()
+
+
+def memoize(
+    max_entries: int | None = 128,
+    max_bytes: int | None = None,
+    policy: Callable[[], EvictionPolicy] = LRUPolicy,
+    key: CacheKey = content_key,
+) -> Callable[[Callable[ParamMemo, ReturnMemo]], Memoized[ParamMemo, ReturnMemo]]:
+    """Make a caching decorator with the given bounds and eviction policy."""
+    settings: CacheSettings = {
+        "max_entries": max_entries,
+        "max_bytes": max_bytes,
+        "key": key,
+    }
+
+    def decorator(
+        func: Callable[ParamMemo, ReturnMemo],
+    ) -> Memoized[ParamMemo, ReturnMemo]:
+        """Decorate function with a result cache."""
+        return Memoized(func, settings, policy())
+
+    return decorator
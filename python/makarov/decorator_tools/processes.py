@@ -0,0 +1,275 @@
+"""Run functions in a pool of forked processes, passing arrays in shared memory.
+
+A large numpy argument or result is copied into a shared memory block,
+and only the name, shape and dtype of the block are pickled; an array
+inside a list, a dict or another object is pickled with it. A function
+is sent to the pool by name: forked processes get a copy of the
+registry, and the pool is forked anew after a new function is
+registered. forkserver would not do, since its processes do not see
+functions defined in a notebook.
+
+A process forked while another thread holds a lock may keep that lock
+taken forever. So before the pool is created the background threads in
+THREAD_STOPPERS are stopped, and every process of the pool is forked at
+once; the threads start again on their next use. Threads the notebook
+server runs keep going, but functions in the pool do not use their
+objects.
+"""
+
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory, util
+from typing import Callable, Generic, NamedTuple, ParamSpec, Protocol, TypeVar, cast
+
+import numpy as np
+
+# фоновые потоки умеют останавливаться: перед fork() их останавливает
+# @run_in_process, а запускаются они снова сами
+THREAD_STOPPERS: list[Callable[[], None]] = []
+
+
+class StopQueue(Protocol):
+    """Queue a background thread reads until it gets None."""
+
+    def put(self, item: None, /) -> None:
+        """Ask the thread to end after the items queued before."""
+
+    # queue.Queue and queue.SimpleQueue have it by this name
+    def empty(self) -> bool:  # noqa: FNE005
+        """Return True when no item is waiting."""
+
+
+class BackgroundThread:
+    """Thread that serves a queue, started on demand and stopped before fork()."""
+
+    def __init__(self, target: Callable[[], None], work: StopQueue) -> None:
+        """Run target in the thread; target returns once it reads None."""
+        self.target = target
+        self.work = work
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        THREAD_STOPPERS.append(self.stop)
+
+    def wake(self) -> None:
+        """Start the thread unless it is running; call after queueing an item."""
+        # поток проверяется после записи в очередь: если stop() его уже
+        # завершил, запись не останется без читателя
+        if self.thread is None:
+            self.start()
+
+    def start(self) -> None:
+        """Start the thread unless it is running."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.target, daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        """Let the thread finish the queued items and end it."""
+        with self.lock:
+            if self.thread is None:
+                return
+            self.work.put(None)
+            self.thread.join()
+            self.thread = None
+        if not self.work.empty():  # элементы, пришедшие после None
+            self.start()
+
+
+# массивы меньше этого дешевле передать через pickle
+SHARED_MIN_BYTES = 1 << 16
+
+
+class SharedArray(NamedTuple):
+    """Array in a shared memory block, as sent between processes."""
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def to_shared(value: object, blocks: list[shared_memory.SharedMemory]) -> object:
+    """Copy a large array into a new block; return other values as they are."""
+    if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+        return value
+    if value.nbytes < SHARED_MIN_BYTES:
+        return value
+    block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+    blocks.append(block)
+    np.ndarray(value.shape, value.dtype, buffer=block.buf)[...] = value
+    return SharedArray(block.name, value.shape, value.dtype.str)
+
+
+def from_shared(value: object, blocks: list[shared_memory.SharedMemory]) -> object:
+    """Return the array a SharedArray refers to, backed by its block."""
+    if not isinstance(value, SharedArray):
+        return value
+    block = shared_memory.SharedMemory(value.name)
+    blocks.append(block)
+    return np.ndarray(value.shape, np.dtype(value.dtype), buffer=block.buf)
+
+
+def release_shared(
+    blocks: list[shared_memory.SharedMemory], unlink: bool = False
+) -> None:
+    """Close the blocks, and remove them when this side owns them."""
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass  # массив из блока еще где-то хранится, блок закроется с ним
+        if unlink:
+            block.unlink()
+
+
+class WorkerFunction(Protocol):
+    """Registered function, called in a pool process."""
+
+    def __call__(self, *args: object, **kwargs: object) -> object:
+        """Call the function."""
+
+
+ParamWorker = ParamSpec("ParamWorker")
+ReturnWorker = TypeVar("ReturnWorker")
+
+
+class WorkerPool:
+    """Process pool forked after the last registered function."""
+
+    def __init__(self, max_workers: int | None = None) -> None:
+        """Start with no functions; the pool is created on first use."""
+        self.max_workers = max_workers
+        self.functions: dict[str, WorkerFunction] = {}
+        self.generation = 0  # сколько раз регистрировали функции
+        self.pool: ProcessPoolExecutor | None = None
+        self.pool_generation = -1
+        self.lock = threading.Lock()
+
+    def register(self, name: str, func: Callable[ParamWorker, ReturnWorker]) -> None:
+        """Make func callable in processes forked from now on."""
+        with self.lock:
+            self.functions[name] = cast(WorkerFunction, func)
+            self.generation += 1
+
+    def executor(self) -> ProcessPoolExecutor | None:
+        """Return a pool that knows every function, None without fork()."""
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        if self.pool_generation != self.generation:
+            # не под блокировкой: поток @autobatch сам может ждать пул
+            for stop in THREAD_STOPPERS:
+                stop()
+        with self.lock:
+            if self.pool_generation != self.generation:
+                if self.pool is not None:
+                    # начатые задачи доработают, и поток старого пула
+                    # завершится до fork()
+                    self.pool.shutdown()
+                # процессы пула должны сообщать о блоках тому же трекеру,
+                # что и основной процесс, который их удаляет
+                resource_tracker.ensure_running()
+                self.pool = ProcessPoolExecutor(
+                    self.max_workers, mp_context=multiprocessing.get_context("fork")
+                )
+                # с fork() первая задача создает сразу все процессы пула
+                self.pool.submit(os.getpid).result()
+                self.pool_generation = self.generation
+                # процесс, сам запущенный через multiprocessing, не вызывает
+                # atexit и ждал бы процессы пула вечно; приоритет выше, чем
+                # у закрытия очередей multiprocessing (10), иначе пул не
+                # сможет передать процессам команду завершиться
+                util.Finalize(self.pool, self.pool.shutdown, exitpriority=20)
+            return self.pool
+
+
+WORKER_POOL = WorkerPool()
+
+
+def call_in_process(
+    name: str, args: tuple[object, ...], kwargs: dict[str, object]
+) -> object:
+    """Run a registered function in a pool process."""
+    inputs: list[shared_memory.SharedMemory] = []
+    outputs: list[shared_memory.SharedMemory] = []
+    func = WORKER_POOL.functions[name]
+    result = func(
+        *(from_shared(arg, inputs) for arg in args),
+        **{key: from_shared(arg, inputs) for key, arg in kwargs.items()},
+    )
+    shared_result = to_shared(result, outputs)
+    del result  # результат мог быть видом на блок аргумента
+    release_shared(inputs)
+    release_shared(outputs)  # удалит блок основной процесс
+    return shared_result
+
+
+ParamProcess = ParamSpec("ParamProcess")
+ReturnProcess = TypeVar("ReturnProcess")
+
+
+class InProcessPool(Generic[ParamProcess, ReturnProcess]):
+    """Function that runs in the worker pool."""
+
+    def __init__(self, func: Callable[ParamProcess, ReturnProcess]) -> None:
+        """Register func with the worker pool."""
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        WORKER_POOL.register(self.name, func)
+
+    def submit(
+        self, *args: ParamProcess.args, **kwargs: ParamProcess.kwargs
+    ) -> Future[ReturnProcess]:
+        """Start a call in a pool process and return the Future of its result."""
+        result: Future[object] = Future()
+        executor = WORKER_POOL.executor()
+        if executor is None:
+            try:
+                result.set_result(self.func(*args, **kwargs))
+            # the Future hands whatever the function raised to the caller
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                result.set_exception(error)
+            return cast(Future[ReturnProcess], result)
+        blocks: list[shared_memory.SharedMemory] = []
+        try:
+            shared_args = tuple(to_shared(arg, blocks) for arg in args)
+            shared_kwargs = {key: to_shared(arg, blocks) for key, arg in kwargs.items()}
+            task = executor.submit(
+                call_in_process, self.name, shared_args, shared_kwargs
+            )
+        except BaseException:
+            release_shared(blocks, unlink=True)
+            raise
+
+        def done(task: Future[object]) -> None:
+            release_shared(blocks, unlink=True)
+            try:
+                value = task.result()
+                if isinstance(value, SharedArray):
+                    result_blocks: list[shared_memory.SharedMemory] = []
+                    # копируем из блока, чтобы его можно было сразу удалить
+                    value = np.array(from_shared(value, result_blocks))
+                    release_shared(result_blocks, unlink=True)
+                result.set_result(value)
+            # as above, and a callback has nobody else to raise to
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                result.set_exception(error)
+
+        task.add_done_callback(done)
+        return cast(Future[ReturnProcess], result)
+
+    def __call__(
+        self, *args: ParamProcess.args, **kwargs: ParamProcess.kwargs
+    ) -> ReturnProcess:
+        """Run a call in a pool process and wait for its result."""
+        return self.submit(*args, **kwargs).result()
+
+
+def run_in_process(
+    func: Callable[ParamProcess, ReturnProcess],
+) -> InProcessPool[ParamProcess, ReturnProcess]:
+    """Decorate function to run in a pool of processes."""
+    return InProcessPool(func)
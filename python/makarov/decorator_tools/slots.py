@@ -0,0 +1,156 @@
+"""Rebuild classes with __slots__ for the attributes their methods assign.
+
+An instance of a plain class keeps its attributes in a __dict__, an
+instance of a class with __slots__ in fixed cells, which takes less
+memory. auto_slots() finds assignments like self.x = ... in the source
+of the methods and creates the class anew with __slots__ of those
+names. The saving needs __slots__ on every base class as well, so the
+whole hierarchy has to be decorated.
+"""
+
+import ast
+import inspect
+import textwrap
+import tracemalloc
+import types
+from typing import TypeVar
+
+SlotsVar = TypeVar("SlotsVar", bound=type)
+
+
+def assigned_attributes(func: types.FunctionType) -> set[str]:
+    """Return the attributes a method assigns on its first argument."""
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+    except (OSError, TypeError) as error:
+        raise TypeError(f"cannot read the source of {func.__qualname__}") from error
+    function = ast.parse(source).body[0]
+    if not isinstance(function, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return set()
+    if not function.args.args:
+        return set()
+    self_name = function.args.args[0].arg
+    names = set()
+    for node in ast.walk(function):
+        if not isinstance(node, ast.Attribute) or not isinstance(node.ctx, ast.Store):
+            continue
+        if isinstance(node.value, ast.Name) and node.value.id == self_name:
+            names.add(node.attr)
+    return names
+
+
+def rebind_function(
+    func: types.FunctionType, cls: type, class_cell: types.CellType
+) -> types.FunctionType:
+    """Copy func with class_cell in place of the closure cells holding cls.
+
+    The function a decorator wrapper keeps in its closure, named by
+    __wrapped__, is copied the same way. Functions with nothing to
+    change are returned as they are.
+    """
+    closure = func.__closure__ or ()
+    wrapped = getattr(func, "__wrapped__", None)
+    new_closure = []
+    new_wrapped = wrapped
+    for cell in closure:
+        try:
+            referent = cell.cell_contents
+        except ValueError:  # пустая ячейка
+            referent = None
+        if referent is cls:
+            cell = class_cell
+        elif referent is wrapped and isinstance(wrapped, types.FunctionType):
+            new_wrapped = rebind_function(wrapped, cls, class_cell)
+            if new_wrapped is not wrapped:
+                cell = types.CellType(new_wrapped)
+        new_closure.append(cell)
+    if new_closure == list(closure):
+        return func
+    copy = types.FunctionType(
+        func.__code__,
+        func.__globals__,
+        func.__name__,
+        func.__defaults__,
+        tuple(new_closure),
+    )
+    copy.__kwdefaults__ = func.__kwdefaults__
+    copy.__qualname__ = func.__qualname__
+    copy.__annotations__ = func.__annotations__
+    copy.__dict__.update(func.__dict__)
+    if new_wrapped is not wrapped:
+        copy.__dict__["__wrapped__"] = new_wrapped
+    return copy
+
+
+def rebind_attribute(value: object, cls: type, class_cell: types.CellType) -> object:
+    """Return a class attribute whose functions refer to class_cell, not cls."""
+    if isinstance(value, types.FunctionType):
+        return rebind_function(value, cls, class_cell)
+    if isinstance(value, (staticmethod, classmethod)):
+        func = value.__func__
+        if isinstance(func, types.FunctionType):
+            return type(value)(rebind_function(func, cls, class_cell))
+    if isinstance(value, property):
+        if isinstance(value.fget, types.FunctionType):
+            value = value.getter(rebind_function(value.fget, cls, class_cell))
+        if isinstance(value.fset, types.FunctionType):
+            value = value.setter(rebind_function(value.fset, cls, class_cell))
+        if isinstance(value.fdel, types.FunctionType):
+            value = value.deleter(rebind_function(value.fdel, cls, class_cell))
+    return value
+
+
+def auto_slots(cls: SlotsVar) -> SlotsVar:
+    """Rebuild a class with __slots__ for the attributes its methods assign."""
+    names: set[str] = set()
+    for value in vars(cls).values():
+        # у статических и классовых методов первый аргумент не экземпляр
+        accessors = (
+            [value.fget, value.fset, value.fdel]
+            if isinstance(value, property)
+            else [value]
+        )
+        for accessor in accessors:
+            method = inspect.unwrap(accessor) if callable(accessor) else None
+            if isinstance(method, types.FunctionType):
+                names |= assigned_attributes(method)
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())
+    }
+    clashes = sorted(name for name in names if name in vars(cls))
+    if clashes:
+        raise TypeError(
+            f"{cls.__qualname__} assigns class attributes on instances: {clashes}"
+        )
+    namespace = {
+        key: value
+        for key, value in vars(cls).items()
+        if key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = tuple(sorted(names - inherited))
+    namespace["__qualname__"] = cls.__qualname__
+    # super() без аргументов берет класс из ячейки __class__ методов.
+    # Ячейка общая с исходным классом, поэтому методы копируются с
+    # новой ячейкой, которая получит новый класс
+    class_cell = types.CellType()
+    for key, value in namespace.items():
+        namespace[key] = rebind_attribute(value, cls, class_cell)
+    slotted = type(cls)(cls.__name__, cls.__bases__, namespace)
+    class_cell.cell_contents = slotted
+    return slotted
+
+
+def instance_bytes(cls: type, *args: object, n_instances: int = 100_000) -> float:
+    """Measure how many bytes one instance takes, on average."""
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        instances = [cls(*args) for _ in range(n_instances)]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    del instances
+    return used / n_instances
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Benchmark build_directory_md on synthetic trees."""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from typing import TypedDict
+
+from build_directory_md import good_file_paths, print_directory_md, print_path
+from ignore_rules import read_ignore_rules
+
+SUFFIXES = (".py", ".ipynb", ".md", ".csv")
+RESULTS_VERSION = 1
+
+
+class Result(TypedDict):
+    """One benchmark on one synthetic tree."""
+
+    tree: str
+    benchmark: str
+    seconds: float
+    peak_bytes: int
+
+
+def tree_dirs(root: str, n_dirs: int, fan_out: int, max_depth: int) -> list[str]:
+    """Return up to n_dirs directory paths under root, added breadth first."""
+    dirs = [root]
+    depths = [0]
+    parent_index = 0
+    while len(dirs) < n_dirs and parent_index < len(dirs):
+        if max_depth and depths[parent_index] == max_depth:
+            break
+        for child in range(fan_out):
+            if len(dirs) == n_dirs:
+                break
+            dirs.append(os.path.join(dirs[parent_index], f"chapter_{child}"))
+            depths.append(depths[parent_index] + 1)
+        parent_index += 1
+    return dirs
+
+
+def make_synthetic_tree(
+    root: str,
+    n_files: int,
+    fan_out: int = 8,
+    files_per_dir: int = 50,
+    max_depth: int = 0,
+) -> str:
+    """Create (or reuse) a tree of n_files files spread over nested directories.
+
+    Directories are added breadth first, fan_out children per directory, until
+    every file has a place or, with max_depth, the deepest allowed level is
+    full; files are then spread more densely. A marker file records the
+    parameters so the tree is only generated once.
+    """
+    marker = os.path.join(root, ".synthetic_tree")
+    params = f"{n_files} {fan_out} {files_per_dir}"
+    params += f" {max_depth}\n" if max_depth else "\n"
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as file:
+            if file.read() == params:
+                return root
+        raise FileExistsError(f"{root} holds a tree with other parameters")
+    dirs = tree_dirs(root, max(1, -(-n_files // files_per_dir)), fan_out, max_depth)
+    n_dirs = len(dirs)
+    for dir_path in dirs:
+        os.makedirs(dir_path, exist_ok=True)
+    for index in range(n_files):
+        dir_path = dirs[index % n_dirs]
+        suffix = SUFFIXES[index % len(SUFFIXES)]
+        with open(os.path.join(dir_path, f"lesson_{index}{suffix}"), "wb"):
+            pass
+    with open(marker, "w", encoding="utf-8") as file:
+        file.write(params)
+    return root
+
+
+def time_walk(
+    list_paths: Callable[[], Iterator[str]], repeat: int = 3
+) -> tuple[float, int]:
+    """Return the best wall time of fully consuming list_paths() and its count."""
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in list_paths())
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def best_time(function: Callable[[], object], repeat: int = 3) -> float:
+    """Return the best wall time of repeat calls, with stdout sent to devnull."""
+    best = float("inf")
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(function: Callable[[], object]) -> int:
+    """Return the peak bytes allocated by Python objects during one call.
+
+    This is a separate run from the timed ones, since tracemalloc slows
+    every allocation down.
+    """
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            tracemalloc.start()
+            try:
+                function()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+
+def print_headers(paths: list[str]) -> None:
+    """Print the headings of sorted paths the way print_directory_md used to."""
+    old_path = ""
+    for path in paths:
+        filepath = os.path.split(path)[0]
+        if filepath != old_path:
+            old_path = print_path(old_path, filepath)
+
+
+def benchmark_builder(top_dir: str, tree: str, repeat: int = 3) -> Iterator[Result]:
+    """Time and measure good_file_paths, print_path and print_directory_md."""
+    paths = sorted(good_file_paths(top_dir))
+    benchmarks: dict[str, Callable[[], object]] = {
+        "good_file_paths": lambda: sum(1 for _ in good_file_paths(top_dir)),
+        "print_path": lambda: print_headers(paths),
+        "print_directory_md": lambda: print_directory_md(top_dir),
+        "print_directory_md --stream": lambda: print_directory_md(
+            top_dir, streaming=True
+        ),
+    }
+    for name, function in benchmarks.items():
+        yield {
+            "tree": tree,
+            "benchmark": name,
+            "seconds": best_time(function, repeat),
+            "peak_bytes": peak_memory(function),
+        }
+
+
+def git_revision() -> str:
+    """Return the commit the benchmarked scripts come from, "" outside git."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare_results(
+    measured: list[Result], baseline_path: str, tolerance: float
+) -> list[str]:
+    """Return a line for every benchmark that got slower than the baseline."""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    before = {
+        (result["tree"], result["benchmark"]): result["seconds"]
+        for result in baseline["results"]
+    }
+    regressions = []
+    for result in measured:
+        old = before.get((result["tree"], result["benchmark"]))
+        if old and result["seconds"] > old * (1 + tolerance):
+            regressions.append(
+                f"{result['tree']} {result['benchmark']}: "
+                f"{old * 1000:.1f} ms -> {result['seconds'] * 1000:.1f} ms"
+            )
+    return regressions
+
+
+def benchmark_walkers(top_dir: str, workers: list[int]) -> dict[str, float]:
+    """Time the os.walk walker against the threaded scandir walker."""
+    results: dict[str, float] = {}
+    seconds, count = time_walk(lambda: iter(sorted(good_file_paths(top_dir))))
+    results["os.walk + sorted"] = seconds
+    for max_workers in workers:
+        seconds, parallel_count = time_walk(
+            functools.partial(good_file_paths, top_dir, max_workers=max_workers)
+        )
+        if parallel_count != count:
+            raise RuntimeError(f"scandir walker found {parallel_count} != {count}")
+        results[f"scandir x{max_workers}"] = seconds
+    return results
+
+
+def hard_coded_keep(names: list[str], is_dir: bool) -> list[str]:
+    """Filter one listing with the checks good_file_paths used to hard-code."""
+    if is_dir:
+        return [
+            name
+            for name in names
+            if name != "scripts" and name[0] not in "._" and "venv" not in name
+        ]
+    return [name for name in names if name != "__init__.py"]
+
+
+def benchmark_filters(top_dir: str, repeat: int = 3) -> dict[str, float]:
+    """Return the cost per entry, in ns, of the hard-coded and compiled filters."""
+    listings: list[tuple[str, list[str], list[str]]] = []
+    top_length = len(os.path.join(top_dir, ""))
+    for dir_path, dir_names, filenames in os.walk(top_dir):
+        listings.append((dir_path[top_length:], list(dir_names), filenames))
+    n_entries = max(1, sum(len(dirs) + len(files) for _, dirs, files in listings))
+    rules = read_ignore_rules(top_dir)
+    best = {"hard-coded filter": float("inf"), "ignore rules": float("inf")}
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _, dir_names, filenames in listings:
+            hard_coded_keep(dir_names, True)
+            hard_coded_keep(filenames, False)
+        middle = time.perf_counter_ns()
+        for rel_dir, dir_names, filenames in listings:
+            rules.keep(rel_dir, dir_names, True)
+            rules.keep(rel_dir, filenames, False)
+        end = time.perf_counter_ns()
+        best["hard-coded filter"] = min(best["hard-coded filter"], middle - start)
+        best["ignore rules"] = min(best["ignore rules"], end - middle)
+    return {name: elapsed / n_entries for name, elapsed in best.items()}
+
+
+def main() -> None:
+    """Run the benchmarks for every requested tree size."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--root", default="/tmp/directory_md_bench")
+    parser.add_argument(
+        "--files", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--fan-out", type=int, default=8)
+    parser.add_argument("--files-per-dir", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=0, help="0 for unlimited")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="slowdown over the baseline reported as a regression",
+    )
+    args = parser.parse_args()
+    results: list[Result] = []
+    for n_files in args.files:
+        tree = f"files_{n_files}_fan_{args.fan_out}_per_{args.files_per_dir}"
+        tree += f"_depth_{args.depth}" if args.depth else ""
+        top_dir = make_synthetic_tree(
+            os.path.join(args.root, tree),
+            n_files,
+            args.fan_out,
+            args.files_per_dir,
+            args.depth,
+        )
+        for name, seconds in benchmark_walkers(top_dir, args.workers).items():
+            print(f"{n_files:>9} files  {name:<28} {seconds * 1000:10.1f} ms")
+        for name, nanoseconds in benchmark_filters(top_dir).items():
+            print(f"{n_files:>9} files  {name:<28} {nanoseconds:10.1f} ns/entry")
+        for result in benchmark_builder(top_dir, tree, args.repeat):
+            results.append(result)
+            print(
+                f"{n_files:>9} files  {result['benchmark']:<28}"
+                f" {result['seconds'] * 1000:10.1f} ms"
+                f" {result['peak_bytes'] / 2**20:8.1f} MiB peak"
+            )
+    if args.json:
+        report = {
+            "version": RESULTS_VERSION,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+    if args.baseline:
+        regressions = compare_results(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
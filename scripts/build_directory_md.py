@@ -1,22 +1,92 @@
 #!/usr/bin/env python3
 """module."""
+import argparse
+import hashlib
+import io
+import json
 import os
-from collections.abc import Iterator
+import sys
+import tempfile
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import NamedTuple, TypedDict, cast
 
+from ignore_rules import IgnoreRules, read_ignore_rules
+from index_outputs import IndexWriter, open_index, path_lead
+from notebook_titles import TITLE_CACHE_PATH, TitleCache, TitleLookup
 
-def good_file_paths(top_dir: str = ".") -> Iterator[str]:
+MANIFEST_VERSION = 2
+MANIFEST_PATH = ".directory_md_manifest.json"
+OUTPUT_PATH = "DIRECTORY.md"
+# directories touched this close to the scan are rescanned next run, because a
+# coarse filesystem clock may not move again for a change made in the same tick
+RACY_WINDOW_NS = 2_000_000_000
+
+
+Listing = tuple[list[str], list[str]]
+Frame = tuple[str, str, Iterator[str], dict[str, Future[Listing]]]
+
+
+class DirRecord(TypedDict):
+    """Cached listing of one directory."""
+
+    mtime_ns: int
+    subdirs: list[str]
+    files: dict[str, list[int]]
+
+
+class SectionRecord(TypedDict):
+    """Rendered top-level section of DIRECTORY.md."""
+
+    dirs: list[str]
+    first: str
+    start: str
+    end: str
+    text: str
+
+
+class Manifest(TypedDict):
+    """Stat snapshot of the tree plus the sections rendered from it."""
+
+    version: int
+    options: str
+    dirs: dict[str, DirRecord]
+    sections: dict[str, SectionRecord]
+
+
+def is_good_file(name: str) -> bool:
+    """Return True for the notebooks and scripts the index lists.
+
+    >>> [is_good_file(name) for name in ("a.py", "b.ipynb", "c.md", ".py")]
+    [True, True, False, False]
+    """
+    if name[0] != ".":
+        return name.endswith((".py", ".ipynb"))
+    # splitext does not count leading dots as an extension
+    return os.path.splitext(name)[1] in (".py", ".ipynb")
+
+
+def child_path(rel_dir: str, name: str) -> str:
+    """Join a name to a path relative to the top directory."""
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+def good_file_paths(
+    top_dir: str = ".", max_workers: int = 0, rules: IgnoreRules | None = None
+) -> Iterator[str]:
     """SENATOROV."""
+    rules = rules or read_ignore_rules(top_dir)
+    if max_workers:
+        yield from scandir_file_paths(top_dir, max_workers, rules)
+        return
+    top_length = len(os.path.join(top_dir, ""))
     for dir_path, dir_names, filenames in os.walk(top_dir):
-        dir_names[:] = [
-            d
-            for d in dir_names
-            if d != "scripts" and d[0] not in "._" and "venv" not in d
-        ]
-        for filename in filenames:
-            if filename == "__init__.py":
-                continue
-            if os.path.splitext(filename)[1] in (".py", ".ipynb"):
-                yield os.path.join(dir_path, filename).lstrip("./")
+        rel_dir = dir_path[top_length:]
+        dir_names[:] = rules.keep(rel_dir, dir_names, True)
+        filenames = [filename for filename in filenames if is_good_file(filename)]
+        for filename in rules.keep(rel_dir, filenames, False):
+            yield os.path.join(dir_path, filename).lstrip("./")
 
 
 def md_prefix(i: int) -> str:
@@ -24,27 +94,644 @@ def md_prefix(i: int) -> str:
     return f"{i * '  '}*" if i else "\n##"
 
 
-def print_path(old_path: str, new_path: str) -> str:
-    """SENATOROV."""
+def path_headers(old_path: str, new_path: str) -> Iterator[str]:
+    r"""Yield the heading lines that lead from old_path to new_path.
+
+    >>> list(path_headers("", "python/makarov"))
+    ['\n## Python', '  * Makarov']
+    """
     old_parts = old_path.split(os.sep)
     for i, new_part in enumerate(new_path.split(os.sep)):
         if (i + 1 > len(old_parts) or old_parts[i] != new_part) and new_part:
-            print(f"{md_prefix(i)} {new_part.replace('_', ' ').title()}")
-    return new_path
+            yield f"{md_prefix(i)} {new_part.replace('_', ' ').title()}"
 
 
-def print_directory_md(top_dir: str = ".") -> None:
+def print_path(old_path: str, new_path: str) -> str:
     """SENATOROV."""
-    old_path = ""
-    for filepath in sorted(good_file_paths(top_dir)):
-        filepath, filename = os.path.split(filepath)
+    for line in path_headers(old_path, new_path):
+        print(line)
+    return new_path
+
+
+def directory_md_lines(
+    file_paths: Iterable[str],
+    old_path: str = "",
+    titles: TitleLookup | None = None,
+    index: IndexWriter | None = None,
+) -> Iterator[str]:
+    """Yield the DIRECTORY.md lines for already sorted file paths.
+
+    Without titles, or when a file has none, entries are labelled with the
+    title-cased file name. Every entry is also handed to index, if given.
+
+    >>> for line in directory_md_lines(["git/stash.py"]):
+    ...     print(line)
+    <BLANKLINE>
+    ## Git
+      * [Stash](git/stash.py)
+    """
+    for path in file_paths:
+        filepath, filename = os.path.split(path)
         if filepath != old_path:
-            old_path = print_path(old_path, filepath)
+            yield from path_headers(old_path, filepath)
+            old_path = filepath
         indent = (filepath.count(os.sep) + 1) if filepath else 0
         url = f"{filepath}/{filename}".replace(" ", "%20")
-        filename = os.path.splitext(filename.replace("_", " ").title())[0]
-        print(f"{md_prefix(indent)} [{filename}]({url})")
+        title = titles(path) if titles else None
+        label = os.path.splitext(filename.replace("_", " ").title())[0]
+        if index:
+            index.add(path, title or label)
+        if title:
+            label = title.replace("[", "\\[").replace("]", "\\]")
+        yield f"{md_prefix(indent)} [{label}]({url})"
+
+
+def title_lookup(top_dir: str, cache: TitleCache) -> TitleLookup:
+    """Return a lookup that maps index paths back to files under top_dir.
+
+    Index paths lose their leading "./" or "/", which is put back here.
+    """
+    lead = path_lead(top_dir)
+    return lambda path: cache.title(lead + path)
+
+
+def iter_directory_md(
+    top_dir: str = ".",
+    titles: TitleLookup | None = None,
+    rules: IgnoreRules | None = None,
+    index: IndexWriter | None = None,
+) -> Iterator[str]:
+    """Yield DIRECTORY.md lines while walking the tree depth first.
+
+    Only the directories on the current path are held in memory, so peak
+    memory follows depth and fan-out instead of the total number of files.
+    """
+    paths = sorted_file_paths(top_dir, rules=rules)
+    return directory_md_lines(paths, titles=titles, index=index)
+
+
+def print_directory_md(
+    top_dir: str = ".",
+    streaming: bool = False,
+    titles: TitleLookup | None = None,
+    rules: IgnoreRules | None = None,
+    index: IndexWriter | None = None,
+) -> None:
+    """SENATOROV."""
+    if streaming:
+        lines = iter_directory_md(top_dir, titles, rules, index)
+    else:
+        paths = sorted(good_file_paths(top_dir, rules=rules))
+        lines = directory_md_lines(paths, titles=titles, index=index)
+    for line in lines:
+        print(line)
+
+
+def list_directory(dir_path: str, rules: IgnoreRules, rel_dir: str = "") -> Listing:
+    """Return the indexed subdirectory and file names of one directory.
+
+    The entry type comes from readdir itself, so plain files are never stat-ed.
+    """
+    subdirs: list[str] = []
+    files: list[str] = []
+    try:
+        entries = os.scandir(dir_path)
+    except OSError:
+        return subdirs, files
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_symlink() and entry.is_dir():
+                continue  # os.walk lists linked directories but never enters them
+            elif is_good_file(entry.name):
+                files.append(entry.name)
+    return rules.keep(rel_dir, subdirs, True), rules.keep(rel_dir, files, False)
+
+
+def sorted_file_paths(
+    top_dir: str = ".",
+    pool: ThreadPoolExecutor | None = None,
+    rules: IgnoreRules | None = None,
+) -> Iterator[str]:
+    """Yield the paths of good_file_paths in sorted order, depth first.
+
+    Every directory is sorted on its own, with subdirectories keyed as
+    ``name/`` so the result matches a global sort of the full paths. With a
+    pool the subdirectories of each opened directory are listed ahead.
+    """
+    rules = rules or read_ignore_rules(top_dir)
+    # paths under "." lose their leading dots to lstrip("./"), so top-level
+    # dotfiles sort by the rest of their names, as in the global sort
+    strips_dots = not os.path.join(top_dir, "").lstrip("./")
+
+    def open_dir(dir_path: str, rel_dir: str, listing: Listing) -> Frame:
+        subdirs, files = listing
+        pending: dict[str, Future[Listing]] = {}
+        if pool:
+            pending = {
+                name: pool.submit(
+                    list_directory,
+                    os.path.join(dir_path, name),
+                    rules,
+                    child_path(rel_dir, name),
+                )
+                for name in subdirs
+            }
+        names = [name + os.sep for name in subdirs] + files
+        if strips_dots and not rel_dir:
+            names.sort(key=lambda name: name.lstrip("./"))
+        else:
+            names.sort()
+        return dir_path, rel_dir, iter(names), pending
+
+    def open_subdir(frame: Frame, name: str) -> Frame:
+        dir_path, rel_dir, _, pending = frame
+        child = os.path.join(dir_path, name)
+        rel_child = child_path(rel_dir, name)
+        future = pending.pop(name, None)
+        if future:
+            return open_dir(child, rel_child, future.result())
+        return open_dir(child, rel_child, list_directory(child, rules, rel_child))
+
+    stack = [open_dir(top_dir, "", list_directory(top_dir, rules))]
+    while stack:
+        dir_path, _, names, _ = stack[-1]
+        prefix = os.path.join(dir_path, "").lstrip("./")
+        for name in names:
+            if name[-1] == os.sep:
+                stack.append(open_subdir(stack[-1], name[:-1]))
+                break
+            yield prefix + name if prefix else name.lstrip("./")
+        else:
+            stack.pop()
+
+
+def scandir_file_paths(
+    top_dir: str = ".", max_workers: int = 8, rules: IgnoreRules | None = None
+) -> Iterator[str]:
+    """Yield sorted good file paths, listing directories on a thread pool."""
+    with ThreadPoolExecutor(max_workers) as pool:
+        yield from sorted_file_paths(top_dir, pool, rules)
+
+
+def scan_directory(dir_path: str, rules: IgnoreRules, rel_dir: str = "") -> DirRecord:
+    """List one directory the way good_file_paths filters it, with file stats."""
+    subdirs, files = list_directory(dir_path, rules, rel_dir)
+    record: DirRecord = {"mtime_ns": 0, "subdirs": subdirs, "files": {}}
+    for filename in files:
+        path = os.path.join(dir_path, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            try:
+                stat = os.lstat(path)  # dangling links are still listed
+            except OSError:
+                continue
+        record["files"][filename] = [stat.st_mtime_ns, stat.st_size]
+    return record
+
+
+def has_changed_files(dir_path: str, record: DirRecord) -> bool:
+    """Return True when a listed file of the directory was edited in place."""
+    for filename, (mtime_ns, size) in record["files"].items():
+        try:
+            stat = os.stat(os.path.join(dir_path, filename))
+        except OSError:
+            return True
+        if stat.st_mtime_ns != mtime_ns or stat.st_size != size:
+            return True
+    return False
+
+
+def refresh_tree(
+    top_dir: str,
+    old_dirs: dict[str, DirRecord],
+    rules: IgnoreRules,
+    check_files: bool = False,
+) -> tuple[dict[str, DirRecord], dict[str, str], set[str]]:
+    """Rescan directories whose mtime moved and reuse the cached rest.
+
+    With check_files the files of unchanged directories are stat-ed as well,
+    for indexes whose labels depend on file contents.
+
+    Returns the new directory records, the section every directory belongs to
+    and the set of directories that were added, removed or rescanned.
+    """
+    trusted_before = time.time_ns() - RACY_WINDOW_NS
+    dirs: dict[str, DirRecord] = {}
+    sections: dict[str, str] = {}
+    changed: set[str] = set()
+    stack: list[tuple[str, str]] = [(top_dir, "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            continue
+        record = old_dirs.get(dir_path)
+        if record is not None and check_files and has_changed_files(dir_path, record):
+            record = None
+        if record is None or record["mtime_ns"] != mtime_ns:
+            record = scan_directory(dir_path, rules, rel_dir)
+            record["mtime_ns"] = mtime_ns if mtime_ns < trusted_before else -1
+            changed.add(dir_path)
+        dirs[dir_path] = record
+        sections[dir_path] = rel_dir.partition("/")[0]
+        for subdir in record["subdirs"]:
+            stack.append((os.path.join(dir_path, subdir), child_path(rel_dir, subdir)))
+    changed.update(old_dirs.keys() - dirs.keys())
+    return dirs, sections, changed
+
+
+def empty_manifest(options: str = "") -> Manifest:
+    """Return a manifest that makes the next refresh scan everything."""
+    return {"version": MANIFEST_VERSION, "options": options, "dirs": {}, "sections": {}}
+
+
+def manifest_options(titles: TitleLookup | None, rules: IgnoreRules) -> str:
+    """Describe the settings a manifest was rendered with."""
+    return f"titles={titles is not None};rules={rules.fingerprint}"
+
+
+def read_manifest(manifest_path: str) -> Manifest:
+    """Read a manifest, starting from scratch when it is missing or stale."""
+    try:
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = cast(Manifest, json.load(file))
+    except (OSError, ValueError):
+        return empty_manifest()
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def write_manifest(manifest_path: str, manifest: Manifest) -> None:
+    """Write the manifest next to the tree it describes."""
+    atomic_write(manifest_path, json.dumps(manifest, separators=(",", ":")).encode())
+
+
+class SectionTree(TypedDict):
+    """Directory records of a tree and the directories of every top-level section.
+
+    A file at the top of the tree is a section of its own, with the top
+    directory as its only member.
+    """
+
+    top_dir: str
+    dirs: dict[str, DirRecord]
+    members: dict[str, list[str]]
+
+
+def section_tree(
+    top_dir: str, dirs: dict[str, DirRecord], dir_sections: dict[str, str]
+) -> SectionTree:
+    """Group the directories of a refreshed tree by their top-level section."""
+    members: dict[str, list[str]] = {}
+    for dir_path, section in dir_sections.items():
+        if section:
+            members.setdefault(section, []).append(dir_path)
+    top_files = dirs[top_dir]["files"] if top_dir in dirs else {}
+    for filename in top_files:
+        members[filename] = [top_dir]
+    return {"top_dir": top_dir, "dirs": dirs, "members": members}
+
+
+def section_paths(tree: SectionTree, section: str) -> list[str]:
+    """Return the sorted file paths of one top-level section."""
+    top_dir = tree["top_dir"]
+    members = tree["members"][section]
+    if top_dir in members:
+        return [os.path.join(top_dir, section).lstrip("./")]
+    return sorted(
+        os.path.join(dir_path, filename).lstrip("./")
+        for dir_path in members
+        for filename in tree["dirs"][dir_path]["files"]
+    )
+
+
+def stale_sections(
+    tree: SectionTree, changed: set[str], old_sections: dict[str, SectionRecord]
+) -> tuple[dict[str, list[str]], dict[str, str]]:
+    """Find the sections whose directories changed since they were rendered.
+
+    Returns the file paths of those sections and the first path of every
+    section, which orders them. Empty sections are left out.
+    """
+    dirty: dict[str, list[str]] = {}
+    firsts: dict[str, str] = {}
+    for section, members in tree["members"].items():
+        old = old_sections.get(section)
+        untouched = changed.isdisjoint(members)
+        if old is not None and untouched and sorted(old["dirs"]) == sorted(members):
+            firsts[section] = old["first"]
+            continue
+        paths = section_paths(tree, section)
+        if paths:
+            dirty[section] = paths
+            firsts[section] = paths[0]
+    return dirty, firsts
+
+
+def render_sections(
+    tree: SectionTree,
+    firsts: dict[str, str],
+    dirty: dict[str, list[str]],
+    old_sections: dict[str, SectionRecord],
+    titles: TitleLookup | None,
+) -> tuple[dict[str, SectionRecord], str]:
+    """Render the stale sections and reuse the rest, in the order of firsts.
+
+    A section is rendered again as well when the one before it now ends in
+    another directory, since its headings depend on where that one ended.
+    """
+    sections: dict[str, SectionRecord] = {}
+    chunks: list[str] = []
+    old_path = ""
+    for section in sorted(firsts, key=firsts.__getitem__):
+        old = old_sections.get(section)
+        if section in dirty or old is None or old["start"] != old_path:
+            paths = dirty.get(section) or section_paths(tree, section)
+            lines = directory_md_lines(paths, old_path, titles)
+            record: SectionRecord = {
+                "dirs": tree["members"][section],
+                "first": paths[0],
+                "start": old_path,
+                "end": os.path.split(paths[-1])[0],
+                "text": "".join(f"{line}\n" for line in lines),
+            }
+        else:
+            record = old
+        sections[section] = record
+        chunks.append(record["text"])
+        old_path = record["end"]
+    return sections, "".join(chunks)
+
+
+def refresh_manifest(
+    top_dir: str,
+    manifest: Manifest,
+    titles: TitleLookup | None = None,
+    rules: IgnoreRules | None = None,
+) -> tuple[Manifest, str]:
+    """Bring a manifest up to date with the tree and return it with the index text."""
+    rules = rules or read_ignore_rules(top_dir)
+    options = manifest_options(titles, rules)
+    if manifest["options"] != options:
+        manifest = empty_manifest(options)
+    dirs, dir_sections, changed = refresh_tree(
+        top_dir, manifest["dirs"], rules, check_files=titles is not None
+    )
+    tree = section_tree(top_dir, dirs, dir_sections)
+    dirty, firsts = stale_sections(tree, changed, manifest["sections"])
+    sections, text = render_sections(tree, firsts, dirty, manifest["sections"], titles)
+    fresh = empty_manifest(options)
+    fresh["dirs"] = dirs
+    fresh["sections"] = sections
+    return fresh, text
+
+
+def incremental_directory_md(
+    top_dir: str = ".",
+    manifest_path: str = MANIFEST_PATH,
+    titles: TitleLookup | None = None,
+) -> str:
+    """Return DIRECTORY.md text, re-rendering only sections whose directories changed.
+
+    The output is identical to print_directory_md; the manifest keeps the stat
+    snapshot and the rendered text of every top-level section between runs.
+    """
+    manifest, text = refresh_manifest(top_dir, read_manifest(manifest_path), titles)
+    write_manifest(manifest_path, manifest)
+    return text
+
+
+def stat_snapshot(paths: Iterable[str]) -> dict[str, int]:
+    """Return the mtime of every path, -1 for the ones that vanished."""
+    snapshot: dict[str, int] = {}
+    for path in paths:
+        try:
+            snapshot[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            snapshot[path] = -1
+    return snapshot
+
+
+def manifest_snapshot(manifest: Manifest, with_files: bool = False) -> dict[str, int]:
+    """Return the mtimes a manifest recorded, in the shape of stat_snapshot."""
+    snapshot: dict[str, int] = {}
+    for dir_path, record in manifest["dirs"].items():
+        snapshot[dir_path] = record["mtime_ns"]
+        if with_files:
+            for filename, (mtime_ns, _) in record["files"].items():
+                snapshot[os.path.join(dir_path, filename)] = mtime_ns
+    return snapshot
+
+
+class PollIntervals(NamedTuple):
+    """Seconds between polls of a quiet tree, and of one that is changing."""
+
+    idle: float = 2.0
+    debounce: float = 0.5
+
+
+DEFAULT_POLL = PollIntervals()
+
+
+def wait_for_change(known: dict[str, int], poll: PollIntervals) -> None:
+    """Return once the mtimes of the known paths moved and then held still.
+
+    Polling speeds up to the debounce period after the first change, so a
+    burst of edits is waited out in one go.
+    """
+    while (current := stat_snapshot(known)) == known:
+        time.sleep(poll.idle)
+    previous: dict[str, int] = {}
+    while current != previous:
+        previous = current
+        time.sleep(poll.debounce)
+        current = stat_snapshot(known)
+
+
+def watch_directory_md(
+    top_dir: str = ".",
+    output_path: str = OUTPUT_PATH,
+    manifest_path: str = MANIFEST_PATH,
+    title_cache: TitleCache | None = None,
+    poll: PollIntervals = DEFAULT_POLL,
+) -> None:
+    """Keep output_path up to date by polling directory mtimes.
+
+    Only directories are stat-ed between changes, since adding, removing or
+    renaming an indexed file always moves the mtime of its directory. With a
+    title cache the files are polled too, as editing a title does not. The
+    affected sections are re-rendered once the change has settled.
+    """
+    titles = title_lookup(top_dir, title_cache) if title_cache else None
+    rules = read_ignore_rules(top_dir)
+    manifest = read_manifest(manifest_path)
+    while True:
+        manifest, text = refresh_manifest(top_dir, manifest, titles, rules)
+        write_manifest(manifest_path, manifest)
+        if title_cache:
+            title_cache.write()
+        if written := atomic_write(output_path, text.encode("utf-8")):
+            print(f"{output_path}: {written} bytes written", file=sys.stderr)
+        wait_for_change(
+            manifest_snapshot(manifest, with_files=title_cache is not None), poll
+        )
+
+
+def atomic_write(path: str, data: bytes) -> int:
+    """Replace path with data through a temporary file and a rename.
+
+    Returns the number of bytes written, or 0 when the file already holds the
+    same content and was left untouched.
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as file:
+                existing = hashlib.sha256(file.read()).digest()
+            if existing == hashlib.sha256(data).digest():
+                return 0
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o644
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(data)
+
+
+def render_directory_md(lines: Iterable[str]) -> bytes:
+    """Join DIRECTORY.md lines into one buffer, as print() would have written them."""
+    buffer = io.StringIO()
+    for line in lines:
+        buffer.write(line)
+        buffer.write("\n")
+    return buffer.getvalue().encode("utf-8")
+
+
+def write_directory_md(
+    top_dir: str = ".",
+    output_path: str = OUTPUT_PATH,
+    manifest_path: str | None = None,
+    titles: TitleLookup | None = None,
+    index: IndexWriter | None = None,
+) -> int:
+    """Atomically replace output_path with the index of top_dir.
+
+    With a manifest_path the index is rendered incrementally from that
+    manifest, otherwise from a full walk. Returns the number of bytes
+    written; 0 means the index was unchanged and the file was not touched.
+    """
+    if manifest_path:
+        text = incremental_directory_md(top_dir, manifest_path, titles)
+        data = text.encode("utf-8")
+    else:
+        data = render_directory_md(iter_directory_md(top_dir, titles, index=index))
+    return atomic_write(output_path, data)
+
+
+def report_written(output_path: str, written: int) -> None:
+    """Tell on stderr whether the output file was rewritten."""
+    status = f"{written} bytes written" if written else "unchanged"
+    print(f"{output_path}: {status}", file=sys.stderr)
+
+
+def write_with_index(
+    args: argparse.Namespace, titles: TitleLookup | None, index: IndexWriter
+) -> None:
+    """Print or write DIRECTORY.md and fill the index outputs in the same walk."""
+    with index:
+        if args.output:
+            written = write_directory_md(
+                args.top_dir, args.output, titles=titles, index=index
+            )
+            report_written(args.output, written)
+        else:
+            print_directory_md(args.top_dir, args.stream, titles, index=index)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Build DIRECTORY.md for the tree given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("top_dir", nargs="?", default=".")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="reuse the stat manifest and re-render only changed sections",
+    )
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="emit lines during a depth-first walk instead of sorting all paths",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="poll the tree and rewrite the output file whenever it changes",
+    )
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL.idle)
+    parser.add_argument("--debounce", type=float, default=DEFAULT_POLL.debounce)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help=f"atomically write the index to a file, e.g. {OUTPUT_PATH}",
+    )
+    parser.add_argument(
+        "--titles",
+        action="store_true",
+        help="label entries with the docstring or first markdown cell of each file",
+    )
+    parser.add_argument("--title-cache", default=TITLE_CACHE_PATH)
+    parser.add_argument(
+        "--jsonl", help="also write the index as JSON lines, from the same walk"
+    )
+    parser.add_argument(
+        "--sqlite", help="also write the index to an SQLite entries table"
+    )
+    args = parser.parse_args(argv)
+    if (args.jsonl or args.sqlite) and (args.incremental or args.watch):
+        parser.error("--jsonl and --sqlite need a full walk")
+    cache = TitleCache(args.title_cache) if args.titles else None
+    titles = title_lookup(args.top_dir, cache) if cache else None
+    index = open_index(args.top_dir, args.jsonl, args.sqlite)
+    if args.watch:
+        try:
+            watch_directory_md(
+                args.top_dir,
+                args.output or OUTPUT_PATH,
+                args.manifest,
+                cache,
+                PollIntervals(args.interval, args.debounce),
+            )
+        except KeyboardInterrupt:
+            pass
+    elif index:
+        write_with_index(args, titles, index)
+    elif args.output:
+        manifest_path = args.manifest if args.incremental else None
+        written = write_directory_md(args.top_dir, args.output, manifest_path, titles)
+        report_written(args.output, written)
+    elif args.incremental:
+        sys.stdout.write(incremental_directory_md(args.top_dir, args.manifest, titles))
+    else:
+        print_directory_md(args.top_dir, args.stream, titles)
+    if cache:
+        cache.write()
 
 
 if __name__ == "__main__":
-    print_directory_md(".")
+    main()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""Run a chapter cell by cell, reusing cached results of unchanged cells."""
+import argparse
+import ast
+import contextlib
+import hashlib
+import importlib
+import io
+import marshal
+import os
+import pickle
+import sqlite3
+import sys
+import time
+import types
+from collections.abc import Iterable, Iterator
+from typing import ParamSpec, TextIO, TypeVar, cast
+
+from chapter_harness import (
+    DEFAULT_ANSWERS,
+    BlockResult,
+    LocalPaths,
+    add_answers_option,
+    exec_block,
+    first_line,
+    headless_environment,
+    light_cells,
+    patched,
+    print_report,
+    source_label,
+)
+
+CACHE_PATH = ".cell_cache.db"
+CACHE_VERSION = 1
+# files the chapters write stay here between runs, for cells that read them back
+WORK_DIR = ".cell_cache_work"
+DEFAULT_MAX_BYTES = 512 << 20
+SCHEMA = (
+    """CREATE TABLE cells (
+        key BLOB PRIMARY KEY,
+        used INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )""",
+    "CREATE INDEX cells_used ON cells (used)",
+)
+# the namespace itself, stored by reference so cached functions keep their globals
+NAMESPACE_ID = "namespace"
+
+# (key, first line, label, source, code) of one cell
+Cell = tuple[bytes, int, str, str, types.CodeType]
+# (changed names and their values, deleted names, printed output) of one cell
+Delta = tuple[dict[str, object], list[str], str]
+
+
+def chained_keys(sources: Iterable[str], seed: str) -> Iterator[bytes]:
+    """Yield a key per cell that covers its source and every cell above it.
+
+    >>> a, b = chained_keys(["x = 1", "y = x"], "")
+    >>> c, d = chained_keys(["x = 2", "y = x"], "")
+    >>> a != c and b != d
+    True
+    """
+    key = hashlib.sha256(seed.encode()).digest()
+    for source in sources:
+        key = hashlib.sha256(key + source.encode()).digest()
+        yield key
+
+
+def imported_names(source: str) -> Iterator[str]:
+    r"""Yield the top-level names of the absolute imports in a module.
+
+    >>> list(imported_names("import os.path\nfrom . import x\nfrom numpy import pi"))
+    ['os', 'numpy']
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield alias.name.partition(".")[0]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            yield node.module.partition(".")[0]
+
+
+def module_files(directory: str, name: str) -> list[str]:
+    """Return the file of module name in directory, or every file of the package."""
+    path = os.path.join(directory, name)
+    if os.path.isfile(path + ".py"):
+        return [path + ".py"]
+    if not os.path.isfile(os.path.join(path, "__init__.py")):
+        return []
+    return sorted(
+        os.path.join(dir_path, file_name)
+        for dir_path, _, file_names in os.walk(path)
+        for file_name in file_names
+        if file_name.endswith(".py")
+    )
+
+
+def local_modules(source: str, directory: str) -> dict[str, bytes]:
+    """Return the contents of the modules in directory a chapter imports.
+
+    Modules those import in turn are followed as well. Cells that call
+    into them can give other results once they are edited, so their
+    contents go into the seed of the cell keys.
+    """
+    modules: dict[str, bytes] = {}
+    pending = [source]
+    while pending:
+        for name in imported_names(pending.pop()):
+            for path in module_files(directory, name):
+                if path in modules:
+                    continue
+                with open(path, "rb") as file:
+                    modules[path] = file.read()
+                pending.append(modules[path].decode("utf-8", "replace"))
+    return modules
+
+
+def cache_seed(source: str, path: str, answers: list[str]) -> str:
+    """Return what the key of every cell of a chapter depends on besides its text.
+
+    That is the cache format, the Python version, the answers to input()
+    and the local modules the chapter imports.
+    """
+    modules = local_modules(source, os.path.dirname(path))
+    digests = [hashlib.sha256(data).hexdigest() for data in modules.values()]
+    return "\0".join([str(CACHE_VERSION), sys.version, *answers, *digests])
+
+
+def chapter_cells(source: str, filename: str, workdir: str, seed: str) -> list[Cell]:
+    """Split a chapter into light cells and compile them.
+
+    Keys are taken from the cell text as written, before Colab and Windows
+    paths are pointed into workdir, so moving the work directory keeps them.
+    """
+    lines = source.splitlines()
+    tree = LocalPaths(workdir).visit(ast.parse(source, filename))
+    nodes = light_cells(source, tree)
+    texts = [
+        "\n".join(lines[first_line(cell[0]) - 1 : cell[-1].end_lineno])
+        for cell in nodes
+    ]
+    return [
+        (
+            key,
+            cell[0].lineno,
+            source_label(text),
+            text,
+            compile(ast.Module(body=cell, type_ignores=[]), filename, "exec"),
+        )
+        for key, cell, text in zip(chained_keys(texts, seed), nodes, texts)
+    ]
+
+
+def referenced_names(code: types.CodeType) -> set[str]:
+    """Return the global names a cell, or a function defined in it, mentions."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= referenced_names(const)
+    return names
+
+
+def make_function(
+    code: types.CodeType,
+    namespace: dict[str, object],
+    names: tuple[str, str],
+    defaults: tuple[tuple[object, ...] | None, dict[str, object] | None],
+    closure: tuple[types.CellType, ...] | None,
+) -> types.FunctionType:
+    """Rebuild a function defined by a chapter, with the chapter as globals.
+
+    names are the name and qualified name, defaults the positional and
+    keyword-only defaults.
+    """
+    function = types.FunctionType(code, namespace, names[0], defaults[0], closure)
+    function.__qualname__ = names[1]
+    function.__kwdefaults__ = defaults[1]
+    return function
+
+
+def make_type_variable(
+    name: str,
+    constraints: tuple[object, ...] | None,
+    bound: object,
+    variance: tuple[bool, bool],
+) -> TypeVar | ParamSpec:
+    """Rebuild a TypeVar, or a ParamSpec when constraints is None."""
+    covariant, contravariant = variance
+    if constraints is None:
+        return ParamSpec(
+            name, bound=bound, covariant=covariant, contravariant=contravariant
+        )
+    return TypeVar(
+        name,
+        *constraints,
+        bound=bound,
+        covariant=covariant,
+        contravariant=contravariant,
+    )
+
+
+def make_cell(*contents: object) -> types.CellType:
+    """Rebuild a closure cell, empty when no contents are given."""
+    return types.CellType(*contents)
+
+
+def reduce_cell(closure_cell: types.CellType) -> tuple[object, tuple[object, ...]]:
+    """Return how make_cell() rebuilds a closure cell."""
+    try:
+        return make_cell, (closure_cell.cell_contents,)
+    except ValueError:  # the cell is empty
+        return make_cell, ()
+
+
+class NamespacePickler(pickle.Pickler):
+    """Pickle what a chapter binds, including the functions it defines.
+
+    Functions and closures of the chapter cannot be pickled by name, since
+    the chapter is not an importable module; they are stored by value, with
+    the namespace itself as a persistent reference, and so are its type
+    variables. Modules are stored by name and imported again when loaded.
+    Classes the chapter defines are still pickled by name and fail.
+    """
+
+    def __init__(self, buffer: io.BytesIO, namespace: dict[str, object]) -> None:
+        """Pickle to buffer, referring to namespace instead of copying it."""
+        super().__init__(buffer, pickle.HIGHEST_PROTOCOL)
+        self.namespace = namespace
+
+    def persistent_id(self, obj: object) -> str | None:
+        """Refer to the chapter namespace by name."""
+        return NAMESPACE_ID if obj is self.namespace else None
+
+    def reducer_override(self, obj: object) -> object:
+        """Store chapter functions, closures, type variables and modules."""
+        if isinstance(obj, types.FunctionType) and obj.__globals__ is self.namespace:
+            return (
+                make_function,
+                (
+                    obj.__code__,
+                    self.namespace,
+                    (obj.__name__, obj.__qualname__),
+                    (obj.__defaults__, obj.__kwdefaults__),
+                    obj.__closure__,
+                ),
+                obj.__dict__ or None,
+            )
+        if isinstance(obj, types.CellType):
+            return reduce_cell(obj)
+        if isinstance(obj, (TypeVar, ParamSpec)) and obj.__module__ == "__main__":
+            constraints = obj.__constraints__ if isinstance(obj, TypeVar) else None
+            variance = (obj.__covariant__, obj.__contravariant__)
+            return (
+                make_type_variable,
+                (obj.__name__, constraints, obj.__bound__, variance),
+            )
+        if isinstance(obj, types.CodeType):
+            return marshal.loads, (marshal.dumps(obj),)
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+class NamespaceUnpickler(pickle.Unpickler):
+    """Load what NamespacePickler wrote into a live namespace."""
+
+    def __init__(self, buffer: io.BytesIO, namespace: dict[str, object]) -> None:
+        """Read from buffer, resolving the namespace reference to namespace."""
+        super().__init__(buffer)
+        self.namespace = namespace
+
+    # pickle.Unpickler calls the hook by this name
+    def persistent_load(self, pid: object) -> object:  # noqa: FNE004
+        """Return the namespace for its reference."""
+        if pid != NAMESPACE_ID:
+            raise pickle.UnpicklingError(f"unknown reference {pid!r}")
+        return self.namespace
+
+
+def pickle_namespace(obj: object, namespace: dict[str, object]) -> bytes | None:
+    """Pickle obj, or return None when it cannot be pickled."""
+    buffer = io.BytesIO()
+    try:
+        NamespacePickler(buffer, namespace).dump(obj)
+    except (pickle.PicklingError, TypeError, AttributeError, ValueError):
+        return None
+    return buffer.getvalue()
+
+
+def unpickle_namespace(data: bytes, namespace: dict[str, object]) -> Delta:
+    """Unpickle a cell delta that refers to namespace."""
+    return cast(Delta, NamespaceUnpickler(io.BytesIO(data), namespace).load())
+
+
+class TeeOutput(io.StringIO):
+    """Keep a copy of everything written while passing it on."""
+
+    def __init__(self, stream: TextIO) -> None:
+        """Pass every write on to stream."""
+        super().__init__()
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        """Write to both the copy and the stream."""
+        self.stream.write(text)
+        return super().write(text)
+
+
+def open_cell_cache(cache_path: str = CACHE_PATH) -> sqlite3.Connection:
+    """Open the cache, starting from scratch when written by another version."""
+    connection = sqlite3.connect(cache_path, isolation_level=None)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != CACHE_VERSION:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("DROP TABLE IF EXISTS cells")
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+        connection.execute("COMMIT")
+    connection.execute("PRAGMA journal_mode = WAL")
+    return connection
+
+
+def evict(connection: sqlite3.Connection, max_bytes: int) -> int:
+    """Drop the least recently used cells beyond max_bytes; return how many."""
+    return connection.execute(
+        """DELETE FROM cells WHERE key IN (
+            SELECT key FROM (
+                SELECT key, SUM(size) OVER (ORDER BY used DESC, key) AS kept
+                FROM cells
+            ) WHERE kept > ?
+        )""",
+        (max_bytes,),
+    ).rowcount
+
+
+def restore_cells(
+    connection: sqlite3.Connection, cells: list[Cell], namespace: dict[str, object]
+) -> Iterator[BlockResult]:
+    """Apply the cached deltas of the leading cells found in the cache.
+
+    Stops at the first cell that is missing or cannot be loaded; the output
+    each restored cell printed is printed again.
+    """
+    for key, line, label, _, _ in cells:
+        start = time.perf_counter()
+        query = "SELECT data FROM cells WHERE key = ?"
+        row = connection.execute(query, (key,)).fetchone()
+        if row is None:
+            return
+        try:
+            delta, deleted, output = unpickle_namespace(row[0], namespace)
+        # a stale entry can fail in whatever reducer it names; the cell is
+        # run again instead
+        except Exception:  # pylint: disable=broad-exception-caught
+            return
+        namespace.update(delta)
+        for name in deleted:
+            namespace.pop(name, None)
+        sys.stdout.write(output)
+        connection.execute(
+            "UPDATE cells SET used = ? WHERE key = ?", (time.time_ns(), key)
+        )
+        yield {
+            "line": line,
+            "source": label,
+            "seconds": time.perf_counter() - start,
+            "peak_bytes": 0,
+            "error": "",
+        }
+
+
+def cell_delta(
+    namespace: dict[str, object],
+    ids: dict[str, int],
+    before: dict[str, bytes | None],
+    output: str,
+) -> bytes | None:
+    """Pickle what a cell changed in namespace, given its state before the cell.
+
+    ids are the ids of the values bound before, and before the pickled
+    values of the names the cell mentions.
+    """
+    changed = {
+        name: value
+        for name, value in namespace.items()
+        if name != "__builtins__" and ids.get(name) != id(value)
+    }
+    for name in before.keys() & namespace.keys() - changed.keys():
+        dumped = before[name]
+        if dumped is None or pickle_namespace(namespace[name], namespace) != dumped:
+            changed[name] = namespace[name]
+    deleted = [name for name in ids if name not in namespace]
+    return pickle_namespace((changed, deleted, output), namespace)
+
+
+def execute_cell(
+    compiled: Cell, namespace: dict[str, object]
+) -> tuple[BlockResult, bytes | None]:
+    """Run one cell and return its result and pickled delta.
+
+    The delta holds the names the cell bound or rebound, the names it
+    deleted, and the global names it mentions whose pickled value changed,
+    which catches in-place edits like ``numbers.append(4)``. It is None when
+    the cell failed or left something that cannot be pickled.
+    """
+    _, line, label, _, code = compiled
+    ids = {name: id(value) for name, value in namespace.items()}
+    mentioned = referenced_names(code) & namespace.keys()
+    before = {name: pickle_namespace(namespace[name], namespace) for name in mentioned}
+    start = time.perf_counter()
+    with patched(sys, "stdout", TeeOutput(sys.stdout)):
+        output = cast(TeeOutput, sys.stdout)
+        error = exec_block(code, namespace)
+    result: BlockResult = {
+        "line": line,
+        "source": label,
+        "seconds": time.perf_counter() - start,
+        "peak_bytes": 0,
+        "error": error,
+    }
+    if error:
+        return result, None
+    return result, cell_delta(namespace, ids, before, output.getvalue())
+
+
+def store_cells(
+    connection: sqlite3.Connection, cells: list[Cell], namespace: dict[str, object]
+) -> Iterator[BlockResult]:
+    """Run the cells and store their deltas, up to the first that has none."""
+    storing = True
+    for cell in cells:
+        result, data = execute_cell(cell, namespace)
+        yield result
+        # a cell can only be restored on top of every cell above it
+        storing = storing and data is not None
+        if storing and data is not None:
+            connection.execute(
+                "INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?)",
+                (cell[0], time.time_ns(), len(data), data),
+            )
+
+
+def run_cached_chapter(
+    connection: sqlite3.Connection,
+    path: str,
+    answers: Iterable[str] = DEFAULT_ANSWERS,
+    workdir: str | None = None,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> tuple[list[BlockResult], int]:
+    """Run a chapter headless from its first changed cell.
+
+    Every cell is keyed by a hash of its source chained with the cells above
+    it, so editing a cell invalidates it and everything after it; editing a
+    module next to the chapter that it imports invalidates every cell. The
+    namespace is rebuilt from the cached deltas of the unchanged cells, and
+    the rest run and are stored. Returns the cell results and how many came
+    from the cache.
+
+    Files that cached cells wrote are not written again, so the default
+    work directory is kept between runs. Names that share one object in the
+    chapter may get separate copies from the cache, and changes made only
+    through a function call to a global the cell never mentions go unseen.
+    """
+    path = os.path.abspath(path)
+    with open(path, encoding="utf-8") as file:
+        source = file.read()
+    answers = list(answers)
+    if workdir is None:
+        chapter = os.path.splitext(os.path.basename(path))[0]
+        workdir = os.path.join(WORK_DIR, chapter)
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    cells = chapter_cells(source, path, workdir, cache_seed(source, path, answers))
+    namespace: dict[str, object] = {"__name__": "__main__", "__file__": path}
+    results: list[BlockResult] = []
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(headless_environment(workdir, answers))
+        stack.enter_context(patched(sys, "path", [os.path.dirname(path), *sys.path]))
+        results += restore_cells(connection, cells, namespace)
+        n_cached = len(results)
+        results += store_cells(connection, cells[n_cached:], namespace)
+    evict(connection, max_bytes)
+    return results, n_cached
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run one chapter from the command line with the cell cache."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("chapter", help="e.g. python/makarov/chapter_10_numpy.py")
+    add_answers_option(parser)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument(
+        "--max-mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1 << 20),
+        help="evict the least recently used cells beyond this size",
+    )
+    parser.add_argument("--workdir", help=f"default: {WORK_DIR}/<chapter>")
+    parser.add_argument("--top", type=int, default=15, help="0 lists every cell")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="hide what the chapter prints"
+    )
+    args = parser.parse_args(argv)
+    connection = open_cell_cache(args.cache)
+    with contextlib.ExitStack() as stack:
+        if args.quiet:
+            devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        results, n_cached = run_cached_chapter(
+            connection,
+            args.chapter,
+            args.answers or DEFAULT_ANSWERS,
+            args.workdir,
+            int(args.max_mb * (1 << 20)),
+        )
+    connection.close()
+    print_report(results, args.top)
+    print(f"{n_cached} of {len(results)} cells from the cache", file=sys.stderr)
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
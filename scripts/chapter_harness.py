@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""Run the Makarov chapter scripts offline and without a user at the keyboard."""
+import argparse
+import ast
+import builtins
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+import types
+import urllib.parse
+import urllib.request
+import zipfile
+from collections.abc import Callable, Iterable, Iterator
+from types import CodeType
+from typing import Protocol, TypedDict, cast
+
+try:
+    import openpyxl
+except ImportError:  # read_excel needs openpyxl as well, so that chapter fails anyway
+    openpyxl = None
+
+# answers given to input() when none are scripted on the command line
+DEFAULT_ANSWERS = ("5",)
+# local paths the chapters were written against, mapped into the work directory
+PATH_PREFIXES = {
+    "/content/": "content/",
+    "K:\\Storage\\makarov\\": "storage/",
+}
+WEB_DIR = "web"
+TITANIC_HEADER = (
+    "PassengerId,Survived,Pclass,Name,Sex,Age,SibSp,Parch,Ticket,Fare,Cabin,Embarked"
+)
+TITANIC_ROWS = (
+    '1,0,3,"Braund, Mr. Owen Harris",male,22,1,0,A/5 21171,7.25,,S',
+    '2,1,1,"Cumings, Mrs. John Bradley",female,38,1,0,PC 17599,71.2833,C85,C',
+    '3,1,3,"Heikkinen, Miss. Laina",female,26,0,0,STON/O2. 3101282,7.925,,S',
+    '4,1,1,"Futrelle, Mrs. Jacques Heath",female,35,1,0,113803,53.1,C123,S',
+    '5,0,3,"Allen, Mr. William Henry",male,35,0,0,373450,8.05,,S',
+)
+TITANIC_EXAMPLE_CSV = "PassengerId,Survived\n892,0\n893,1\n"
+TEMPERATURE_CSV = "Date,Temp\n2019-01-01,-8.4\n2019-01-2,-6.1\n2019-02,-4.5\n"
+WORLD_POPULATION_HTML = """<html><body><table>
+<caption>World population milestones</caption>
+<tr><th>Population</th><th>Year</th></tr>
+<tr><td>1</td><td>1804</td></tr>
+<tr><td>2</td><td>1927</td></tr>
+<tr><td>8</td><td>2022</td></tr>
+</table></body></html>
+"""
+IRIS_ROWS = (
+    ("sepal_length", "sepal_width", "petal_length", "petal_width", "species"),
+    (5.1, 3.5, 1.4, 0.2, "setosa"),
+    (7.0, 3.2, 4.7, 1.4, "versicolor"),
+    (6.3, 3.3, 6.0, 2.5, "virginica"),
+)
+
+
+class BlockResult(TypedDict):
+    """Timing of one top-level statement, or of one cell."""
+
+    line: int
+    source: str
+    seconds: float
+    peak_bytes: int
+    error: str
+
+
+Block = tuple[int, str, CodeType]
+
+
+def titanic_csv(survived: bool = True) -> str:
+    """Return a few rows of the Kaggle Titanic data the chapters read."""
+    lines = [TITANIC_HEADER, *TITANIC_ROWS]
+    if not survived:
+        splits = (line.split(",", 2) for line in lines)
+        lines = [f"{passenger},{rest}" for passenger, _, rest in splits]
+    return "\n".join(lines) + "\n"
+
+
+def write_fixtures(workdir: str) -> None:
+    """Create the files and web pages the chapters expect, in small versions."""
+    content = os.path.join(workdir, PATH_PREFIXES["/content/"])
+    storage = os.path.join(workdir, PATH_PREFIXES["K:\\Storage\\makarov\\"])
+    titanic = os.path.join(
+        workdir, WEB_DIR, "www.dmitrymakarov.ru", "wp-content", "uploads", "2021", "11"
+    )
+    wiki = os.path.join(workdir, WEB_DIR, "en.wikipedia.org", "wiki")
+    for path in (content, storage, titanic, wiki):
+        os.makedirs(path, exist_ok=True)
+    files = {
+        os.path.join(content, "train.csv"): titanic_csv(),
+        os.path.join(content, "test.csv"): titanic_csv(survived=False),
+        os.path.join(titanic, "titanic_example.csv"): TITANIC_EXAMPLE_CSV,
+        os.path.join(wiki, "World_population"): WORLD_POPULATION_HTML,
+        os.path.join(workdir, "temperature.csv"): TEMPERATURE_CSV,
+    }
+    for path, text in files.items():
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            file.write(text)
+    with zipfile.ZipFile(os.path.join(storage, "train.zip"), "w") as archive:
+        archive.writestr("train.csv", titanic_csv())
+    with contextlib.closing(sqlite3.connect(os.path.join(storage, "chinook.db"))) as db:
+        db.execute("DROP TABLE IF EXISTS tracks")
+        db.execute("CREATE TABLE tracks (TrackId INTEGER, Name TEXT, Milliseconds INT)")
+        db.executemany(
+            "INSERT INTO tracks VALUES (?, ?, ?)",
+            [(1, "For Those About To Rock", 343719), (2, "Balls to the Wall", 342562)],
+        )
+        db.commit()
+    if openpyxl is None:
+        return
+    workbook = openpyxl.Workbook()
+    for row in IRIS_ROWS:
+        workbook.active.append(row)
+    workbook.save(os.path.join(storage, "iris.xlsx"))
+
+
+def fake_colab_files(workdir: str) -> types.ModuleType:
+    """Return a stand-in for google.colab.files backed by the work directory.
+
+    upload() hands back the fixture files of /content, the way Colab returns
+    what the user picked; download() copies into a downloads directory.
+    """
+    content = os.path.join(workdir, PATH_PREFIXES["/content/"])
+    downloads = os.path.join(workdir, "downloads")
+
+    def upload() -> dict[str, bytes]:
+        uploaded: dict[str, bytes] = {}
+        for name in sorted(os.listdir(content)):
+            with open(os.path.join(content, name), "rb") as file:
+                uploaded[name] = file.read()
+        return uploaded
+
+    def download(filename: str) -> None:
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f"Cannot find file: {filename}")
+        os.makedirs(downloads, exist_ok=True)
+        shutil.copy(filename, downloads)
+
+    module = types.ModuleType("google.colab.files")
+    setattr(module, "upload", upload)
+    setattr(module, "download", download)
+    return module
+
+
+class LocalPaths(ast.NodeTransformer):
+    """Point string literals with Colab or Windows paths into the work directory."""
+
+    def __init__(self, workdir: str) -> None:
+        """Map every known prefix to a directory under workdir."""
+        self.prefixes = {
+            prefix: os.path.join(workdir, local)
+            for prefix, local in PATH_PREFIXES.items()
+        }
+
+    # ast.NodeTransformer finds visitors by the name of the node class
+    def visit_Constant(self, node: ast.Constant) -> ast.Constant:  # noqa: N802
+        """Rewrite one literal."""
+        if isinstance(node.value, str):
+            for prefix, local in self.prefixes.items():
+                if node.value.startswith(prefix):
+                    rest = node.value[len(prefix) :].replace("\\", "/")
+                    return ast.copy_location(ast.Constant(local + rest), node)
+        return node
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve fixture pages without logging every request."""
+
+    # the parameter is named as in BaseHTTPRequestHandler.log_message
+    # pylint: disable-next=redefined-builtin
+    def log_message(self, format: str, *args: object) -> None:  # noqa: VNE003
+        """Stay quiet."""
+
+
+@contextlib.contextmanager
+def fixture_server(web_dir: str) -> Iterator[str]:
+    """Serve web_dir on a free local port and yield its base URL."""
+    handler = functools.partial(FixtureHandler, directory=web_dir)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def local_url(remote_url: str, base_url: str) -> str:
+    """Map a remote URL onto the fixture server, keeping host and path.
+
+    >>> local_url("https://example.org/data/titanic.csv?raw=1", "http://127.0.0.1:8")
+    'http://127.0.0.1:8/example.org/data/titanic.csv'
+    """
+    parts = urllib.parse.urlsplit(remote_url)
+    if parts.scheme not in ("http", "https") or remote_url.startswith(base_url):
+        return remote_url
+    return f"{base_url}/{parts.netloc}{parts.path}"
+
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    """Change the working directory for the duration of the block."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def stand_in_modules(stand_ins: dict[str, types.ModuleType]) -> Iterator[None]:
+    """Make imports of the given names return the given modules."""
+    originals = {name: sys.modules.get(name) for name in stand_ins}
+    sys.modules.update(stand_ins)
+    try:
+        yield
+    finally:
+        for name, original in originals.items():
+            if original is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = original
+
+
+@contextlib.contextmanager
+def environment_variable(name: str, value: str) -> Iterator[None]:
+    """Set an environment variable for the duration of the block."""
+    original = os.environ.get(name)
+    os.environ[name] = value
+    try:
+        yield
+    finally:
+        if original is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = original
+
+
+@contextlib.contextmanager
+def patched(owner: object, name: str, value: object) -> Iterator[None]:
+    """Replace an attribute for the duration of the block."""
+    missing = object()
+    original = getattr(owner, name, missing)
+    setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        if original is missing:
+            delattr(owner, name)
+        else:
+            setattr(owner, name, original)
+
+
+class UrlOpener(Protocol):
+    """urllib.request.urlopen, as the stand-in forwards to it."""
+
+    def __call__(self, url: object, /, *args: object, **kwargs: object) -> object:
+        """Open url."""
+
+
+def scripted_input(answers: Iterable[str]) -> Callable[[object], str]:
+    """Return an input() that answers from a script, repeating the last answer.
+
+    The prompt and the answer are echoed, so the output reads like a session.
+    """
+    script = iter(answers)
+    last = ""
+
+    def answer(prompt: object = "") -> str:
+        nonlocal last
+        last = next(script, last)
+        print(f"{prompt}{last}")
+        return last
+
+    return answer
+
+
+@contextlib.contextmanager
+def headless_environment(
+    workdir: str, answers: Iterable[str] = DEFAULT_ANSWERS
+) -> Iterator[None]:
+    """Run the enclosed code offline, non-interactively, inside workdir.
+
+    input() follows the script, google.colab.files works on local files,
+    plots go to the Agg backend and plt.show() only closes them, and urllib
+    requests to remote hosts are answered by a local fixture server.
+    """
+    answers = list(answers)
+    write_fixtures(workdir)
+    files = fake_colab_files(workdir)
+    colab = types.ModuleType("google.colab")
+    setattr(colab, "files", files)
+    google = types.ModuleType("google")
+    setattr(google, "colab", colab)
+    modules = {"google": google, "google.colab": colab, "google.colab.files": files}
+    urlopen = cast(UrlOpener, urllib.request.urlopen)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(environment_variable("MPLBACKEND", "Agg"))
+        base_url = stack.enter_context(fixture_server(os.path.join(workdir, WEB_DIR)))
+
+        def local_urlopen(url: object, *args: object, **kwargs: object) -> object:
+            if isinstance(url, urllib.request.Request):
+                url.full_url = local_url(url.full_url, base_url)
+            elif isinstance(url, str):
+                url = local_url(url, base_url)
+            return urlopen(url, *args, **kwargs)
+
+        stack.enter_context(patched(urllib.request, "urlopen", local_urlopen))
+        stack.enter_context(patched(builtins, "input", scripted_input(answers)))
+        stack.enter_context(patched(sys, "stdin", io.StringIO("\n".join(answers))))
+        stack.enter_context(stand_in_modules(modules))
+        try:
+            # pyplot fixes its backend on import, so only after MPLBACKEND is set
+            import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            pass
+        else:
+            stack.enter_context(patched(plt, "show", lambda *_, **__: plt.close("all")))
+        stack.enter_context(working_directory(workdir))
+        yield
+
+
+def source_label(source: str, width: int = 60) -> str:
+    r"""Return the first non-blank line of a block, cut to width.
+
+    >>> source_label("\n@timer\ndef slow() -> None:\n    pass")
+    '@timer'
+    """
+    line = next((line.strip() for line in source.splitlines() if line.strip()), "")
+    return line if len(line) <= width else line[: width - 1] + "…"
+
+
+def statement_blocks(source: str, filename: str, workdir: str) -> list[Block]:
+    """Compile every top-level statement of a script on its own.
+
+    Colab and Windows paths in string literals are pointed into workdir.
+    """
+    tree = LocalPaths(workdir).visit(ast.parse(source, filename))
+    blocks: list[Block] = []
+    for node in tree.body:
+        module = ast.Module(body=[node], type_ignores=[])
+        label = source_label(ast.get_source_segment(source, node) or "")
+        blocks.append((node.lineno, label, compile(module, filename, "exec")))
+    return blocks
+
+
+def light_cells(source: str, tree: ast.Module) -> list[list[ast.stmt]]:
+    """Group the top-level statements of a script into jupytext light cells.
+
+    A cell opened by "# +" runs to the next "# -" or "# +"; elsewhere, as in
+    the light format, a blank line between two statements starts a new cell.
+    """
+    lines = source.splitlines()
+    cells: list[list[ast.stmt]] = []
+    marked = False
+    end = 0
+    for node in tree.body:
+        new_cell = not cells
+        for text in lines[end : first_line(node) - 1]:
+            if text.strip() in ("# +", "# -"):
+                marked = text.strip() == "# +"
+                new_cell = True
+            elif not text.strip() and not marked:
+                new_cell = True
+        if new_cell:
+            cells.append([])
+        cells[-1].append(node)
+        end = node.end_lineno or node.lineno
+    return cells
+
+
+def first_line(node: ast.stmt) -> int:
+    """Return the line a statement starts on, counting its decorators."""
+    decorators: list[ast.expr] = getattr(node, "decorator_list", [])
+    return min([node.lineno, *(decorator.lineno for decorator in decorators)])
+
+
+def cell_blocks(source: str, filename: str, workdir: str) -> list[Block]:
+    """Compile the jupytext light cells of a script, one block per cell."""
+    tree = LocalPaths(workdir).visit(ast.parse(source, filename))
+    blocks: list[Block] = []
+    for cell in light_cells(source, tree):
+        module = ast.Module(body=cell, type_ignores=[])
+        label = source_label(ast.get_source_segment(source, cell[0]) or "")
+        blocks.append((cell[0].lineno, label, compile(module, filename, "exec")))
+    return blocks
+
+
+def exec_block(code: CodeType, namespace: dict[str, object]) -> str:
+    """Execute one block of a chapter; return its error, "" when it succeeds.
+
+    A failing block has its traceback printed to stderr, so that the run
+    can go on with the next one.
+    """
+    try:
+        exec(code, namespace)  # pylint: disable=exec-used
+    # a chapter may fail in any way, and exit() in a cell ends only the cell
+    except (Exception, SystemExit) as error:  # pylint: disable=broad-exception-caught
+        traceback.print_exc()
+        return f"{type(error).__name__}: {error}"
+    return ""
+
+
+def run_blocks(
+    code_blocks: Iterable[Block],
+    namespace: dict[str, object],
+    measure_memory: bool = True,
+    stop_on_error: bool = False,
+) -> Iterator[BlockResult]:
+    """Execute code_blocks in one namespace, timing each and tracing its memory.
+
+    peak_bytes is how far traced memory rose above its level at the start
+    of the block. A failing block is reported with its traceback on stderr
+    and, unless stop_on_error, the run goes on with the next one.
+    """
+    if measure_memory:
+        tracemalloc.start()
+    try:
+        for line, label, code in code_blocks:
+            before = tracemalloc.get_traced_memory()[0] if measure_memory else 0
+            if measure_memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            error = exec_block(code, namespace)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - before if measure_memory else 0
+            yield {
+                "line": line,
+                "source": label,
+                "seconds": seconds,
+                "peak_bytes": max(peak, 0),
+                "error": error,
+            }
+            if error and stop_on_error:
+                return
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+
+
+# pylint: disable-next=too-many-arguments
+def run_chapter(
+    path: str,
+    answers: Iterable[str] = DEFAULT_ANSWERS,
+    workdir: str | None = None,
+    *,
+    measure_memory: bool = True,
+    stop_on_error: bool = False,
+    split: Callable[[str, str, str], list[Block]] = statement_blocks,
+) -> list[BlockResult]:
+    """Run a chapter script headless and return the result of every block.
+
+    Blocks are top-level statements, or cells with split=cell_blocks.
+    """
+    path = os.path.abspath(path)
+    with open(path, encoding="utf-8") as file:
+        source = file.read()
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        workdir = os.path.abspath(workdir)
+        os.makedirs(workdir, exist_ok=True)
+        blocks = split(source, path, workdir)
+        stack.enter_context(headless_environment(workdir, answers))
+        stack.enter_context(patched(sys, "path", [os.path.dirname(path), *sys.path]))
+        # the blocks run as __main__, as in Jupyter, so that pickle can find
+        # the functions they define, e.g. for a process pool
+        main_module = types.ModuleType("__main__")
+        main_module.__file__ = path
+        stack.enter_context(stand_in_modules({"__main__": main_module}))
+        namespace: dict[str, object] = vars(main_module)
+        return list(run_blocks(blocks, namespace, measure_memory, stop_on_error))
+
+
+def print_report(results: list[BlockResult], top: int = 15) -> None:
+    """Print the slowest blocks and the totals to stderr."""
+    total = sum(result["seconds"] for result in results)
+    failed = sum(1 for result in results if result["error"])
+    rows = sorted(results, key=lambda result: result["seconds"], reverse=True)
+    print(f"{'line':>5} {'ms':>9} {'peak KiB':>9}  code", file=sys.stderr)
+    for result in rows[:top] if top else rows:
+        mark = "  !" if result["error"] else ""
+        print(
+            f"{result['line']:>5} {result['seconds'] * 1000:9.1f}"
+            f" {result['peak_bytes'] / 1024:9.1f}  {result['source']}{mark}",
+            file=sys.stderr,
+        )
+    print(
+        f"{len(results)} blocks, {failed} failed, {total * 1000:.0f} ms in total",
+        file=sys.stderr,
+    )
+
+
+def add_answers_option(parser: argparse.ArgumentParser) -> None:
+    """Add the -i option that scripts the answers to input()."""
+    parser.add_argument(
+        "-i",
+        "--input",
+        action="append",
+        dest="answers",
+        help="answer for the next input() call; the last one repeats",
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run one chapter from the command line and report its slowest statements."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("chapter", help="e.g. python/makarov/chapter_6_functions.py")
+    add_answers_option(parser)
+    parser.add_argument("--workdir", help="keep fixtures and outputs here")
+    parser.add_argument("--top", type=int, default=15, help="0 lists every block")
+    parser.add_argument("--json", help="write every statement result to this file")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip tracemalloc, for exact timings"
+    )
+    parser.add_argument("--stop-on-error", action="store_true")
+    parser.add_argument(
+        "--cells", action="store_true", help="time jupytext cells, not statements"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="hide what the chapter prints"
+    )
+    args = parser.parse_args(argv)
+    with contextlib.ExitStack() as stack:
+        if args.quiet:
+            devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        results = run_chapter(
+            args.chapter,
+            args.answers or DEFAULT_ANSWERS,
+            args.workdir,
+            measure_memory=not args.no_memory,
+            stop_on_error=args.stop_on_error,
+            split=cell_blocks if args.cells else statement_blocks,
+        )
+    print_report(results, args.top)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Gitignore-style exclusion rules for the directory index."""
+
+import hashlib
+import os
+import re
+from collections.abc import Iterable
+
+# the rules build_directory_md always applied: tooling, hidden and private
+# directories, virtual environments and package markers
+DEFAULT_PATTERNS = ("scripts/", ".*/", "_*/", "*venv*/", "__init__.py")
+IGNORE_FILES = (".gitignore", ".directoryignore")
+# a compiled pattern: (priority, negated) of the rule that decided
+Decision = tuple[int, bool]
+NO_MATCH: Decision = (-1, False)
+
+
+def glob_to_regex(pattern: str) -> str:
+    r"""Translate one gitignore glob into a regex over "/"-separated paths.
+
+    >>> glob_to_regex("*.py[cod]")
+    '[^/]*\\.py[cod]'
+    >>> glob_to_regex("docs/**/build")
+    'docs/(?:.*/)?build'
+    """
+    parts: list[str] = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        at_segment_start = index == 0 or pattern[index - 1] == "/"
+        if pattern.startswith("**/", index) and at_segment_start:
+            parts.append("(?:.*/)?")
+            index += 3
+            continue
+        if pattern.startswith("**", index) and index + 2 == len(pattern):
+            parts.append(".*")
+            index += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[" and (end := pattern.find("]", index + 2)) != -1:
+            body = pattern[index + 1 : end].replace("\\", "\\\\")
+            parts.append(f"[^{body[1:]}]" if body[0] in "!^" else f"[{body}]")
+            index = end
+        elif char == "\\" and index + 1 < len(pattern):
+            index += 1
+            parts.append(re.escape(pattern[index]))
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return "".join(parts)
+
+
+class PatternSet:
+    """Patterns of one kind compiled into a single alternation.
+
+    Alternatives are ordered from the last pattern to the first, so the group
+    that matches belongs to the rule gitignore would let win.
+    """
+
+    def __init__(self, rules: list[tuple[int, bool, str]]) -> None:
+        """Compile (priority, negated, regex) rules."""
+        ordered = sorted(rules, reverse=True)
+        self.decisions: list[Decision] = [NO_MATCH]
+        self.decisions += [(priority, negated) for priority, negated, _ in ordered]
+        alternatives = "|".join(f"({regex})" for _, _, regex in ordered)
+        self.regex = re.compile(alternatives) if ordered else None
+
+    def match(self, text: str) -> Decision:
+        """Return the decision of the winning rule, NO_MATCH when none applies."""
+        if self.regex is None:
+            return NO_MATCH
+        match = self.regex.fullmatch(text)
+        return self.decisions[match.lastindex or 0] if match else NO_MATCH
+
+
+class IgnoreRules:
+    """Compiled gitignore rules, evaluated once per walked entry.
+
+    Patterns without a slash only look at the entry name: literal names are
+    resolved by a dict lookup and globs by one combined regex, memoized per
+    directory name since those repeat across the tree. Patterns with a
+    slash are anchored at the top directory and grouped by their number of
+    path segments, so an entry is only matched against patterns that can
+    apply at its depth.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        """Parse gitignore lines in order; later lines override earlier ones."""
+        self.patterns = list(patterns)
+        literal_names: dict[bool, dict[str, Decision]] = {False: {}, True: {}}
+        glob_rules: dict[bool, list[tuple[int, bool, str]]] = {False: [], True: []}
+        path_rules: dict[tuple[bool, int], list[tuple[int, bool, str]]] = {}
+        for priority, line in enumerate(self.patterns):
+            pattern = line.rstrip("\n")
+            if not pattern.endswith("\\ "):
+                pattern = pattern.rstrip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            if negated or pattern[:2] in ("\\#", "\\!"):
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            kinds = (True,) if dir_only else (False, True)
+            if "/" not in pattern and not set(pattern) & set("*?[\\"):
+                for is_dir in kinds:
+                    literal_names[is_dir][pattern] = (priority, negated)
+                continue
+            rule = (priority, negated, glob_to_regex(pattern.lstrip("/")))
+            if "/" not in pattern:
+                for is_dir in kinds:
+                    glob_rules[is_dir].append(rule)
+                continue
+            pattern = pattern.lstrip("/")
+            depth = 0 if "**" in pattern else pattern.count("/") + 1
+            for is_dir in kinds:
+                path_rules.setdefault((is_dir, depth), []).append(rule)
+        self.literal_names = literal_names
+        self.glob_names = {
+            is_dir: PatternSet(rules) for is_dir, rules in glob_rules.items()
+        }
+        self.paths = {key: PatternSet(rules) for key, rules in path_rules.items()}
+        self.dir_decisions: dict[str, Decision] = {}
+        self.ignored_literals = {
+            is_dir: frozenset(
+                name for name, (_, negated) in names.items() if not negated
+            )
+            for is_dir, names in literal_names.items()
+        }
+        self.fingerprint = hashlib.sha1("\n".join(self.patterns).encode()).hexdigest()
+
+    def name_decision(self, name: str, is_dir: bool) -> Decision:
+        """Return the winning rule among those that only look at the name."""
+        decision = self.literal_names[is_dir].get(name, NO_MATCH)
+        candidate = self.glob_names[is_dir].match(name)
+        return candidate if candidate[0] > decision[0] else decision
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """Return True when a path relative to the top directory is excluded.
+
+        >>> rules = IgnoreRules(DEFAULT_PATTERNS)
+        >>> rules.is_ignored("python/scripts", True), rules.is_ignored("python", True)
+        (True, False)
+        >>> rules.is_ignored("python/__init__.py", False)
+        True
+        """
+        name = rel_path[rel_path.rfind("/") + 1 :]
+        if is_dir:
+            cached = self.dir_decisions.get(name)
+            if cached is None:
+                cached = self.dir_decisions[name] = self.name_decision(name, True)
+            decision = cached
+        else:
+            decision = self.name_decision(name, False)
+        if self.paths:
+            depth = rel_path.count("/") + 1
+            for key in ((is_dir, depth), (is_dir, 0)):
+                if (pattern_set := self.paths.get(key)) is not None:
+                    candidate = pattern_set.match(rel_path)
+                    if candidate[0] > decision[0]:
+                        decision = candidate
+        return decision[0] >= 0 and not decision[1]
+
+    def keep(self, rel_dir: str, names: list[str], is_dir: bool) -> list[str]:
+        """Return the names in rel_dir that are not ignored, in their order.
+
+        Listings that no anchored pattern can reach are filtered by name
+        alone, which skips building a relative path per entry.
+
+        >>> IgnoreRules(["*.md", "!README.md"]).keep("docs", ["a.md", "README.md"], False)
+        ['README.md']
+        """
+        if not names:
+            return names
+        if self.paths:
+            depth = rel_dir.count("/") + 2 if rel_dir else 1
+            if (is_dir, depth) in self.paths or (is_dir, 0) in self.paths:
+                prefix = f"{rel_dir}/" if rel_dir else ""
+                return [
+                    name for name in names if not self.is_ignored(prefix + name, is_dir)
+                ]
+        if is_dir:
+            decisions = self.dir_decisions
+            for name in names:
+                if name not in decisions:
+                    decisions[name] = self.name_decision(name, True)
+            return [
+                name for name in names if decisions[name][0] < 0 or decisions[name][1]
+            ]
+        if self.glob_names[False].regex is None:
+            ignored = self.ignored_literals[False]
+            return [name for name in names if name not in ignored]
+        return [
+            name
+            for name in names
+            if (decision := self.name_decision(name, False))[0] < 0 or decision[1]
+        ]
+
+
+def read_ignore_rules(top_dir: str = ".") -> IgnoreRules:
+    """Combine the default rules with .gitignore and .directoryignore of top_dir."""
+    patterns = list(DEFAULT_PATTERNS)
+    for filename in IGNORE_FILES:
+        try:
+            with open(os.path.join(top_dir, filename), encoding="utf-8") as file:
+                patterns.extend(file)
+        except OSError:
+            continue
+    return IgnoreRules(patterns)
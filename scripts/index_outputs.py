@@ -0,0 +1,203 @@
+"""Machine-readable copies of the repository index: JSON lines and SQLite."""
+
+import json
+import os
+import sqlite3
+import tempfile
+from types import TracebackType
+from typing import Protocol
+
+COLUMNS = ("section", "title", "path", "size", "mtime", "kind")
+KINDS = {".ipynb": "notebook", ".py": "script"}
+BATCH_SIZE = 1000
+ENCODER = json.JSONEncoder(ensure_ascii=False)
+# mtime is stored in nanoseconds, like the manifest of build_directory_md
+SCHEMA = """
+CREATE TABLE entries (
+    section TEXT NOT NULL,
+    title TEXT NOT NULL,
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    kind TEXT NOT NULL
+) WITHOUT ROWID
+"""
+INDEXES = (
+    "CREATE INDEX entries_section ON entries (section, path)",
+    "CREATE INDEX entries_title ON entries (title)",
+    "CREATE INDEX entries_kind ON entries (kind)",
+)
+
+IndexRow = tuple[str, str, str, int, int, str]
+
+
+class IndexOutput(Protocol):
+    """A file the index rows are written to."""
+
+    def add(self, rows: list[IndexRow]) -> None:
+        """Append a batch of rows."""
+
+    def close(self, commit: bool = True) -> None:
+        """Move the finished file into place, or drop it when commit is False."""
+
+
+def path_lead(top_dir: str) -> str:
+    """Return what index paths under top_dir lose to their ``lstrip("./")``.
+
+    >>> path_lead("./python"), path_lead("/srv/repo"), path_lead("python")
+    ('./', '/', '')
+    """
+    sample = os.path.join(top_dir, "x")
+    return sample[: len(sample) - len(sample.lstrip("./"))]
+
+
+def temp_file(path: str) -> tuple[int, str]:
+    """Create a temporary file next to path, so it can be renamed over it."""
+    return tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".", suffix=".tmp"
+    )
+
+
+def replace_file(temp_path: str, path: str, commit: bool) -> None:
+    """Rename a finished temporary file over path, keeping the old mode."""
+    if not commit:
+        os.unlink(temp_path)
+        return
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = 0o644
+    os.chmod(temp_path, mode)
+    os.replace(temp_path, path)
+
+
+class JsonLinesIndex:
+    """One JSON object per indexed file."""
+
+    def __init__(self, path: str) -> None:
+        """Start writing to a temporary file next to path."""
+        self.path = path
+        fd, self.temp_path = temp_file(path)
+        self.file = os.fdopen(fd, "w", encoding="utf-8", newline="\n")
+
+    def add(self, rows: list[IndexRow]) -> None:
+        """Append a batch of rows."""
+        self.file.writelines(
+            ENCODER.encode(dict(zip(COLUMNS, row))) + "\n" for row in rows
+        )
+
+    def close(self, commit: bool = True) -> None:
+        """Flush the file to disk and move it into place."""
+        if commit:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+        replace_file(self.temp_path, self.path, commit)
+
+
+class SqliteIndex:
+    """An entries table filled in a single transaction.
+
+    The database is built in a temporary file, so readers of the old one
+    never see a half-written catalogue. Secondary indexes are created after
+    the bulk insert, which is cheaper than maintaining them row by row.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Create the table in a fresh temporary database."""
+        self.path = path
+        fd, self.temp_path = temp_file(path)
+        os.close(fd)
+        self.connection = sqlite3.connect(self.temp_path, isolation_level=None)
+        # the file is only renamed into place once complete, so no journal
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("BEGIN")
+        self.connection.execute(SCHEMA)
+
+    def add(self, rows: list[IndexRow]) -> None:
+        """Insert a batch of rows."""
+        self.connection.executemany(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+
+    def close(self, commit: bool = True) -> None:
+        """Commit the transaction, sync the file and move it into place."""
+        if commit:
+            for statement in INDEXES:
+                self.connection.execute(statement)
+            self.connection.execute("COMMIT")
+        self.connection.close()
+        if commit:
+            fd = os.open(self.temp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        replace_file(self.temp_path, self.path, commit)
+
+
+class IndexWriter:
+    """Collect index entries during a walk and write them out in batches.
+
+    Used as a context manager: every output is replaced when the block
+    finishes and left untouched when it raises.
+    """
+
+    def __init__(
+        self, top_dir: str, outputs: list[IndexOutput], batch_size: int = BATCH_SIZE
+    ) -> None:
+        """Write rows for files under top_dir to every output."""
+        self.lead = path_lead(top_dir)
+        self.outputs = outputs
+        self.batch_size = batch_size
+        self.batch: list[IndexRow] = []
+
+    def add(self, path: str, title: str) -> None:
+        """Record one index entry."""
+        try:
+            stat = os.stat(self.lead + path)
+        except OSError:
+            size, mtime_ns = 0, 0
+        else:
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        section = path.partition(os.sep)[0] if os.sep in path else ""
+        kind = KINDS.get(path[path.rfind(".") :], "")
+        self.batch.append((section, title, path, size, mtime_ns, kind))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the pending rows to the outputs."""
+        for output in self.outputs:
+            output.add(self.batch)
+        self.batch = []
+
+    def __enter__(self) -> "IndexWriter":
+        """Return the writer itself."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Write the last batch and close every output."""
+        commit = exc_type is None
+        if commit and self.batch:
+            self.flush()
+        for output in self.outputs:
+            output.close(commit)
+
+
+def open_index(
+    top_dir: str, jsonl_path: str | None = None, sqlite_path: str | None = None
+) -> IndexWriter | None:
+    """Return a writer for the requested outputs, None when there are none."""
+    outputs: list[IndexOutput] = []
+    if jsonl_path:
+        outputs.append(JsonLinesIndex(jsonl_path))
+    if sqlite_path:
+        outputs.append(SqliteIndex(sqlite_path))
+    return IndexWriter(top_dir, outputs) if outputs else None
@@ -0,0 +1,229 @@
+"""Read notebook and script titles without parsing whole files."""
+
+import ast
+import io
+import json
+import os
+import tokenize
+from collections.abc import Callable, Iterator
+from typing import TextIO, cast
+
+TITLE_CACHE_PATH = ".directory_md_titles.json"
+CHUNK_SIZE = 1 << 16
+# a title is looked for in this many leading cells before giving up
+MAX_TITLE_CELLS = 5
+# docstrings up to this length are titles as a whole, longer ones by first line
+MAX_TITLE_LENGTH = 80
+SKIPPED_TOKENS = frozenset(
+    (tokenize.ENCODING, tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE)
+)
+
+TitleLookup = Callable[[str], "str | None"]
+NotebookCell = dict[str, object]
+
+
+class JsonStream:
+    """Pull JSON values one at a time out of a text stream.
+
+    Only the value being decoded and a read-ahead chunk are held in memory.
+    """
+
+    def __init__(self, source: TextIO, chunk_size: int = CHUNK_SIZE) -> None:
+        """Wrap an open text file."""
+        self.source = source
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def has_read_more(self) -> bool:
+        """Append the next chunk, dropping what was consumed; False at the end."""
+        if self.eof:
+            return False
+        chunk = self.source.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-blank character without consuming it, "" at EOF."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.has_read_more():
+                return ""
+
+    def expect(self, char: str) -> None:
+        """Consume one structural character."""
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self) -> object:
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.has_read_more():
+                    continue
+                raise
+            # a number cut at the end of the buffer decodes too early
+            if end == len(self.buffer) and self.has_read_more():
+                continue
+            self.pos = end
+            return cast(object, value)
+
+    def array_values(self) -> Iterator[object]:
+        """Yield the values of the array the stream is at, consuming it."""
+        self.expect("[")
+        while self.peek() not in ("]", ""):
+            yield self.value()
+            if self.peek() == ",":
+                self.expect(",")
+        self.expect("]")
+
+
+def iter_notebook_cells(
+    notebook_file: TextIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[NotebookCell]:
+    """Yield the cells of an .ipynb file one by one.
+
+    Top-level keys before "cells" are skipped value by value, so with the
+    sorted keys nbformat writes the first cell is reached after one chunk.
+    """
+    stream = JsonStream(notebook_file, chunk_size)
+    stream.expect("{")
+    while stream.peek() == '"':
+        key = stream.value()
+        stream.expect(":")
+        if key != "cells":
+            stream.value()
+            if stream.peek() == ",":
+                stream.expect(",")
+            continue
+        for cell in stream.array_values():
+            yield cast(NotebookCell, cell)
+        return
+
+
+def clean_title(text: str, max_length: int = 0) -> str | None:
+    r"""Turn a docstring or a markdown heading into a one-line label.
+
+    >>> clean_title("## Decorators.\n\nText of the chapter.")
+    'Decorators'
+    >>> clean_title("ООП.\n\nКлассы и объекты.\n", max_length=80)
+    'ООП. Классы и объекты'
+    >>> clean_title("   ") is None
+    True
+    """
+    lines = [" ".join(line.strip().lstrip("#").split()) for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    if not lines:
+        return None
+    joined = " ".join(lines)
+    return (joined if len(joined) <= max_length else lines[0]).rstrip(".")
+
+
+def source_docstring(readline: Callable[[], str]) -> str | None:
+    r"""Return the module docstring, tokenizing only up to its closing quotes.
+
+    >>> source_docstring(io.StringIO('# coding\n"Decorators."\nimport os\n').readline)
+    'Decorators.'
+    """
+    try:
+        for token in tokenize.generate_tokens(readline):
+            if token.type in SKIPPED_TOKENS:
+                continue
+            if token.type != tokenize.STRING:
+                return None
+            docstring = ast.literal_eval(token.string)
+            return docstring if isinstance(docstring, str) else None
+    except (tokenize.TokenError, SyntaxError, ValueError):
+        return None
+    return None
+
+
+def cell_source(cell: NotebookCell) -> str:
+    """Join the source of a cell, which nbformat may store as a list of lines."""
+    source = cell.get("source", "")
+    if isinstance(source, list):
+        return "".join(str(line) for line in source)
+    return str(source)
+
+
+def notebook_title(notebook_file: TextIO) -> str | None:
+    """Return the title of a notebook from its first markdown or docstring cell."""
+    for index, cell in enumerate(iter_notebook_cells(notebook_file)):
+        if index == MAX_TITLE_CELLS:
+            break
+        source = cell_source(cell)
+        if cell.get("cell_type") == "markdown":
+            title = clean_title(source)
+        elif docstring := source_docstring(io.StringIO(source).readline):
+            title = clean_title(docstring, MAX_TITLE_LENGTH)
+        else:
+            continue
+        if title:
+            return title
+    return None
+
+
+def extract_title(path: str) -> str | None:
+    """Return the real title of a .py or .ipynb file, None when it has none."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            if path.endswith(".ipynb"):
+                return notebook_title(file)
+            docstring = source_docstring(file.readline)
+    except (OSError, UnicodeDecodeError, ValueError):
+        return None
+    return clean_title(docstring, MAX_TITLE_LENGTH) if docstring else None
+
+
+class TitleCache:
+    """Titles of indexed files, keyed by path and checked against mtime and size."""
+
+    def __init__(self, cache_path: str = TITLE_CACHE_PATH) -> None:
+        """Load the cache file if there is one."""
+        self.cache_path = cache_path
+        self.entries: dict[str, list[int | str]] = {}
+        self.dirty = False
+        try:
+            with open(cache_path, encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return
+        if isinstance(entries, dict):
+            self.entries = cast(dict[str, list[int | str]], entries)
+
+    def title(self, path: str) -> str | None:
+        """Return the title of path, reading the file only when it changed."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return str(entry[2]) or None
+        title = extract_title(path)
+        self.entries[path] = [stat.st_mtime_ns, stat.st_size, title or ""]
+        self.dirty = True
+        return title
+
+    def write(self) -> None:
+        """Write the cache back when titles were added or refreshed."""
+        if not self.dirty:
+            return
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, self.cache_path)
+        self.dirty = False
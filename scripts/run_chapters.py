@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Run every Makarov chapter in parallel and report the time of each cell."""
+import argparse
+import ast
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import BaseContext
+from types import CodeType, FrameType
+from typing import TypedDict
+
+from chapter_harness import (
+    DEFAULT_ANSWERS,
+    Block,
+    BlockResult,
+    add_answers_option,
+    cell_blocks,
+    environment_variable,
+    patched,
+    run_chapter,
+)
+
+CHAPTERS_GLOB = os.path.join("python", "makarov", "chapter*.py")
+SAMPLE_INTERVAL = 0.005
+# modules the stand-ins of chapter_harness replace, never worth preloading
+NOT_PRELOADED = ("google",)
+
+
+class ChapterReport(TypedDict):
+    """Per-cell results and sampled stacks of one chapter run."""
+
+    chapter: str
+    seconds: float
+    slept: float
+    cells: list[BlockResult]
+    stacks: dict[str, int]
+    log: str
+
+
+class StackSampler:
+    """Sample the Python stack of the main thread from a background thread.
+
+    Samples are kept as collapsed stacks, ``chapter;cell;frame;frame``, with
+    the cell found by matching frames against the code of the cells, so no
+    hook has to run between cells.
+    """
+
+    def __init__(self, chapter: str, interval: float = SAMPLE_INTERVAL) -> None:
+        """Sample every interval seconds once started."""
+        self.chapter = chapter
+        self.interval = interval
+        self.cells: dict[CodeType, str] = {}
+        self.stacks: Counter[str] = Counter()
+        self.stopped = threading.Event()
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def add_cells(self, blocks: list[Block]) -> list[Block]:
+        """Remember the code of every cell and pass the blocks on."""
+        for line, label, code in blocks:
+            self.cells[code] = f"cell {line} {label.replace(';', ',')}"
+        return blocks
+
+    def collapse(self, frame: FrameType | None) -> str | None:
+        """Return the collapsed stack of frame, None outside the cells."""
+        names: list[str] = []
+        while frame is not None:
+            cell = self.cells.get(frame.f_code)
+            if cell is not None:
+                return ";".join([self.chapter, cell, *reversed(names)])
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return None
+
+    def run(self) -> None:
+        """Take samples until stopped."""
+        while not self.stopped.wait(self.interval):
+            # the stack of another thread can only be read this way; the
+            # function is documented in sys despite its underscore
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            stack = self.collapse(frames.get(self.thread_id))
+            if stack is not None:
+                self.stacks[stack] += 1
+
+    def __enter__(self) -> "StackSampler":
+        """Start sampling."""
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Stop sampling."""
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_chapter_cells(
+    path: str,
+    answers: tuple[str, ...] = DEFAULT_ANSWERS,
+    no_sleep: bool = False,
+    sample_interval: float = SAMPLE_INTERVAL,
+) -> ChapterReport:
+    """Run one chapter cell by cell in this process, hiding what it prints.
+
+    With no_sleep, time.sleep() returns at once and the requested seconds
+    are only added up.
+    """
+    chapter = os.path.splitext(os.path.basename(path))[0]
+    slept = 0.0
+
+    def fake_sleep(seconds: float) -> None:
+        nonlocal slept
+        slept += seconds
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if no_sleep:
+            stack.enter_context(patched(time, "sleep", fake_sleep))
+        devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+        stack.enter_context(contextlib.redirect_stdout(devnull))
+        stack.enter_context(contextlib.redirect_stderr(log))
+        workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        sampler = stack.enter_context(StackSampler(chapter, sample_interval))
+        cells = run_chapter(
+            path,
+            answers,
+            workdir,
+            measure_memory=False,
+            split=lambda *args: sampler.add_cells(cell_blocks(*args)),
+        )
+    return {
+        "chapter": chapter,
+        "seconds": time.perf_counter() - start,
+        "slept": slept,
+        "cells": cells,
+        "stacks": dict(sampler.stacks),
+        "log": log.getvalue(),
+    }
+
+
+def imported_modules(paths: list[str]) -> list[str]:
+    r"""Return the top-level modules the chapters import, in first-seen order.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as file:
+    ...     _ = file.write("import numpy as np\nfrom scipy.sparse import csr_matrix\n")
+    >>> imported_modules([file.name])
+    ['numpy', 'scipy.sparse']
+    """
+    modules: dict[str, None] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            tree = ast.parse(file.read(), path)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                modules.update((alias.name, None) for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules[node.module] = None
+    return [name for name in modules if not name.startswith(NOT_PRELOADED)]
+
+
+def run_chapters(
+    paths: list[str],
+    max_workers: int | None = None,
+    answers: tuple[str, ...] = DEFAULT_ANSWERS,
+    no_sleep: bool = False,
+    sample_interval: float = SAMPLE_INTERVAL,
+) -> Iterator[ChapterReport]:
+    """Run chapters concurrently, each in a fresh process, in the order given.
+
+    Workers are forked from a forkserver that imported everything the
+    chapters import, so pandas, matplotlib and scipy are loaded once and
+    every chapter starts with a warm module cache. Without forkserver
+    support (Windows) the chapters run on a spawn pool.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        forkserver = multiprocessing.get_context("forkserver")
+        forkserver.set_forkserver_preload(["chapter_harness", *imported_modules(paths)])
+        context: BaseContext = forkserver
+    else:
+        context = multiprocessing.get_context("spawn")
+    # the preloaded pyplot has to pick the non-interactive backend already, and
+    # the forkserver keeps the environment it was started with
+    with environment_variable("MPLBACKEND", "Agg"), ProcessPoolExecutor(
+        max_workers or min(len(paths), os.cpu_count() or 1),
+        mp_context=context,
+        max_tasks_per_child=1,
+    ) as pool:
+        futures = [
+            pool.submit(run_chapter_cells, path, answers, no_sleep, sample_interval)
+            for path in paths
+        ]
+        for future in futures:
+            yield future.result()
+
+
+def print_cells(reports: list[ChapterReport], top: int = 20) -> None:
+    """Print the slowest cells of all chapters and the time of every chapter."""
+    rows = [(report["chapter"], cell) for report in reports for cell in report["cells"]]
+    rows.sort(key=lambda row: row[1]["seconds"], reverse=True)
+    print(f"{'ms':>9}  {'chapter':<26} {'line':>5}  cell")
+    for chapter, cell in rows[:top] if top else rows:
+        mark = "  !" if cell["error"] else ""
+        print(
+            f"{cell['seconds'] * 1000:9.1f}  {chapter:<26} {cell['line']:>5}"
+            f"  {cell['source']}{mark}"
+        )
+    print(f"\n{'ms':>9}  {'chapter':<26} {'cells':>5}  failed  slept s")
+    for report in sorted(reports, key=lambda report: report["seconds"], reverse=True):
+        failed = sum(1 for cell in report["cells"] if cell["error"])
+        print(
+            f"{report['seconds'] * 1000:9.1f}  {report['chapter']:<26}"
+            f" {len(report['cells']):>5}  {failed:>6}  {report['slept']:7.1f}"
+        )
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Run the chapters given, or all of them, and print the reports."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("chapters", nargs="*", help=f"default: {CHAPTERS_GLOB}")
+    parser.add_argument("-j", "--jobs", type=int, help="chapters run at once")
+    add_answers_option(parser)
+    parser.add_argument(
+        "--no-sleep", action="store_true", help="make time.sleep() return at once"
+    )
+    parser.add_argument("--top", type=int, default=20, help="0 lists every cell")
+    parser.add_argument(
+        "--flame", help="write collapsed stacks for flamegraph.pl or speedscope"
+    )
+    parser.add_argument("--interval", type=float, default=SAMPLE_INTERVAL)
+    parser.add_argument("--json", help="write every chapter report to this file")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="show the tracebacks of failed cells",
+    )
+    args = parser.parse_args(argv)
+    paths = args.chapters or sorted(glob.glob(CHAPTERS_GLOB))
+    answers = tuple(args.answers or DEFAULT_ANSWERS)
+    start = time.perf_counter()
+    reports = list(
+        run_chapters(paths, args.jobs, answers, args.no_sleep, args.interval)
+    )
+    elapsed = time.perf_counter() - start
+    print_cells(reports, args.top)
+    serial = sum(report["seconds"] for report in reports)
+    print(
+        f"\n{len(reports)} chapters in {elapsed:.2f} s,"
+        f" {serial:.2f} s one after another"
+    )
+    if args.verbose:
+        for report in reports:
+            if report["log"]:
+                print(f"\n== {report['chapter']}\n{report['log']}", file=sys.stderr)
+    if args.flame:
+        stacks: Counter[str] = Counter()
+        for report in reports:
+            stacks.update(report["stacks"])
+        with open(args.flame, "w", encoding="utf-8") as file:
+            file.writelines(
+                f"{stack} {count}\n" for stack, count in sorted(stacks.items())
+            )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(reports, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
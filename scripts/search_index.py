@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Full-text search over the notebooks and scripts listed in DIRECTORY.md."""
+import argparse
+import heapq
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from itertools import accumulate, chain, groupby, repeat
+from operator import add, itemgetter, lshift, mul, neg, rshift, sub
+
+from build_directory_md import RACY_WINDOW_NS, good_file_paths
+from index_outputs import path_lead
+from notebook_titles import cell_source, iter_notebook_cells
+
+INDEX_PATH = ".search_index.db"
+INDEX_VERSION = 1
+TOKEN_RE = re.compile(r"\w+")
+MULTIBYTE_RE = re.compile(rb"[\x80-\xff]+[\x00-\x7f]")
+# longer "words" are base64 blobs and hashes nobody searches for
+MAX_TOKEN_LENGTH = 64
+# new documents are written in segments of this many files, to bound memory
+SEGMENT_DOCS = 10_000
+# more segments than this, or this share of deleted documents, trigger a merge
+MAX_SEGMENTS = 16
+MAX_DELETED_SHARE = 0.25
+DEFAULT_LIMIT = 20
+SCHEMA = (
+    """CREATE TABLE docs (
+        doc_id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL
+    )""",
+    "CREATE TABLE deleted (doc_id INTEGER PRIMARY KEY)",
+    """CREATE TABLE postings (
+        term TEXT NOT NULL,
+        segment INTEGER NOT NULL,
+        df INTEGER NOT NULL,
+        docs BLOB NOT NULL,
+        positions BLOB NOT NULL,
+        PRIMARY KEY (term, segment)
+    ) WITHOUT ROWID""",
+)
+
+Posting = tuple[int, list[int]]
+
+
+def encode_varints(values: Iterable[int]) -> bytes:
+    """Encode non-negative integers as LEB128 varints, 7 bits per byte.
+
+    >>> encode_varints([1, 127, 128, 300]).hex()
+    '017f8001ac02'
+    """
+    data = bytearray()
+    for value in values:
+        while value >= 0x80:
+            data.append(value & 0x7F | 0x80)
+            value >>= 7
+        data.append(value)
+    return bytes(data)
+
+
+def decode_varints(data: bytes) -> list[int]:
+    """Decode a run of varints.
+
+    Delta-encoded postings are mostly single bytes, so runs of those are
+    copied by list.extend() in C and only multi-byte varints are decoded in
+    Python.
+
+    >>> decode_varints(bytes.fromhex("017f8001ac02"))
+    [1, 127, 128, 300]
+    """
+    if data.isascii():
+        return list(data)
+    values: list[int] = []
+    start = 0
+    for match in MULTIBYTE_RE.finditer(data):
+        values += data[start : match.start()]
+        value = 0
+        for byte in reversed(match.group()):
+            value = value << 7 | byte & 0x7F
+        values.append(value)
+        start = match.end()
+    values += data[start:]
+    return values
+
+
+def encode_postings(pairs: Iterable[Posting]) -> tuple[int, bytes, bytes]:
+    """Encode (doc_id, positions) pairs sorted by doc_id.
+
+    The docs blob holds a doc_id delta and a term frequency per document,
+    the positions blob the position deltas of every document in turn, so
+    queries without phrases never decode positions. Returns the document
+    frequency with both blobs.
+    """
+    docs: list[int] = []
+    positions: list[int] = []
+    previous = 0
+    for doc_id, doc_positions in pairs:
+        docs += (doc_id - previous, len(doc_positions))
+        previous = doc_id
+        positions += (b - a for a, b in zip([0, *doc_positions], doc_positions))
+    return len(docs) // 2, encode_varints(docs), encode_varints(positions)
+
+
+def decode_postings(docs: bytes, positions: bytes) -> Iterator[Posting]:
+    """Yield the (doc_id, positions) pairs encode_postings was given.
+
+    >>> _, docs, positions = encode_postings([(3, [0, 5]), (200, [7])])
+    >>> list(decode_postings(docs, positions))
+    [(3, [0, 5]), (200, [7])]
+    """
+    values = decode_varints(docs)
+    deltas = decode_varints(positions)
+    offset = 0
+    for doc_id, tf in zip(accumulate(values[0::2]), values[1::2]):
+        yield doc_id, list(accumulate(deltas[offset : offset + tf]))
+        offset += tf
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word tokens.
+
+    >>> tokenize("Декораторы: @functools.wraps(func)")
+    ['декораторы', 'functools', 'wraps', 'func']
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    return [token for token in tokens if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def document_text(path: str) -> str:
+    """Return the searchable text of a script, or the cell sources of a notebook."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            if path.endswith(".ipynb"):
+                cells = iter_notebook_cells(file)
+                return "\n".join(cell_source(cell) for cell in cells)
+            return file.read()
+    except (OSError, UnicodeDecodeError, ValueError):
+        return ""
+
+
+def document_terms(path: str) -> dict[str, list[int]]:
+    """Return the positions of every term of a document."""
+    terms: dict[str, list[int]] = {}
+    for position, token in enumerate(tokenize(document_text(path))):
+        terms.setdefault(token, []).append(position)
+    return terms
+
+
+def open_search_index(index_path: str = INDEX_PATH) -> sqlite3.Connection:
+    """Open the index, creating it when missing or written by another version.
+
+    WAL mode lets queries read the last committed state during an update.
+    """
+    connection = sqlite3.connect(index_path, isolation_level=None)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != INDEX_VERSION:
+        connection.execute("BEGIN IMMEDIATE")
+        for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall():
+            connection.execute(f'DROP TABLE "{name}"')
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        connection.execute("COMMIT")
+    connection.execute("PRAGMA journal_mode = WAL")
+    return connection
+
+
+def write_segment(
+    connection: sqlite3.Connection, segment: int, documents: list[tuple[int, str]]
+) -> None:
+    """Tokenize documents, given as (doc_id, file path), into a new segment."""
+    inverted: dict[str, list[Posting]] = {}
+    for doc_id, path in documents:
+        for term, positions in document_terms(path).items():
+            inverted.setdefault(term, []).append((doc_id, positions))
+    connection.executemany(
+        "INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+        (
+            (term, segment, *encode_postings(postings))
+            for term, postings in inverted.items()
+        ),
+    )
+
+
+def concat_postings(
+    segments: Iterable[tuple[bytes, bytes]], deleted: set[int]
+) -> tuple[int, bytes, bytes]:
+    """Join the (docs, positions) blobs of one term, dropping deleted documents.
+
+    Doc ids only grow and segments are written in order, so the blobs are
+    concatenated as they are; only the first doc id delta of each segment
+    changes. Segments that hold deleted documents are re-encoded.
+
+    >>> first, second = encode_postings([(1, [4])]), encode_postings([(9, [2, 3])])
+    >>> df, docs, positions = concat_postings([first[1:], second[1:]], set())
+    >>> df, list(decode_postings(docs, positions))
+    (2, [(1, [4]), (9, [2, 3])])
+    """
+    docs_parts: list[bytes] = []
+    position_parts: list[bytes] = []
+    df = previous = 0
+    for docs, positions in segments:
+        values = decode_varints(docs)
+        doc_ids = list(accumulate(values[0::2]))
+        if not deleted.isdisjoint(doc_ids):
+            kept = [
+                posting
+                for posting in decode_postings(docs, positions)
+                if posting[0] not in deleted
+            ]
+            if not kept:
+                continue
+            _, docs, positions = encode_postings(kept)
+            doc_ids = [doc_id for doc_id, _ in kept]
+        # the first delta of a segment is its first doc id
+        head = len(encode_varints(doc_ids[:1]))
+        docs_parts += (encode_varints([doc_ids[0] - previous]), docs[head:])
+        position_parts.append(positions)
+        df += len(doc_ids)
+        previous = doc_ids[-1]
+    return df, b"".join(docs_parts), b"".join(position_parts)
+
+
+def merge_segments(connection: sqlite3.Connection) -> None:
+    """Rewrite all segments as one, dropping the postings of deleted documents."""
+    deleted = {doc_id for (doc_id,) in connection.execute("SELECT doc_id FROM deleted")}
+    connection.execute(SCHEMA[2].replace("postings", "merged", 1))
+    rows = connection.execute(
+        "SELECT term, docs, positions FROM postings ORDER BY term, segment"
+    )
+
+    def merged_rows() -> Iterator[tuple[str, int, int, bytes, bytes]]:
+        for term, group in groupby(rows, key=itemgetter(0)):
+            df, docs, positions = concat_postings((row[1:] for row in group), deleted)
+            if df:
+                yield term, 0, df, docs, positions
+
+    connection.executemany("INSERT INTO merged VALUES (?, ?, ?, ?, ?)", merged_rows())
+    connection.execute("DROP TABLE postings")
+    connection.execute("ALTER TABLE merged RENAME TO postings")
+    connection.execute("DELETE FROM deleted")
+
+
+def changed_files(
+    connection: sqlite3.Connection, top_dir: str, trusted_before: int
+) -> tuple[list[int], list[tuple[str, int, int]]]:
+    """Compare the tree with the indexed stats.
+
+    Returns the doc ids of the edited and removed files, and the path,
+    mtime and size of the new and edited ones.
+    """
+    lead = path_lead(top_dir)
+    known = {
+        path: (doc_id, mtime_ns, size)
+        for doc_id, path, mtime_ns, size in connection.execute("SELECT * FROM docs")
+    }
+    stale: list[int] = []
+    fresh: list[tuple[str, int, int]] = []
+    for path in good_file_paths(top_dir):
+        try:
+            stat = os.stat(lead + path)
+        except OSError:
+            continue
+        record = known.pop(path, None)
+        if record and record[1:] == (stat.st_mtime_ns, stat.st_size):
+            continue
+        if record:
+            stale.append(record[0])
+        # a file written in the same clock tick as the scan is read again
+        mtime_ns = stat.st_mtime_ns if stat.st_mtime_ns < trusted_before else -1
+        fresh.append((path, mtime_ns, stat.st_size))
+    stale += (doc_id for doc_id, _, _ in known.values())
+    return stale, fresh
+
+
+def add_documents(
+    connection: sqlite3.Connection, lead: str, fresh: list[tuple[str, int, int]]
+) -> None:
+    """Index files under new doc ids, SEGMENT_DOCS of them per new segment."""
+    next_id, segment = connection.execute(
+        """SELECT max((SELECT coalesce(max(doc_id), 0) FROM docs),
+                      (SELECT coalesce(max(doc_id), 0) FROM deleted)) + 1,
+                  (SELECT coalesce(max(segment), 0) FROM postings) + 1"""
+    ).fetchone()
+    for start in range(0, len(fresh), SEGMENT_DOCS):
+        batch = fresh[start : start + SEGMENT_DOCS]
+        rows = [(next_id + start + i, *entry) for i, entry in enumerate(batch)]
+        connection.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+        documents = [(doc_id, lead + path) for doc_id, path, _, _ in rows]
+        write_segment(connection, segment, documents)
+        segment += 1
+
+
+def update_search_index(
+    connection: sqlite3.Connection, top_dir: str = "."
+) -> tuple[int, int]:
+    """Index new and edited files and forget removed ones, in one transaction.
+
+    Files are matched to the index by mtime and size, so unchanged files are
+    never read. A changed file is deleted and indexed again under a new doc
+    id in a new segment; old segments are only rewritten by a merge.
+
+    Returns the number of documents indexed and removed.
+    """
+    trusted_before = time.time_ns() - RACY_WINDOW_NS
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        stale, fresh = changed_files(connection, top_dir, trusted_before)
+        connection.executemany(
+            "DELETE FROM docs WHERE doc_id = ?", ((doc_id,) for doc_id in stale)
+        )
+        connection.executemany(
+            "INSERT INTO deleted VALUES (?)", ((doc_id,) for doc_id in stale)
+        )
+        add_documents(connection, path_lead(top_dir), fresh)
+        n_docs, n_deleted, n_segments = connection.execute(
+            """SELECT (SELECT count(*) FROM docs), (SELECT count(*) FROM deleted),
+                      (SELECT count(DISTINCT segment) FROM postings)"""
+        ).fetchone()
+        if n_segments > MAX_SEGMENTS or n_deleted > MAX_DELETED_SHARE * max(n_docs, 1):
+            merge_segments(connection)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return len(fresh), len(stale)
+
+
+class TermPostings:
+    """The postings of one query term across segments, decoded on demand."""
+
+    def __init__(self) -> None:
+        """Start with no segments."""
+        self.df = 0
+        self.segments: list[tuple[bytes, bytes]] = []
+        self.tfs: dict[int, int] | None = None
+
+    def docs(self) -> dict[int, int]:
+        """Map every doc id containing the term to its term frequency."""
+        if self.tfs is None:
+            self.tfs = {}
+            for docs, _ in self.segments:
+                values = decode_varints(docs)
+                self.tfs.update(zip(accumulate(values[0::2]), values[1::2]))
+        return self.tfs
+
+    def occurrences(self, step: int = 0) -> set[int]:
+        """Return ``doc_id << 32 | position - step`` for every occurrence.
+
+        Shifting the n-th term of a phrase back by n turns a phrase match
+        into a set intersection. Everything but the per-segment setup runs
+        in C: positions are summed across the whole blob and every document
+        gets its base added back through repeat().
+        """
+        keys: set[int] = set()
+        for docs, positions in self.segments:
+            values = decode_varints(docs)
+            doc_ids, tfs = accumulate(values[0::2]), values[1::2]
+            sums = list(accumulate(decode_varints(positions)))
+            # the running sum just before each document starts
+            before = map(sums.__getitem__, map(sub, accumulate(tfs), repeat(1)))
+            bases = map(sub, map(lshift, doc_ids, repeat(32)), chain((0,), before))
+            bases = map(sub, bases, repeat(step))
+            keys.update(map(add, sums, chain.from_iterable(map(repeat, bases, tfs))))
+        return keys
+
+
+def parse_query(text: str) -> list[list[str]]:
+    """Split a query into clauses, each a list of terms that must be adjacent.
+
+    Quoted text is a phrase; so is a bare word that tokenizes into several
+    terms, like a dotted name.
+
+    >>> parse_query('"list comprehension" os.path Map')
+    [['list', 'comprehension'], ['os', 'path'], ['map']]
+    """
+    clauses: list[list[str]] = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if terms := tokenize(phrase or word):
+            clauses.append(terms)
+    return clauses
+
+
+def phrase_docs(clause: list[str], postings: dict[str, TermPostings]) -> set[int]:
+    """Return the doc ids where the terms of clause appear one after another."""
+    keys = postings[clause[0]].occurrences()
+    for step, term in enumerate(clause[1:], 1):
+        keys &= postings[term].occurrences(step)
+    return set(map(rshift, keys, repeat(32)))
+
+
+def read_postings(
+    connection: sqlite3.Connection, terms: list[str]
+) -> dict[str, TermPostings]:
+    """Collect the segments of every term's postings, still encoded."""
+    postings = {term: TermPostings() for term in terms}
+    for term, df, docs, positions in connection.execute(
+        f"""SELECT term, df, docs, positions FROM postings
+            WHERE term IN ({", ".join("?" * len(terms))}) ORDER BY term, segment""",
+        terms,
+    ):
+        postings[term].df += df
+        postings[term].segments.append((docs, positions))
+    return postings
+
+
+def matching_docs(
+    clauses: list[list[str]], postings: dict[str, TermPostings]
+) -> set[int]:
+    """Return the doc ids that match every clause, rarest terms first."""
+    matches: set[int] | None = None
+    clauses.sort(key=lambda clause: min(postings[term].df for term in clause))
+    for clause in clauses:
+        for term in sorted(set(clause), key=lambda term: postings[term].df):
+            docs = postings[term].docs().keys()
+            matches = set(docs) if matches is None else matches & docs
+        if len(clause) > 1 and matches:
+            matches &= phrase_docs(clause, postings)
+        if not matches:
+            return set()
+    return matches or set()
+
+
+def best_paths(
+    connection: sqlite3.Connection,
+    doc_ids: list[int],
+    postings: dict[str, TermPostings],
+    limit: int,
+) -> list[tuple[str, float]]:
+    """Score documents by tf-idf and return the paths of the best ones."""
+    (n_docs,) = connection.execute("SELECT count(*) FROM docs").fetchone()
+    scores: Iterable[float] = repeat(0.0)
+    # summed term by term with map(), which keeps the per-document work in C
+    for term_postings in postings.values():
+        idf = math.log(1 + n_docs / term_postings.df)
+        tfs = map(term_postings.docs().__getitem__, doc_ids)
+        scores = map(add, scores, map(mul, tfs, repeat(idf)))
+    best = heapq.nlargest(limit, zip(scores, map(neg, doc_ids)))
+    placeholders = ", ".join("?" * len(best))
+    paths = dict(
+        connection.execute(
+            f"SELECT doc_id, path FROM docs WHERE doc_id IN ({placeholders})",
+            [-doc_id for _, doc_id in best],
+        ).fetchall()
+    )
+    return [(paths[-doc_id], score) for score, doc_id in best if -doc_id in paths]
+
+
+def search(
+    connection: sqlite3.Connection, query: str, limit: int = DEFAULT_LIMIT
+) -> list[tuple[str, float]]:
+    """Return the paths matching every clause of query, best tf-idf score first."""
+    clauses = parse_query(query)
+    terms = sorted({term for clause in clauses for term in clause})
+    if not terms:
+        return []
+    postings = read_postings(connection, terms)
+    if not all(term_postings.df for term_postings in postings.values()):
+        return []
+    matches = matching_docs(clauses, postings)
+    matches.difference_update(
+        doc_id for (doc_id,) in connection.execute("SELECT doc_id FROM deleted")
+    )
+    return best_paths(connection, list(matches), postings, limit)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Update the index of a tree or answer a query from it."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--index", default=INDEX_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="index new and edited files")
+    update.add_argument("top_dir", nargs="?", default=".")
+    query = commands.add_parser(
+        "query", help='find files with all terms, "quoted phrases" in order'
+    )
+    query.add_argument("query", nargs="+")
+    query.add_argument("-n", "--limit", type=int, default=DEFAULT_LIMIT)
+    args = parser.parse_args(argv)
+    connection = open_search_index(args.index)
+    start = time.perf_counter()
+    if args.command == "update":
+        indexed, removed = update_search_index(connection, args.top_dir)
+        elapsed = (time.perf_counter() - start) * 1000
+        status = f"{indexed} indexed, {removed} removed"
+        print(f"{status} in {elapsed:.0f} ms", file=sys.stderr)
+    else:
+        results = search(connection, " ".join(args.query), args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+        for path, score in results:
+            print(f"{score:8.2f}  {path}")
+        print(f"{len(results)} results in {elapsed:.1f} ms", file=sys.stderr)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""Shrink notebooks by moving images out of their outputs and dropping bulky HTML."""
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import os
+import sys
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import TextIO, TypedDict, cast
+
+from build_directory_md import atomic_write
+from index_outputs import replace_file, temp_file
+from notebook_titles import JsonStream, NotebookCell
+from sync_notebooks import notebook_paths
+
+ASSETS_DIR = "notebook_assets"
+# base64 payloads, stored decoded under the hash of their bytes
+IMAGE_TYPES = {"image/png": ".png", "image/jpeg": ".jpg", "image/gif": ".gif"}
+# text payloads, stored as they are
+TEXT_IMAGE_TYPES = {"image/svg+xml": ".svg"}
+DEFAULT_MAX_HTML = 16 << 10
+DEFAULT_MAX_TEXT = 64 << 10
+HASH_LENGTH = 16
+
+
+class StripReport(TypedDict):
+    """What stripping did to one notebook."""
+
+    path: str
+    before: int
+    after: int
+    images: int
+    html: int
+    truncated: int
+    error: str
+
+
+class StripOptions(TypedDict):
+    """Limits and switches shared by every notebook of a run."""
+
+    assets_dir: str
+    max_html: int
+    max_text: int
+    clear: bool
+    check: bool
+
+
+def joined(text: object) -> str:
+    """Return a notebook string, stored either whole or as a list of lines."""
+    return "".join(cast(list[str], text)) if isinstance(text, list) else str(text)
+
+
+def split_lines(text: str) -> list[str]:
+    r"""Split text into lines with their endings, as nbformat stores it.
+
+    >>> split_lines("a\nb")
+    ['a\n', 'b']
+    """
+    return text.splitlines(keepends=True)
+
+
+def truncate_output(text: str, max_bytes: int) -> str | None:
+    r"""Cut text to max_bytes at a line end, None when it already fits.
+
+    The note on what was dropped counts towards max_bytes, so cut text
+    is left alone by the next run.
+
+    >>> cut = truncate_output("line\n" * 20, 60)
+    >>> cut.splitlines()[-1], len(cut), truncate_output(cut, 60)
+    ('... [75 bytes of output dropped]', 58, None)
+    """
+    data = text.encode()
+    if len(data) <= max_bytes:
+        return None
+    budget = max_bytes - len(f"... [{len(data)} bytes of output dropped]\n")
+    head = data[: max(budget, 0)].decode(errors="ignore")
+    head = head[: head.rfind("\n") + 1]
+    dropped = len(data) - len(head.encode())
+    return f"{head}... [{dropped} bytes of output dropped]\n"
+
+
+def externalize(
+    payload: bytes, suffix: str, notebook_dir: str, options: StripOptions
+) -> str:
+    """Store payload under its hash in the assets directory; return a Markdown link."""
+    name = hashlib.sha256(payload).hexdigest()[:HASH_LENGTH] + suffix
+    path = os.path.join(options["assets_dir"], name)
+    if not options["check"] and not os.path.exists(path):
+        os.makedirs(options["assets_dir"], exist_ok=True)
+        atomic_write(path, payload)
+    link = os.path.relpath(path, notebook_dir).replace(os.sep, "/")
+    return f"![]({link})"
+
+
+def image_links(
+    data: dict[str, object], notebook_dir: str, options: StripOptions
+) -> list[str]:
+    """Move the images of an output into the assets directory; return links to them."""
+    links: list[str] = []
+    for mime, suffix in IMAGE_TYPES.items():
+        if mime in data:
+            try:
+                payload = base64.b64decode(joined(data[mime]))
+            except (binascii.Error, ValueError):
+                continue
+            links.append(externalize(payload, suffix, notebook_dir, options))
+            del data[mime]
+    for mime, suffix in TEXT_IMAGE_TYPES.items():
+        if mime in data:
+            payload = joined(data[mime]).encode()
+            links.append(externalize(payload, suffix, notebook_dir, options))
+            del data[mime]
+    return links
+
+
+def has_output_shrunk(
+    output: dict[str, object],
+    notebook_dir: str,
+    options: StripOptions,
+    report: StripReport,
+) -> bool:
+    """Shrink one output of a cell in place; return True when it changed."""
+    changed = False
+    if "text" in output and options["max_text"]:
+        text = truncate_output(joined(output["text"]), options["max_text"])
+        if text is not None:
+            output["text"] = split_lines(text)
+            report["truncated"] += 1
+            changed = True
+    data = cast(dict[str, object], output.get("data") or {})
+    links = image_links(data, notebook_dir, options)
+    if links:
+        data["text/markdown"] = split_lines("\n".join(links))
+        report["images"] += len(links)
+        changed = True
+    html = data.get("text/html")
+    # a DataFrame keeps its text/plain repr when its HTML table goes
+    if html is not None and "text/plain" in data:
+        if len(joined(html).encode()) > options["max_html"]:
+            del data["text/html"]
+            report["html"] += 1
+            changed = True
+    if "text/plain" in data and options["max_text"]:
+        text = truncate_output(joined(data["text/plain"]), options["max_text"])
+        if text is not None:
+            data["text/plain"] = split_lines(text)
+            report["truncated"] += 1
+            changed = True
+    return changed
+
+
+def has_shrunk(
+    cell: NotebookCell, notebook_dir: str, options: StripOptions, report: StripReport
+) -> bool:
+    """Shrink the outputs of one cell in place; return True when it changed."""
+    outputs = cast(list[dict[str, object]], cell.get("outputs") or [])
+    if options["clear"]:
+        if not outputs and cell.get("execution_count") is None:
+            return False
+        cell["outputs"] = []
+        cell["execution_count"] = None
+        return True
+    changed = False
+    for output in outputs:
+        changed = has_output_shrunk(output, notebook_dir, options, report) or changed
+    return changed
+
+
+def nested_json(value: object, indent: str) -> str:
+    """Dump a value as nbformat does, for a place indent deep in the file."""
+    text = json.dumps(value, indent=1, sort_keys=True, ensure_ascii=False)
+    return text.replace("\n", "\n" + indent)
+
+
+def iter_notebook(stream: JsonStream) -> Iterator[tuple[str, object]]:
+    """Yield the top-level keys of a notebook with their values.
+
+    The value of "cells" is an iterator that decodes one cell at a time.
+    """
+    stream.expect("{")
+    while stream.peek() == '"':
+        key = cast(str, stream.value())
+        stream.expect(":")
+        if key == "cells":
+            yield key, iter_cells(stream)
+        else:
+            yield key, stream.value()
+        if stream.peek() == ",":
+            stream.expect(",")
+    stream.expect("}")
+
+
+def iter_cells(stream: JsonStream) -> Iterator[NotebookCell]:
+    """Yield the cells of the array the stream is at, consuming it."""
+    for cell in stream.array_values():
+        yield cast(NotebookCell, cell)
+
+
+def write_notebook(
+    source: TextIO,
+    write: Callable[[str], object],
+    strip: Callable[[NotebookCell], bool],
+) -> int:
+    """Copy a notebook cell by cell, in the layout nbformat writes.
+
+    Returns how many cells strip changed.
+    """
+    changed = 0
+    separator = "{\n"
+    for key, value in iter_notebook(JsonStream(source)):
+        write(f"{separator} {json.dumps(key, ensure_ascii=False)}: ")
+        separator = ",\n"
+        if key != "cells":
+            write(nested_json(value, " "))
+            continue
+        opening = "["
+        for cell in cast(Iterator[NotebookCell], value):
+            changed += strip(cell)
+            write(f"{opening}\n  {nested_json(cell, '  ')}")
+            opening = ","
+        write("[]" if opening == "[" else "\n ]")
+    write("{}\n" if separator == "{\n" else "\n}\n")
+    return changed
+
+
+def strip_notebook(path: str, options: StripOptions) -> StripReport:
+    """Strip one notebook, rewriting it only when something changed."""
+    report: StripReport = {
+        "path": path,
+        "before": 0,
+        "after": 0,
+        "images": 0,
+        "html": 0,
+        "truncated": 0,
+        "error": "",
+    }
+    notebook_dir = os.path.dirname(os.path.abspath(path))
+    after = 0
+    changed = False
+
+    def has_output_shrunks(cell: NotebookCell) -> bool:
+        return has_shrunk(cell, notebook_dir, options, report)
+
+    try:
+        report["before"] = os.path.getsize(path)
+        if options["check"]:
+            fd, temp_path = os.open(os.devnull, os.O_WRONLY), ""
+        else:
+            fd, temp_path = temp_file(path)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as target:
+
+                def write(text: str) -> None:
+                    nonlocal after
+                    after += len(text.encode())
+                    target.write(text)
+
+                with open(path, encoding="utf-8") as source:
+                    changed = write_notebook(source, write, has_output_shrunks) > 0
+                if changed and temp_path:
+                    target.flush()
+                    os.fsync(target.fileno())
+        finally:
+            if temp_path:
+                replace_file(temp_path, path, changed)
+    except (OSError, ValueError) as error:
+        report["error"] = f"{type(error).__name__}: {error}"
+        return report
+    report["after"] = after if changed else report["before"]
+    return report
+
+
+def collect_paths(targets: list[str]) -> list[str]:
+    """Return the notebooks given, with directories expanded like DIRECTORY.md."""
+    notebooks: list[str] = []
+    for path in targets:
+        if os.path.isdir(path):
+            notebooks += sorted(notebook_paths(path))
+        else:
+            notebooks.append(path)
+    return notebooks
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Strip the notebooks given on the command line and report bytes saved."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", default=["."], help="notebooks or trees")
+    parser.add_argument(
+        "--assets", default=ASSETS_DIR, help="where images go, named by their hash"
+    )
+    parser.add_argument(
+        "--max-html",
+        type=int,
+        default=DEFAULT_MAX_HTML,
+        help="drop larger HTML outputs that have a plain-text version",
+    )
+    parser.add_argument(
+        "--max-text",
+        type=int,
+        default=DEFAULT_MAX_TEXT,
+        help="cut longer printed output; 0 keeps it whole",
+    )
+    parser.add_argument(
+        "--clear", action="store_true", help="remove every output and execution count"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only report, and exit 1 when a notebook would shrink",
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="processes")
+    args = parser.parse_args(argv)
+    options: StripOptions = {
+        "assets_dir": os.path.abspath(args.assets),
+        "max_html": args.max_html,
+        "max_text": args.max_text,
+        "clear": args.clear,
+        "check": args.check,
+    }
+    start = time.perf_counter()
+    notebooks = collect_paths(args.paths)
+    with ProcessPoolExecutor(args.jobs) as pool:
+        reports = list(pool.map(strip_notebook, notebooks, [options] * len(notebooks)))
+    elapsed = (time.perf_counter() - start) * 1000
+    saved = 0
+    for report in reports:
+        if report["error"]:
+            print(f"failed {report['path']}: {report['error']}", file=sys.stderr)
+            continue
+        if report["after"] == report["before"]:
+            continue
+        saved += report["before"] - report["after"]
+        print(
+            f"{report['before'] - report['after']:>10,} B saved"
+            f"  {report['before']:>10,} -> {report['after']:>10,}"
+            f"  {report['images']} images, {report['html']} HTML,"
+            f" {report['truncated']} cut  {report['path']}"
+        )
+    print(
+        f"{len(reports)} notebooks, {saved:,} bytes saved in {elapsed:.0f} ms",
+        file=sys.stderr,
+    )
+    if any(report["error"] for report in reports) or args.check and saved:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
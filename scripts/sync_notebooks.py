@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Sync paired .ipynb and .py:light files, converting only the pairs that changed."""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import TypedDict, cast
+
+from build_directory_md import RACY_WINDOW_NS, atomic_write, child_path, list_directory
+from ignore_rules import read_ignore_rules
+
+try:
+    from jupytext.cli import jupytext
+except ImportError:  # pairs are still listed and recorded without it
+    jupytext = None
+
+
+SYNC_MANIFEST_PATH = ".notebook_sync_manifest.json"
+SYNC_MANIFEST_VERSION = 1
+PAIRED_SUFFIX = ".py"
+
+# [mtime_ns, size, sha256] of one side of a pair, None when the file is missing
+FileState = list[int | str] | None
+
+
+class SyncManifest(TypedDict):
+    """Last synced state of every notebook and its paired script."""
+
+    version: int
+    pairs: dict[str, list[FileState]]
+
+
+def paired_path(notebook_path: str) -> str:
+    """Return the py:light file paired with a notebook.
+
+    >>> paired_path("python/makarov/chapter_1_variables.ipynb")
+    'python/makarov/chapter_1_variables.py'
+    """
+    return os.path.splitext(notebook_path)[0] + PAIRED_SUFFIX
+
+
+def file_digest(path: str) -> str:
+    """Return the sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path: str, old: FileState, trusted_before: int) -> FileState:
+    """Return the state of path, hashing it only when its stat moved.
+
+    A file written within RACY_WINDOW_NS of the scan is stored with mtime
+    -1, so the next run hashes it again instead of trusting the stat.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if old and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+        return old
+    digest = file_digest(path)
+    mtime_ns = stat.st_mtime_ns if stat.st_mtime_ns < trusted_before else -1
+    return [mtime_ns, stat.st_size, digest]
+
+
+def has_same_content(old: FileState, new: FileState) -> bool:
+    """Return True when both states describe the same bytes, or no file."""
+    if old is new:
+        return True
+    if old is None or new is None:
+        return old is new
+    return old[1:] == new[1:]
+
+
+def read_sync_manifest(manifest_path: str) -> SyncManifest:
+    """Read the manifest, starting from scratch when it is missing or stale."""
+    try:
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = cast(SyncManifest, json.load(file))
+    except (OSError, ValueError):
+        manifest = {"version": 0, "pairs": {}}
+    version = manifest.get("version") if isinstance(manifest, dict) else None
+    if version != SYNC_MANIFEST_VERSION:
+        return {"version": SYNC_MANIFEST_VERSION, "pairs": {}}
+    return manifest
+
+
+def notebook_paths(top_dir: str) -> Iterator[str]:
+    """Yield the notebooks under top_dir, with the same exclusions as DIRECTORY.md.
+
+    The walk is unsorted and reuses the scandir listing of build_directory_md,
+    which tells files from directories without a stat per entry.
+    """
+    rules = read_ignore_rules(top_dir)
+    stack = [(top_dir, "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        subdirs, files = list_directory(dir_path, rules, rel_dir)
+        prefix = os.path.join(dir_path, "")
+        for name in files:
+            if name.endswith(".ipynb"):
+                yield prefix + name
+        stack += ((prefix + name, child_path(rel_dir, name)) for name in subdirs)
+
+
+def sync_pair(source_path: str) -> str:
+    """Run jupytext --sync from the side of a pair that changed.
+
+    jupytext reads the pairing and metadata filters from pyproject.toml, as
+    the pre-commit hook does. Returns an error message, "" on success.
+    """
+    if jupytext is None:
+        return "jupytext is not installed"
+    try:
+        jupytext(["--sync", "--quiet", source_path])
+    # jupytext reports a bad pair or format with ValueError, a file it
+    # cannot read or that changed under it with OSError, and a bad
+    # command line with SystemExit, which would end the pool worker
+    except (OSError, ValueError, KeyError, RuntimeError, SystemExit) as error:
+        return f"{type(error).__name__}: {error}"
+    return ""
+
+
+def sync_source(notebook: str, old: list[FileState], states: list[FileState]) -> str:
+    """Return the side of a changed pair to sync from: like jupytext, the newer one."""
+    notebook_changed = not has_same_content(old[0], states[0])
+    script_changed = states[1] is not None and not has_same_content(old[1], states[1])
+    if script_changed and notebook_changed:
+        script = paired_path(notebook)
+        return (
+            script
+            if os.path.getmtime(script) > os.path.getmtime(notebook)
+            else notebook
+        )
+    return paired_path(notebook) if script_changed else notebook
+
+
+def scan_pairs(
+    top_dir: str,
+    old_pairs: dict[str, list[FileState]],
+    trusted_before: int,
+    assume_synced: bool,
+) -> tuple[dict[str, list[FileState]], dict[str, str]]:
+    """Return the state of every pair and the sources of the changed ones."""
+    pairs: dict[str, list[FileState]] = {}
+    sources: dict[str, str] = {}
+    for notebook in notebook_paths(top_dir):
+        old = old_pairs.get(notebook) or [None, None]
+        states = [
+            file_state(notebook, old[0], trusted_before),
+            file_state(paired_path(notebook), old[1], trusted_before),
+        ]
+        pairs[notebook] = states
+        unchanged = old[0] is not None and all(map(has_same_content, old, states))
+        if not (assume_synced or unchanged):
+            sources[notebook] = sync_source(notebook, old, states)
+    return pairs, sources
+
+
+def convert_pairs(
+    sources: dict[str, str],
+    pairs: dict[str, list[FileState]],
+    trusted_before: int,
+    max_workers: int | None,
+) -> tuple[list[str], list[str]]:
+    """Sync the pairs from their sources on a process pool, updating pairs.
+
+    Returns the synced sources and the failures.
+    """
+    synced: list[str] = []
+    failures: list[str] = []
+    with ProcessPoolExecutor(max_workers) as pool:
+        for (notebook, source), error in zip(
+            sources.items(), pool.map(sync_pair, sources.values())
+        ):
+            if error:
+                failures.append(f"{source}: {error}")
+                del pairs[notebook]  # retried on the next run
+                continue
+            synced.append(source)
+            pairs[notebook] = [
+                file_state(notebook, None, trusted_before),
+                file_state(paired_path(notebook), None, trusted_before),
+            ]
+    return synced, failures
+
+
+def sync_notebooks(
+    top_dir: str = ".",
+    manifest_path: str = SYNC_MANIFEST_PATH,
+    max_workers: int | None = None,
+    assume_synced: bool = False,
+) -> tuple[int, list[str], list[str]]:
+    """Bring every notebook pair under top_dir in sync.
+
+    Pairs whose files still have the stat recorded in the manifest are
+    skipped without reading them; the others are hashed, and only those
+    whose content changed since the last sync are converted, on a process
+    pool. With assume_synced the current files are recorded as they are.
+
+    Returns the number of pairs, the synced sources and the failures.
+    """
+    old_pairs = read_sync_manifest(manifest_path)["pairs"]
+    trusted_before = time.time_ns() - RACY_WINDOW_NS
+    pairs, sources = scan_pairs(top_dir, old_pairs, trusted_before, assume_synced)
+    n_pairs = len(pairs)
+    synced: list[str] = []
+    failures: list[str] = []
+    if sources:
+        synced, failures = convert_pairs(sources, pairs, trusted_before, max_workers)
+    if pairs != old_pairs:
+        manifest: SyncManifest = {"version": SYNC_MANIFEST_VERSION, "pairs": pairs}
+        data = json.dumps(manifest, separators=(",", ":")).encode()
+        atomic_write(manifest_path, data)
+    return n_pairs, synced, failures
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Sync the notebook pairs of the tree given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("top_dir", nargs="?", default=".")
+    parser.add_argument("--manifest", default=SYNC_MANIFEST_PATH)
+    parser.add_argument("-j", "--jobs", type=int, help="conversion processes")
+    parser.add_argument(
+        "--assume-synced",
+        action="store_true",
+        help="record the current files as in sync without converting anything",
+    )
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    n_pairs, synced, failures = sync_notebooks(
+        args.top_dir, args.manifest, args.jobs, args.assume_synced
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    for source in synced:
+        print(f"synced {source}", file=sys.stderr)
+    for failure in failures:
+        print(f"failed {failure}", file=sys.stderr)
+    print(f"{n_pairs} pairs, {len(synced)} synced in {elapsed:.0f} ms", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()